@@ -3,10 +3,11 @@
 Telegram бот для анонимной обратной связи
 """
 
+import asyncio
 import logging
 import sys
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
 
 # Добавляем путь для импортов
@@ -23,6 +24,7 @@ from telegram.ext import (
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
     filters,
     ContextTypes,
 )
@@ -30,6 +32,11 @@ from telegram.error import NetworkError
 
 from config import config
 from database import Database
+from services.update_dedup import UpdateDeduplicator
+from services.export_service import ExportService
+from services.adaptive_request import AdaptiveRequest
+from services.notification_service import NotificationService
+from services.segment_index import SegmentError
 
 # ==================== ИМПОРТЫ ДЛЯ МОДУЛЕЙ ====================
 
@@ -83,7 +90,15 @@ SELECTING_CATEGORY, WAITING_MESSAGE = range(2)
 
 class FeedbackBot:
     def __init__(self):
-        self.application = Application.builder().token(config.BOT_TOKEN).build()
+        # Запросы к Bot API идут через адаптивный лимит одновременных запросов
+        self.request = AdaptiveRequest()
+        self.application = Application.builder().token(config.BOT_TOKEN).request(self.request).build()
+        
+        # Защита от повторной обработки апдейтов (рестарты, повторная доставка вебхука)
+        self.deduplicator = UpdateDeduplicator(db, config.UPDATE_DEDUP_CAPACITY)
+        
+        # Уведомления по задачам (дайджест)
+        self.notifications = NotificationService(self.application.bot, db)
         
         # Инициализируем сервис упоминаний
         if MENTION_SERVICE_AVAILABLE:
@@ -94,10 +109,95 @@ class FeedbackBot:
             logger.warning("⚠️ Сервис упоминаний недоступен, используется заглушка")
         
         self.setup_handlers()
+        self.setup_jobs()
+    
+    def setup_jobs(self):
+        """Настройка фоновых задач JobQueue"""
+        job_queue = self.application.job_queue
+        
+        if job_queue is None:
+            logger.warning("⚠️ JobQueue недоступна, фоновые задачи отключены")
+            return
+        
+        # Пакетная запись активности пользователей
+        job_queue.run_repeating(
+            db.activity.flush_job,
+            interval=config.ACTIVITY_FLUSH_INTERVAL,
+            first=config.ACTIVITY_FLUSH_INTERVAL,
+            name='activity_flush'
+        )
+        
+        # Пакетная запись обработанных update_id
+        job_queue.run_repeating(
+            self.deduplicator.flush_job,
+            interval=config.UPDATE_DEDUP_FLUSH_INTERVAL,
+            first=config.UPDATE_DEDUP_FLUSH_INTERVAL,
+            name='update_dedup_flush'
+        )
+        
+        # Оповещения о просрочке задач точно в момент дедлайна
+        db.deadlines.start(job_queue)
+        
+        # Эскалация неотвеченных обращений по порогам RESPONSE_TIME_LIMIT
+        db.sla.start(job_queue)
+        
+        # Доставка сообщений из outbox (в том числе накопленных до перезапуска)
+        db.outbox.start(job_queue)
+        
+        # Сегменты рассылок догоняют журнал изменений; прочитанные всеми
+        # потребителями события удаляются
+        job_queue.run_repeating(
+            db.segments.sync_job,
+            interval=config.CHANGE_FEED_INTERVAL,
+            first=config.CHANGE_FEED_INTERVAL,
+            name='segment_index_sync'
+        )
+        job_queue.run_repeating(
+            db.segments.feed.prune_job,
+            interval=config.CHANGE_LOG_PRUNE_INTERVAL,
+            first=config.CHANGE_LOG_PRUNE_INTERVAL,
+            name='change_log_prune'
+        )
+        
+        # Незавершенные рассылки продолжаются с контрольной точки
+        job_queue.run_once(db.broadcasts.resume, when=0, name='broadcast_resume')
+        
+        # Задачи по расписанию хранятся в БД и переживают перезапуск
+        db.job_store.attach(
+            job_queue,
+            self.notifications.prerender_daily_digest,
+            self.notifications.send_daily_digest
+        )
+        
+        # Ежедневный дайджест задач: подготовка заранее, отправка в DIGEST_TIME
+        digest_time = datetime.strptime(config.DIGEST_TIME, '%H:%M')
+        local_tz = datetime.now().astimezone().tzinfo
+        job_queue.run_daily(
+            self.notifications.prerender_daily_digest,
+            time=(digest_time - timedelta(minutes=config.DIGEST_PRERENDER_MINUTES)).time().replace(tzinfo=local_tz),
+            name='daily_digest_prerender',
+            job_kwargs=db.job_store.job_kwargs('daily_digest_prerender')
+        )
+        job_queue.run_daily(
+            self.notifications.send_daily_digest,
+            time=digest_time.time().replace(tzinfo=local_tz),
+            name='daily_digest',
+            job_kwargs=db.job_store.job_kwargs('daily_digest')
+        )
     
     def setup_handlers(self):
         """Настройка обработчиков команд"""
         
+        # Отсев повторных апдейтов до всех остальных обработчиков; отметка
+        # об обработке - после них, упавшие апдейты не отмечаются
+        self.application.add_handler(
+            TypeHandler(Update, self.deduplicator.check_update), group=-1
+        )
+        self.application.add_handler(
+            TypeHandler(Update, self.deduplicator.mark_update), group=UpdateDeduplicator.MARK_GROUP
+        )
+        self.application.add_error_handler(self.deduplicator.on_error)
+        
         # ОСНОВНЫЕ КОМАНДЫ (работают везде)
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("help", self.help))
@@ -124,12 +224,24 @@ class FeedbackBot:
         self.application.add_handler(
             CommandHandler("stats", self.stats, filters.ChatType.PRIVATE)
         )
+        self.application.add_handler(
+            CommandHandler("adminstats", self.admin_stats, filters.ChatType.PRIVATE)
+        )
         self.application.add_handler(
             CommandHandler("broadcast", self.broadcast, filters.ChatType.PRIVATE)
         )
+        self.application.add_handler(
+            CommandHandler("segment", self.segment, filters.ChatType.PRIVATE)
+        )
+        self.application.add_handler(
+            CommandHandler("apistats", self.api_stats, filters.ChatType.PRIVATE)
+        )
         self.application.add_handler(
             CommandHandler("reply", self.admin_reply, filters.ChatType.PRIVATE)
         )
+        self.application.add_handler(
+            CommandHandler("export", self.export, filters.ChatType.PRIVATE)
+        )
         
         # КОМАНДЫ ДЛЯ ГРУПП
         self.application.add_handler(
@@ -518,7 +630,7 @@ class FeedbackBot:
         """Упомянуть всех зарегистрированных (только для админов)"""
         user = update.effective_user
         
-        if user.id not in config.ADMIN_IDS:
+        if not config.is_admin(user.id):
             await update.message.reply_text("⛔ Только для администраторов")
             return
         
@@ -655,7 +767,8 @@ class FeedbackBot:
                 user.id,
                 message_text,
                 category,
-                config.ENABLE_ANONYMITY
+                config.ENABLE_ANONYMITY,
+                self.admin_notification(user, message_text, category)
             )
             message_id = result['message_id']
         except Exception as e:
@@ -666,16 +779,12 @@ class FeedbackBot:
             )
             return ConversationHandler.END
         
-        # Уведомление администраторов
-        if config.ENABLE_ADMIN_NOTIFICATIONS:
-            await self.notify_admins(context, message_id, user, message_text, category)
-        
         # Ответ пользователю
         await update.message.reply_text(
             config.THANK_YOU_MESSAGE + f"\n\n"
             f"📝 Номер обращения: #{message_id}\n"
             f"📁 Категория: {self.get_category_name(category)}\n"
-            f"⏳ Среднее время ответа: {config.RESPONSE_TIME_LIMIT} часов\n\n"
+            f"{self.get_queue_status(message_id) or ''}\n\n"
             f"Проверить статус: /my"
         )
         
@@ -704,58 +813,49 @@ class FeedbackBot:
                 user.id,
                 update.message.text,
                 'general',
-                config.ENABLE_ANONYMITY
+                config.ENABLE_ANONYMITY,
+                self.admin_notification(user, update.message.text, 'general')
             )
             message_id = result['message_id']
         except Exception as e:
             logger.error(f"Ошибка: {e}")
             return
         
-        # Уведомляем админов
-        if config.ENABLE_ADMIN_NOTIFICATIONS:
-            await self.notify_admins(
-                context, 
-                message_id, 
-                user, 
-                update.message.text, 
-                'general'
-            )
-        
         await update.message.reply_text(
             f"✅ Сообщение отправлено! Номер: #{message_id}\n"
+            f"{self.get_queue_status(message_id) or ''}\n"
             f"Используйте /my для отслеживания статуса."
         )
     
-    async def notify_admins(self, context, message_id, user, text, category):
-        """Уведомить администраторов о новом сообщении"""
+    def admin_notification(self, user, text, category):
+        """Шаблон уведомления администраторам о новом сообщении (None, если уведомления выключены)
+        
+        Возвращает функцию от номера обращения: текст собирается в транзакции
+        add_message и уходит через outbox.
+        """
+        if not config.ENABLE_ADMIN_NOTIFICATIONS:
+            return None
+        
         category_name = self.get_category_name(category)
+        received_at = datetime.now().strftime('%d.%m.%Y %H:%M')
         
-        message = (
+        return lambda message_id: (
             f"📨 Новое обращение #{message_id}\n"
             f"📁 Категория: {category_name}\n"
             f"👤 От: {user.first_name or 'Пользователь'}"
             f"{' (@' + user.username + ')' if user.username else ''}\n"
             f"🆔 ID: {user.id}\n"
-            f"🕒 Время: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"🕒 Время: {received_at}\n\n"
             f"💬 Сообщение:\n{text[:500]}"
             f"{'...' if len(text) > 500 else ''}\n\n"
             f"📎 Для ответа используйте: /reply {message_id} ваш ответ"
         )
-        
-        for admin_id in config.ADMIN_IDS:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=message
-                )
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление админу {admin_id}: {e}")
     
     async def admin_reply(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Ответ администратора на сообщение"""
         user = update.effective_user
         
-        if user.id not in config.ADMIN_IDS:
+        if not config.is_admin(user.id):
             await update.message.reply_text("⛔ Доступ запрещен.")
             return
         
@@ -781,29 +881,24 @@ class FeedbackBot:
                 await update.message.reply_text("❌ Сообщение не найдено!")
                 return
             
-            # Добавляем ответ в БД
-            success = db.add_reply(message_id, user.id, reply_text)
+            # Добавляем ответ в БД; доставка пользователю - через outbox той же транзакцией
+            success = db.add_reply(
+                message_id,
+                user.id,
+                reply_text,
+                notification=f"📬 Ответ на ваше обращение #{message_id}\n\n"
+                             f"{reply_text}\n\n"
+                             f"💬 Чтобы ответить, просто напишите новое сообщение."
+            )
             
             if not success:
                 await update.message.reply_text("❌ Ошибка при сохранении ответа!")
                 return
             
-            # Получаем ID пользователя для отправки ответа
-            cursor.execute('''
-                SELECT telegram_id FROM users WHERE id = ?
-            ''', (result['user_id'],))
-            user_result = cursor.fetchone()
-            
-            if user_result:
-                # Отправляем ответ пользователю
-                await context.bot.send_message(
-                    chat_id=user_result['telegram_id'],
-                    text=f"📬 Ответ на ваше обращение #{message_id}\n\n"
-                         f"{reply_text}\n\n"
-                         f"💬 Чтобы ответить, просто напишите новое сообщение."
-                )
-            
-            await update.message.reply_text(f"✅ Ответ на обращение #{message_id} отправлен!")
+            # Доставка асинхронная (outbox и очередь исходящих) - подтверждаем только постановку
+            await update.message.reply_text(
+                f"✅ Ответ на обращение #{message_id} сохранен и поставлен в очередь на отправку."
+            )
             
         except ValueError:
             await update.message.reply_text("❌ Неверный формат номера сообщения!")
@@ -838,6 +933,10 @@ class FeedbackBot:
             
             if msg['reply_text']:
                 response += f"📬 Ответ: {msg['reply_text'][:50]}...\n"
+            elif msg['status'] == 'new':
+                queue_status = self.get_queue_status(msg['id'])
+                if queue_status:
+                    response += queue_status + "\n"
             
             response += "─" * 30 + "\n"
         
@@ -850,7 +949,7 @@ class FeedbackBot:
         """Панель администратора"""
         user = update.effective_user
         
-        if user.id not in config.ADMIN_IDS:
+        if not config.is_admin(user.id):
             await update.message.reply_text("⛔ Доступ запрещен.")
             return
         
@@ -889,7 +988,7 @@ class FeedbackBot:
         """Показать статистику"""
         user = update.effective_user
         
-        if user.id not in config.ADMIN_IDS:
+        if not config.is_admin(user.id):
             await update.message.reply_text("⛔ Доступ запрещен.")
             return
         
@@ -914,25 +1013,186 @@ class FeedbackBot:
         
         await update.message.reply_text(response)
     
+    async def admin_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показатели администраторов: ответы, время ответа, задачи"""
+        user = update.effective_user
+        
+        if not config.is_admin(user.id):
+            await update.message.reply_text("⛔ Доступ запрещен.")
+            return
+        
+        stats = db.admin_stats.get_all()
+        
+        if not stats:
+            await update.message.reply_text("📭 Статистики администраторов пока нет.")
+            return
+        
+        def minutes(value):
+            return f"{value:.0f} мин" if value is not None else "—"
+        
+        response = "👑 Показатели администраторов\n\n"
+        for item in stats:
+            name = f"@{item['username']}" if item['username'] else str(item['admin_id'])
+            response += (
+                f"{name}\n"
+                f"  ✉️ Ответов: {item['reply_count']}\n"
+                f"  ⏱️ Медиана: {minutes(item['median_response_time'])}, "
+                f"p95: {minutes(item['p95_response_time'])}, "
+                f"среднее: {minutes(item['avg_response_time'])}\n"
+                f"  📋 Задач в работе: {item['open_tasks']}, завершено: {item['completed_tasks']}\n\n"
+            )
+        
+        await update.message.reply_text(response)
+    
+    async def segment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Размер сегмента пользователей или список атрибутов"""
+        user = update.effective_user
+        
+        if not config.is_admin(user.id):
+            await update.message.reply_text("⛔ Доступ запрещен.")
+            return
+        
+        if not context.args:
+            await update.message.reply_text(
+                "🎯 Атрибуты сегментов (размер)\n\n" + "\n".join(db.segments.describe()) +
+                "\n\nОператоры: & (и), | (или), - (кроме), ! (не), скобки\n"
+                "Пример: /segment active:30&cat:bug&!replied"
+            )
+            return
+        
+        expression = ''.join(context.args)
+        try:
+            audience = db.broadcasts.audience(expression)
+        except SegmentError as e:
+            await update.message.reply_text(f"❌ Ошибка в сегменте: {e}")
+            return
+        
+        await update.message.reply_text(f"🎯 Сегмент {expression}: {len(audience)} получателей")
+    
+    async def api_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Лимит одновременных запросов к Bot API и события снижения"""
+        user = update.effective_user
+        
+        if not config.is_admin(user.id):
+            await update.message.reply_text("⛔ Доступ запрещен.")
+            return
+        
+        metrics = self.request.limiter.metrics()
+        latency = f"{metrics['latency']:.2f} с" if metrics['latency'] is not None else "нет данных"
+        response = (
+            "📡 Bot API\n\n"
+            f"Лимит одновременных запросов: {metrics['limit']} "
+            f"({config.API_CONCURRENCY_MIN}-{config.API_CONCURRENCY_MAX})\n"
+            f"В полете: {metrics['in_flight']} (пик {metrics['peak_in_flight']}), ждут: {metrics['waiting']}\n"
+            f"Задержка (сглаженная): {latency}\n"
+            f"Очередь исходящих: {db.outbound.pending_count()}\n\n"
+            f"Запросов: {metrics['requests']}, успешно: {metrics['success']}\n"
+            f"RetryAfter: {metrics['retry_after']}, 5xx: {metrics['server_error']}, таймауты: {metrics['timeout']}, "
+            f"прочие ошибки: {metrics['error']}\n"
+            f"Снижений лимита: {metrics['decreases']}"
+        )
+        
+        if metrics['events']:
+            response += "\n\nПоследние снижения:\n" + "\n".join(
+                f"• {moment.strftime('%d.%m %H:%M:%S')} {reason} → {int(limit)}"
+                for moment, reason, limit in metrics['events'][-5:]
+            )
+        
+        await update.message.reply_text(response)
+    
     async def broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Рассылка сообщения"""
         user = update.effective_user
         
-        if user.id not in config.ADMIN_IDS:
+        if not config.is_admin(user.id):
             await update.message.reply_text("⛔ Доступ запрещен.")
             return
         
-        if not context.args:
-            await update.message.reply_text("Использование: /broadcast <текст рассылки>")
+        args = list(context.args)
+        segment = None
+        if args and args[0].startswith('segment='):
+            segment = args.pop(0).partition('=')[2]
+        
+        if not args:
+            await update.message.reply_text(
+                "Использование: /broadcast [segment=<выражение>] <текст рассылки>\n\n"
+                "Пример: /broadcast segment=active:30&cat:bug Исправили ошибку!\n"
+                "Атрибуты сегментов: /segment"
+            )
             return
         
-        broadcast_text = ' '.join(context.args)
-        await update.message.reply_text(
-            f"Рассылка начата...\n\nТекст: {broadcast_text[:100]}..."
+        broadcast_text = ' '.join(args)
+        try:
+            broadcast_id = db.broadcasts.create(broadcast_text, user.id, segment)
+        except SegmentError as e:
+            await update.message.reply_text(f"❌ Ошибка в сегменте: {e}")
+            return
+        
+        if broadcast_id is None:
+            await update.message.reply_text("❌ Не удалось создать рассылку.")
+            return
+        
+        # Прогресс показывается редактированием этого сообщения
+        status_message = await update.message.reply_text(
+            f"📢 Рассылка #{broadcast_id} начата...\n\nТекст: {broadcast_text[:100]}..."
+        )
+        db.broadcasts.set_status_message(broadcast_id, status_message.chat_id, status_message.message_id)
+        db.broadcasts.start(context.application, broadcast_id)
+    
+    async def export(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгрузка истории обращений документом"""
+        user = update.effective_user
+        
+        if not config.is_admin(user.id):
+            await update.message.reply_text("⛔ Доступ запрещен.")
+            return
+        
+        fmt = 'jsonl'
+        compress = False
+        filters_ = {}
+        
+        try:
+            for arg in context.args:
+                key, _, value = arg.partition('=')
+                if arg in ('jsonl', 'csv'):
+                    fmt = arg
+                elif arg in ('gz', 'gzip'):
+                    compress = True
+                elif key == 'from':
+                    filters_['date_from'] = datetime.strptime(value, '%Y-%m-%d').date()
+                elif key == 'to':
+                    filters_['date_to'] = datetime.strptime(value, '%Y-%m-%d').date()
+                elif key == 'category':
+                    filters_['category'] = value
+                else:
+                    raise ValueError(arg)
+        except ValueError:
+            await update.message.reply_text(
+                "Использование: /export [jsonl|csv] [gz] [from=ГГГГ-ММ-ДД] "
+                "[to=ГГГГ-ММ-ДД] [category=bug]\n\n"
+                "Пример: /export csv gz from=2024-01-01 category=bug"
+            )
+            return
+        
+        await update.message.reply_text("⏳ Готовлю выгрузку...")
+        
+        # Выгрузка идет в отдельном потоке, чтобы не блокировать обработку апдейтов
+        output, filename, count = await asyncio.to_thread(
+            ExportService(db).export_to_file, fmt, compress, **filters_
         )
         
-        # Здесь должна быть реализация рассылки
-        # Для этого нужно хранить всех пользователей в БД
+        try:
+            if count == 0:
+                await update.message.reply_text("📭 Нет обращений по заданным фильтрам.")
+                return
+            
+            await update.message.reply_document(
+                document=output,
+                filename=filename,
+                caption=f"📦 Выгрузка обращений: {count} строк"
+            )
+        finally:
+            output.close()
     
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Помощь"""
@@ -960,7 +1220,11 @@ class FeedbackBot:
                 "👑 Для администраторов:\n"
                 "• /admin - панель управления\n"
                 "• /stats - статистика\n"
-                "• /broadcast - рассылка\n"
+                "• /adminstats - показатели администраторов\n"
+                "• /broadcast - рассылка (всем или сегменту)\n"
+                "• /segment - сегменты пользователей для рассылок\n"
+                "• /apistats - нагрузка на Bot API\n"
+                "• /export - выгрузка обращений\n"
                 "• /reply - ответить на обращение\n\n"
                 "📜 Правила:\n"
                 "• /rules - правила использования бота\n\n"
@@ -1032,6 +1296,20 @@ class FeedbackBot:
         }
         return categories.get(category, 'Общее')
     
+    def get_queue_status(self, message_id: int) -> Optional[str]:
+        """Место обращения в очереди и ожидаемое время ответа"""
+        position, eta = db.reply_queue.estimate(message_id)
+        if position is None:
+            return None
+        
+        if eta is None:
+            expected = f"до {config.RESPONSE_TIME_LIMIT} ч"
+        elif eta < timedelta(hours=1):
+            expected = f"~{max(round(eta.total_seconds() / 60), 1)} мин"
+        else:
+            expected = f"~{eta.total_seconds() / 3600:.1f} ч"
+        return f"⏳ Вы #{position} в очереди, ожидаемый ответ: {expected}"
+    
     def check_spam_protection(self, user_id):
         """Проверка защиты от спама"""
         # Здесь можно реализовать проверку частоты сообщений
@@ -1099,6 +1377,7 @@ def main():
     """Основная функция"""
     bot = FeedbackBot()
     bot.run()
+    bot.deduplicator.flush()
     db.close()
 
 if __name__ == '__main__':
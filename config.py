@@ -22,6 +22,7 @@ class Config:
         for admin_id in os.getenv('ADMIN_IDS', '').split(',') 
         if admin_id.strip().isdigit()
     ]
+    ADMIN_ID_SET: frozenset = frozenset(ADMIN_IDS)
     
     # База данных
     DB_TYPE: str = os.getenv('DB_TYPE', 'sqlite').lower()
@@ -35,16 +36,62 @@ class Config:
     
     # Настройки бота
     RESPONSE_TIME_LIMIT: int = int(os.getenv('RESPONSE_TIME_LIMIT', '72'))
+    # Доли RESPONSE_TIME_LIMIT, при которых администраторам уходит эскалация
+    SLA_ESCALATION_THRESHOLDS: List[float] = sorted(
+        float(threshold.strip())
+        for threshold in os.getenv('SLA_ESCALATION_THRESHOLDS', '0.5,1.0').split(',')
+        if threshold.strip()
+    )
     MAX_MESSAGE_LENGTH: int = int(os.getenv('MAX_MESSAGE_LENGTH', '4000'))
     AUTO_DELETE_DAYS: int = int(os.getenv('AUTO_DELETE_DAYS', '90'))
+    UPDATE_DEDUP_CAPACITY: int = int(os.getenv('UPDATE_DEDUP_CAPACITY', '10000'))
+    UPDATE_DEDUP_FLUSH_INTERVAL: int = int(os.getenv('UPDATE_DEDUP_FLUSH_INTERVAL', '5'))  # сек
+    USER_CACHE_SIZE: int = int(os.getenv('USER_CACHE_SIZE', '10000'))
     
     # Логирование
     LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO').upper()
     ENABLE_ADMIN_NOTIFICATIONS: bool = os.getenv('ENABLE_ADMIN_NOTIFICATIONS', 'true').lower() == 'true'
     CHECK_INTERVAL: int = int(os.getenv('CHECK_INTERVAL', '300'))
+    ACTIVITY_FLUSH_INTERVAL: int = int(os.getenv('ACTIVITY_FLUSH_INTERVAL', '60'))
+    QUEUE_EWMA_ALPHA: float = float(os.getenv('QUEUE_EWMA_ALPHA', '0.2'))  # вес последнего ответа в темпе очереди
+    CHANGE_FEED_INTERVAL: int = int(os.getenv('CHANGE_FEED_INTERVAL', '30'))  # чтение журнала изменений, сек
+    CHANGE_LOG_PRUNE_INTERVAL: int = int(os.getenv('CHANGE_LOG_PRUNE_INTERVAL', '3600'))  # очистка журнала, сек
+    
+    # Ежедневный дайджест задач (локальное время ЧЧ:ММ) и лимиты исходящих сообщений
+    DIGEST_TIME: str = os.getenv('DIGEST_TIME', '09:00')
+    DIGEST_PRERENDER_MINUTES: int = int(os.getenv('DIGEST_PRERENDER_MINUTES', '10'))
+    NOTIFY_CONCURRENCY: int = int(os.getenv('NOTIFY_CONCURRENCY', '8'))  # воркеры очереди, не больше API_CONCURRENCY_MAX
+    NOTIFY_RATE: float = float(os.getenv('NOTIFY_RATE', '25'))  # сообщений в секунду
+    NOTIFY_CHAT_RATE: float = float(os.getenv('NOTIFY_CHAT_RATE', '1'))  # в секунду в один личный чат
+    NOTIFY_GROUP_RATE: float = float(os.getenv('NOTIFY_GROUP_RATE', '20'))  # в минуту в одну группу
+    NOTIFY_MAX_RETRIES: int = int(os.getenv('NOTIFY_MAX_RETRIES', '3'))  # повторов после RetryAfter
+    
+    # Outbox: пачка отправки, число попыток и экспоненциальная задержка повторов (сек)
+    OUTBOX_BATCH_SIZE: int = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+    OUTBOX_RETRY_BASE: float = float(os.getenv('OUTBOX_RETRY_BASE', '5'))
+    OUTBOX_RETRY_MAX: float = float(os.getenv('OUTBOX_RETRY_MAX', '3600'))
+    OUTBOX_FAILED_RETENTION_DAYS: int = int(os.getenv('OUTBOX_FAILED_RETENTION_DAYS', '30'))  # хранение недоставленных
+    
+    # Рассылки: размер страницы получателей и период обновления прогресса (сек)
+    BROADCAST_PAGE_SIZE: int = int(os.getenv('BROADCAST_PAGE_SIZE', '500'))
+    BROADCAST_PROGRESS_INTERVAL: float = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '5'))
+    
+    # Запросы к Bot API (AIMD): начальный, минимальный и максимальный лимит одновременных
+    # запросов и целевая задержка ответа (сек), выше которой лимит не растет
+    API_CONCURRENCY_INITIAL: int = int(os.getenv('API_CONCURRENCY_INITIAL', '16'))
+    API_CONCURRENCY_MIN: int = int(os.getenv('API_CONCURRENCY_MIN', '1'))
+    API_CONCURRENCY_MAX: int = int(os.getenv('API_CONCURRENCY_MAX', '64'))
+    API_LATENCY_TARGET: float = float(os.getenv('API_LATENCY_TARGET', '2'))
     
-    # Безопасность
-    ENCRYPTION_KEY: str = os.getenv('ENCRYPTION_KEY', 'default-encryption-key-32-chars')
+    # Постоянные задачи планировщика: задержка пакетной записи и допуск пропущенного запуска (сек)
+    JOB_STORE_FLUSH_DELAY: float = float(os.getenv('JOB_STORE_FLUSH_DELAY', '1'))
+    JOB_MISFIRE_GRACE_TIME: int = int(os.getenv('JOB_MISFIRE_GRACE_TIME', '3600'))
+    
+    # Безопасность (ключ по умолчанию общеизвестен: с ним шифрование не запускается)
+    DEFAULT_ENCRYPTION_KEY = 'default-encryption-key-32-chars'
+    ENCRYPTION_KEY: str = os.getenv('ENCRYPTION_KEY', DEFAULT_ENCRYPTION_KEY)
+    ENABLE_ENCRYPTION: bool = os.getenv('ENABLE_ENCRYPTION', 'true').lower() == 'true'
     ANTI_SPAM_ENABLED: bool = os.getenv('ANTI_SPAM_ENABLED', 'true').lower() == 'true'
     MESSAGES_PER_MINUTE: int = int(os.getenv('MESSAGES_PER_MINUTE', '5'))
     
@@ -73,6 +120,11 @@ class Config:
     WEBHOOK_URL: Optional[str] = os.getenv('WEBHOOK_URL')
     WEBHOOK_PORT: int = int(os.getenv('WEBHOOK_PORT', '8443'))
     
+    @classmethod
+    def is_admin(cls, user_id: int) -> bool:
+        """Проверить, что пользователь - администратор из конфига"""
+        return user_id in cls.ADMIN_ID_SET
+    
     @classmethod
     def validate(cls) -> bool:
         """Проверка обязательных настроек"""
@@ -87,6 +139,9 @@ class Config:
         if not cls.ENCRYPTION_KEY or len(cls.ENCRYPTION_KEY) < 32:
             errors.append("ENCRYPTION_KEY должен быть не менее 32 символов")
         
+        if cls.ENABLE_ENCRYPTION and cls.ENCRYPTION_KEY == cls.DEFAULT_ENCRYPTION_KEY:
+            errors.append("ENCRYPTION_KEY не задан: шифрование с ключом по умолчанию ничего не защищает")
+        
         if errors:
             print("❌ Ошибки конфигурации:")
             for error in errors:
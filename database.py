@@ -1,18 +1,57 @@
 import sqlite3
 import logging
 from datetime import datetime, timedelta
-from typing import List, Tuple, Optional, Dict, Any
+from typing import List, Tuple, Optional, Dict, Any, Callable
 from config import config
+from utils.crypto import ENCRYPTED_PREFIX, get_cipher
+from services.quote_engine import QuoteEngine
+from services.reference_cache import ReferenceCache
+from services.user_cache import UserCache
+from services.activity_tracker import ActivityTracker
+from services.admin_stats import AdminStats
+from services.workload_tracker import WorkloadTracker
+from services.deadline_scheduler import DeadlineScheduler
+from services.sla_monitor import SlaMonitor
+from services.job_store import SQLiteJobStore
+from services.reply_queue import ReplyQueue
+from services.outbound import OutboundScheduler, PRIORITY_REPLY
+from services.outbox import Outbox
+from services.broadcast_service import BroadcastService
+from services.segment_index import SegmentIndex
+from services.task_service import STATUS_ASSIGNMENTS, status_params
 
 logger = logging.getLogger(__name__)
 
 class Database:
     def __init__(self):
+        if config.ENABLE_ENCRYPTION and config.ENCRYPTION_KEY == config.DEFAULT_ENCRYPTION_KEY:
+            # Проверяется до открытия БД: иначе тексты успели бы зашифроваться
+            # общеизвестным ключом, а смена ключа потом сломала бы их чтение
+            raise ValueError("Шифрование включено, но ENCRYPTION_KEY не задан (используется ключ по умолчанию)")
         self.db_name = config.DB_NAME
         self.conn = sqlite3.connect(self.db_name, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        self.cipher = get_cipher(config.ENCRYPTION_KEY)
+        self.encrypt_at_rest = config.ENABLE_ENCRYPTION
+        self.reference_cache = ReferenceCache(self)
+        self.user_cache = UserCache(config.USER_CACHE_SIZE)
+        self.activity = ActivityTracker(self)
+        self.admin_stats = AdminStats(self)
         self.create_tables()
+        self.reference_cache.load()
+        self.encrypt_legacy_rows()
         self.clean_old_messages()
+        self.quote_engine = QuoteEngine(self)
+        self.workload = WorkloadTracker(self)
+        self.deadlines = DeadlineScheduler(self)
+        self.task_trackers = [self.workload, self.deadlines]
+        self.sla = SlaMonitor(self)
+        self.reply_queue = ReplyQueue(self)
+        self.outbound = OutboundScheduler()
+        self.outbox = Outbox(self)
+        self.broadcasts = BroadcastService(self)
+        self.segments = SegmentIndex(self)
+        self.job_store = SQLiteJobStore(self)
     
     def create_tables(self):
         """Создание таблиц в БД"""
@@ -42,6 +81,7 @@ class Database:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 text TEXT NOT NULL,
+                text_hash TEXT,
                 category TEXT DEFAULT 'general',
                 status TEXT DEFAULT 'new',
                 is_anonymous BOOLEAN DEFAULT 1,
@@ -49,6 +89,7 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 replied_at TIMESTAMP,
                 response_time INTEGER,
+                sla_level INTEGER DEFAULT 0,
                 FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
             )
         ''')
@@ -60,6 +101,7 @@ class Database:
                 message_id INTEGER NOT NULL,
                 admin_id INTEGER NOT NULL,
                 text TEXT NOT NULL,
+                text_hash TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
             )
@@ -118,6 +160,11 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 completed_at TIMESTAMP,
+                version INTEGER DEFAULT 1,
+                started_at TIMESTAMP,
+                status_changed_at TIMESTAMP,
+                overdue_notified_at TIMESTAMP,
+                is_overdue BOOLEAN DEFAULT 0,  -- учтена в teams.overdue_count
                 FOREIGN KEY (created_by) REFERENCES admins (id),
                 FOREIGN KEY (assigned_to) REFERENCES admins (id)
             )
@@ -131,6 +178,11 @@ class Database:
                 description TEXT,
                 leader_id INTEGER,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                member_count INTEGER DEFAULT 0,
+                open_new INTEGER DEFAULT 0,
+                open_in_progress INTEGER DEFAULT 0,
+                open_review INTEGER DEFAULT 0,
+                overdue_count INTEGER DEFAULT 0,
                 FOREIGN KEY (leader_id) REFERENCES admins (id)
             )
         ''')
@@ -143,6 +195,7 @@ class Database:
                 admin_id INTEGER NOT NULL,
                 role TEXT DEFAULT 'member',
                 joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                version INTEGER DEFAULT 1,
                 FOREIGN KEY (team_id) REFERENCES teams (id) ON DELETE CASCADE,
                 FOREIGN KEY (admin_id) REFERENCES admins (id) ON DELETE CASCADE,
                 UNIQUE(team_id, admin_id)
@@ -178,25 +231,290 @@ class Database:
             )
         ''')
         
+        # ==================== ЖУРНАЛ ИЗМЕНЕНИЙ (CDC) ====================
+        
+        # Журнал изменений (только добавление, заполняется триггерами)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                operation TEXT NOT NULL,
+                payload TEXT,  -- JSON с ключевыми полями строки
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Позиции потребителей журнала
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_cursors (
+                consumer TEXT PRIMARY KEY,
+                last_event_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Триггеры пишут в журнал только ключевые поля (тексты не попадают в журнал)
+        cdc_columns = {
+            'messages': ('user_id', 'category', 'status'),
+            'replies': ('message_id', 'admin_id'),
+            'tasks': ('created_by', 'assigned_to', 'priority', 'status', 'deadline'),
+            'team_members': ('team_id', 'admin_id', 'role'),
+        }
+        for table, columns in cdc_columns.items():
+            for operation, ref in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')):
+                payload = ', '.join(f"'{column}', {ref}.{column}" for column in columns)
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_cdc_{operation}
+                    AFTER {operation.upper()} ON {table}
+                    BEGIN
+                        INSERT INTO change_log (table_name, row_id, operation, payload)
+                        VALUES ('{table}', {ref}.id, '{operation}', json_object({payload}));
+                    END
+                ''')
+        
+        # ==================== АНАЛИТИКА АДМИНИСТРАТОРОВ ====================
+        
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'admin_stats'")
+        admin_stats_created = cursor.fetchone() is None
+        
+        # Накопительные показатели администратора (admin_id - Telegram ID)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS admin_stats (
+                admin_id INTEGER NOT NULL PRIMARY KEY,
+                reply_count INTEGER DEFAULT 0,
+                response_count INTEGER DEFAULT 0,  -- первые ответы на обращения
+                response_time_total INTEGER DEFAULT 0,  -- минуты
+                response_time_max INTEGER DEFAULT 0,
+                open_tasks INTEGER DEFAULT 0,
+                completed_tasks INTEGER DEFAULT 0,
+                last_reply_at TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Гистограмма времени первого ответа (корзины - services.admin_stats.RESPONSE_BUCKETS)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS admin_response_histogram (
+                admin_id INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (admin_id, bucket)
+            )
+        ''')
+        
+        # Бэклог и завершенные задачи ведутся триггерами в транзакции изменения задачи
+        open_sql = "{ref}.status IN ('new', 'in_progress', 'review')"
+        
+        def task_stats_delta(ref: str, sign: str, completed: str = '0') -> str:
+            return f'''
+                INSERT INTO admin_stats (admin_id, open_tasks, completed_tasks)
+                SELECT {ref}.assigned_to, MAX(0, {sign}({open_sql.format(ref=ref)})), {completed}
+                WHERE {ref}.assigned_to IS NOT NULL
+                ON CONFLICT(admin_id) DO UPDATE SET
+                    open_tasks = MAX(0, open_tasks {sign} ({open_sql.format(ref=ref)})),
+                    completed_tasks = completed_tasks + excluded.completed_tasks,
+                    updated_at = CURRENT_TIMESTAMP;
+            '''
+        
+        just_completed = "(NEW.status = 'completed' AND OLD.status IS NOT 'completed')"
+        admin_stats_triggers = {
+            'trg_tasks_admin_stats_insert': (
+                'AFTER INSERT ON tasks',
+                task_stats_delta('NEW', '+', "(NEW.status = 'completed')")
+            ),
+            'trg_tasks_admin_stats_update': (
+                'AFTER UPDATE OF status, assigned_to ON tasks',
+                task_stats_delta('OLD', '-') + task_stats_delta('NEW', '+', just_completed)
+            ),
+            'trg_tasks_admin_stats_delete': (
+                'AFTER DELETE ON tasks',
+                task_stats_delta('OLD', '-')
+            ),
+        }
+        for name, (event, body) in admin_stats_triggers.items():
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+        
+        # ==================== ИСТОРИЯ СТАТУСОВ ЗАДАЧ ====================
+        
+        # Переходы статусов (заполняется триггером при смене tasks.status)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_status_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id INTEGER NOT NULL,
+                from_status TEXT,
+                to_status TEXT NOT NULL,
+                assigned_to INTEGER,
+                entered_at TIMESTAMP,  -- когда задача перешла в from_status
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Агрегаты ведутся по областям: all (scope_id = 0), assignee (Telegram ID), team (teams.id)
+        
+        # Время в статусах
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_status_time (
+                scope TEXT NOT NULL,
+                scope_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                seconds_total REAL DEFAULT 0,
+                entries INTEGER DEFAULT 0,
+                PRIMARY KEY (scope, scope_id, status)
+            )
+        ''')
+        
+        # Lead time (создание -> завершение) и cycle time (начало работы -> завершение)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_flow_stats (
+                scope TEXT NOT NULL,
+                scope_id INTEGER NOT NULL,
+                completed_count INTEGER DEFAULT 0,
+                lead_seconds_total REAL DEFAULT 0,
+                cycle_count INTEGER DEFAULT 0,
+                cycle_seconds_total REAL DEFAULT 0,
+                PRIMARY KEY (scope, scope_id)
+            )
+        ''')
+        
+        # Завершенные задачи по неделям (week = ГГГГ-НН)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_throughput (
+                scope TEXT NOT NULL,
+                scope_id INTEGER NOT NULL,
+                week TEXT NOT NULL,
+                completed INTEGER DEFAULT 0,
+                PRIMARY KEY (scope, scope_id, week)
+            )
+        ''')
+        
+        # Задачи планировщика JobQueue (состояние APScheduler в pickle)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                id TEXT PRIMARY KEY,
+                next_run_time REAL,
+                job_state BLOB NOT NULL
+            )
+        ''')
+        
+        # Исходящие сообщения, ожидающие доставки (пишутся в транзакции изменения)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                parse_mode TEXT,
+                priority INTEGER DEFAULT 1,
+                status TEXT DEFAULT 'pending',  -- pending / failed
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Рассылки с контрольной точкой (last_user_id - последний обработанный users.id)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                created_by INTEGER NOT NULL,
+                segment TEXT,  -- выражение сегмента получателей (NULL - все)
+                status TEXT DEFAULT 'running',  -- running / completed / failed
+                total INTEGER DEFAULT 0,
+                last_user_id INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                status_chat_id INTEGER,
+                status_message_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        
+        # ==================== МИГРАЦИИ ====================
+        
+        # Слепой индекс для зашифрованных текстов (для БД, созданных до шифрования)
+        self._ensure_column('messages', 'text_hash', 'TEXT')
+        self._ensure_column('replies', 'text_hash', 'TEXT')
+        
+        # Версии строк для оптимистичных блокировок
+        self._ensure_column('tasks', 'version', 'INTEGER DEFAULT 1')
+        self._ensure_column('team_members', 'version', 'INTEGER DEFAULT 1')
+        
+        # Моменты начала работы и последней смены статуса
+        self._ensure_column('tasks', 'started_at', 'TIMESTAMP')
+        self._ensure_column('tasks', 'status_changed_at', 'TIMESTAMP')
+        
+        # Отметка об отправленном оповещении о просрочке
+        self._ensure_column('tasks', 'overdue_notified_at', 'TIMESTAMP')
+        
+        # Новый дедлайн или переоткрытие (закрытие) задачи - отметка снимается,
+        # чтобы о следующей просрочке снова сообщили
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_overdue_notified_reset
+            AFTER UPDATE OF status, deadline ON tasks
+            WHEN NEW.overdue_notified_at IS NOT NULL AND (
+                NEW.deadline IS NOT OLD.deadline
+                OR (OLD.status IN ('completed', 'cancelled')) IS NOT (NEW.status IN ('completed', 'cancelled'))
+            )
+            BEGIN
+                UPDATE tasks SET overdue_notified_at = NULL WHERE id = NEW.id;
+            END
+        ''')
+        
+        # Пройденные пороги SLA по обращению
+        self._ensure_column('messages', 'sla_level', 'INTEGER DEFAULT 0')
+        
+        # Пользователь заблокировал бота (пропускается в рассылках)
+        self._ensure_column('users', 'blocked_bot', 'BOOLEAN DEFAULT 0')
+        
+        # Сегмент получателей рассылки
+        self._ensure_column('broadcasts', 'segment', 'TEXT')
+        
+        # Денормализованные счетчики команд и учтенное в них состояние просрочки задачи
+        counters_added = self._ensure_column('tasks', 'is_overdue', 'BOOLEAN DEFAULT 0')
+        for column in self.TEAM_COUNTERS:
+            counters_added |= self._ensure_column('teams', column, 'INTEGER DEFAULT 0')
+        
+        # ==================== СЧЕТЧИКИ КОМАНД ====================
+        
+        self._create_team_counter_triggers()
+        self._create_task_history_triggers()
+        if counters_added:
+            self.recalculate_team_counters()
+        if admin_stats_created:
+            self.admin_stats.rebuild()
+        
         # ==================== ИНДЕКСЫ ====================
         
         # Индексы для основных таблиц
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_status ON messages(status)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_text_hash ON messages(text_hash)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_replies_text_hash ON replies(text_hash)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_telegram ON users(telegram_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users(last_activity)')
         # Индекс для таблицы упоминания
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_mentions_chat ON group_mentions(chat_id)')
         # Индексы для таблиц задач
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_assigned ON tasks(assigned_to)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks(status, created_at)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_priority ON tasks(priority)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_deadline ON tasks(deadline)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_status_history_task ON task_status_history(task_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_team_members_team ON team_members(team_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_team_members_admin ON team_members(admin_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_quotes_category ON quotes(category)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_read ON notifications(is_read)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_table ON change_log(table_name, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_next_run ON scheduled_jobs(next_run_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status)')
         
         self.conn.commit()
         logger.info("✅ Все таблицы БД созданы/проверены")
@@ -204,6 +522,299 @@ class Database:
         # Добавляем администраторов из конфига
         self.add_admins_from_config()
     
+    def _ensure_column(self, table: str, column: str, definition: str) -> bool:
+        """Добавить колонку в существующую таблицу, если её нет; True - если добавлена"""
+        cursor = self.conn.cursor()
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in {row['name'] for row in cursor.fetchall()}:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            logger.info(f"✅ Добавлена колонка {table}.{column}")
+            return True
+        return False
+    
+    # ==================== СЧЕТЧИКИ КОМАНД ====================
+    
+    TEAM_COUNTERS = ('member_count', 'open_new', 'open_in_progress', 'open_review', 'overdue_count')
+    
+    # Открытая задача с прошедшим дедлайном (дедлайны хранятся в локальном времени)
+    _OVERDUE_SQL = (
+        "{ref}.status NOT IN ('completed', 'cancelled') AND {ref}.deadline IS NOT NULL "
+        "AND {ref}.deadline < datetime('now', 'localtime')"
+    )
+    
+    def _task_counter_delta(self, ref: str, sign: str) -> str:
+        """UPDATE счетчиков всех команд исполнителя задачи {ref}
+
+        Снимается (OLD) ровно то, что было учтено - сохраненный is_overdue,
+        а добавляется (NEW) текущее состояние, которое тут же записывается
+        в is_overdue триггером trg_tasks_overdue_flag_*.
+        """
+        overdue = f'{ref}.is_overdue' if ref == 'OLD' else self._OVERDUE_SQL.format(ref=ref)
+        return f'''
+            UPDATE teams SET
+                open_new = MAX(0, open_new {sign} ({ref}.status = 'new')),
+                open_in_progress = MAX(0, open_in_progress {sign} ({ref}.status = 'in_progress')),
+                open_review = MAX(0, open_review {sign} ({ref}.status = 'review')),
+                overdue_count = MAX(0, overdue_count {sign} ({overdue}))
+            WHERE id IN (SELECT team_id FROM team_members WHERE admin_id = {ref}.assigned_to);
+        '''
+    
+    def _member_counter_delta(self, ref: str, sign: str) -> str:
+        """UPDATE счетчиков команды {ref}.team_id при входе/выходе участника"""
+        overdue = 't.is_overdue = 1'
+        return f'''
+            UPDATE teams SET
+                member_count = MAX(0, member_count {sign} 1),
+                open_new = MAX(0, open_new {sign} (
+                    SELECT COUNT(*) FROM tasks t WHERE t.assigned_to = {ref}.admin_id AND t.status = 'new')),
+                open_in_progress = MAX(0, open_in_progress {sign} (
+                    SELECT COUNT(*) FROM tasks t WHERE t.assigned_to = {ref}.admin_id AND t.status = 'in_progress')),
+                open_review = MAX(0, open_review {sign} (
+                    SELECT COUNT(*) FROM tasks t WHERE t.assigned_to = {ref}.admin_id AND t.status = 'review')),
+                overdue_count = MAX(0, overdue_count {sign} (
+                    SELECT COUNT(*) FROM tasks t WHERE t.assigned_to = {ref}.admin_id AND {overdue}))
+            WHERE id = {ref}.team_id;
+        '''
+    
+    def _create_team_counter_triggers(self):
+        """Триггеры, поддерживающие счетчики teams в той же транзакции, что и изменение"""
+        cursor = self.conn.cursor()
+        
+        overdue = self._OVERDUE_SQL.format(ref='NEW')
+        set_overdue_flag = f'UPDATE tasks SET is_overdue = ({overdue}) WHERE id = NEW.id;'
+        
+        triggers = {
+            'trg_tasks_overdue_flag_insert': ('AFTER INSERT ON tasks', set_overdue_flag),
+            'trg_tasks_overdue_flag_update': (
+                'AFTER UPDATE OF status, assigned_to, deadline ON tasks', set_overdue_flag
+            ),
+            'trg_tasks_team_counters_insert': (
+                'AFTER INSERT ON tasks WHEN NEW.assigned_to IS NOT NULL',
+                self._task_counter_delta('NEW', '+')
+            ),
+            'trg_tasks_team_counters_update': (
+                'AFTER UPDATE OF status, assigned_to, deadline ON tasks',
+                self._task_counter_delta('OLD', '-') + self._task_counter_delta('NEW', '+')
+            ),
+            'trg_tasks_team_counters_delete': (
+                'AFTER DELETE ON tasks WHEN OLD.assigned_to IS NOT NULL',
+                self._task_counter_delta('OLD', '-')
+            ),
+            'trg_team_members_counters_insert': (
+                'AFTER INSERT ON team_members',
+                self._member_counter_delta('NEW', '+')
+            ),
+            'trg_team_members_counters_update': (
+                'AFTER UPDATE OF team_id, admin_id ON team_members',
+                self._member_counter_delta('OLD', '-') + self._member_counter_delta('NEW', '+')
+            ),
+            'trg_team_members_counters_delete': (
+                'AFTER DELETE ON team_members',
+                self._member_counter_delta('OLD', '-')
+            ),
+        }
+        
+        for name, (event, body) in triggers.items():
+            # Пересоздаются при старте: определения менялись вместе со схемой
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'CREATE TRIGGER {name} {event} BEGIN {body} END')
+    
+    def _create_task_history_triggers(self):
+        """Запись переходов статусов и инкрементальное обновление агрегатов по ним"""
+        cursor = self.conn.cursor()
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_tasks_status_history
+            AFTER UPDATE OF status ON tasks
+            WHEN OLD.status IS NOT NEW.status
+            BEGIN
+                INSERT INTO task_status_history
+                    (task_id, from_status, to_status, assigned_to, entered_at, changed_at)
+                VALUES (
+                    NEW.id, OLD.status, NEW.status, NEW.assigned_to,
+                    COALESCE(OLD.status_changed_at, OLD.created_at),
+                    COALESCE(NEW.status_changed_at, CURRENT_TIMESTAMP)
+                );
+            END
+        ''')
+        
+        # Области, в которые попадает переход: все задачи, исполнитель, его команды
+        scopes = '''
+            (SELECT 'all' AS scope, 0 AS scope_id
+             UNION ALL
+             SELECT 'assignee', NEW.assigned_to WHERE NEW.assigned_to IS NOT NULL
+             UNION ALL
+             SELECT 'team', team_id FROM team_members WHERE admin_id = NEW.assigned_to) s
+        '''
+        seconds = "(julianday({end}) - julianday({start})) * 86400"
+        
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_task_status_history_aggregates
+            AFTER INSERT ON task_status_history
+            BEGIN
+                INSERT INTO task_status_time (scope, scope_id, status, seconds_total, entries)
+                SELECT s.scope, s.scope_id, NEW.from_status,
+                       MAX(0, {seconds.format(end='NEW.changed_at', start='NEW.entered_at')}), 1
+                FROM {scopes}
+                WHERE NEW.from_status IS NOT NULL AND NEW.entered_at IS NOT NULL
+                ON CONFLICT(scope, scope_id, status) DO UPDATE SET
+                    seconds_total = seconds_total + excluded.seconds_total,
+                    entries = entries + 1;
+                
+                INSERT INTO task_flow_stats
+                    (scope, scope_id, completed_count, lead_seconds_total, cycle_count, cycle_seconds_total)
+                SELECT s.scope, s.scope_id, 1,
+                       MAX(0, {seconds.format(end='NEW.changed_at', start='t.created_at')}),
+                       t.started_at IS NOT NULL,
+                       COALESCE(MAX(0, {seconds.format(end='NEW.changed_at', start='t.started_at')}), 0)
+                FROM {scopes}, tasks t
+                WHERE t.id = NEW.task_id AND NEW.to_status = 'completed'
+                ON CONFLICT(scope, scope_id) DO UPDATE SET
+                    completed_count = completed_count + 1,
+                    lead_seconds_total = lead_seconds_total + excluded.lead_seconds_total,
+                    cycle_count = cycle_count + excluded.cycle_count,
+                    cycle_seconds_total = cycle_seconds_total + excluded.cycle_seconds_total;
+                
+                INSERT INTO task_throughput (scope, scope_id, week, completed)
+                SELECT s.scope, s.scope_id, strftime('%Y-%W', NEW.changed_at), 1
+                FROM {scopes}
+                WHERE NEW.to_status = 'completed'
+                ON CONFLICT(scope, scope_id, week) DO UPDATE SET completed = completed + 1;
+            END
+        ''')
+    
+    def recalculate_team_counters(self):
+        """Пересчитать счетчики команд одним запросом
+        
+        Сначала обновляется tasks.is_overdue, затем счетчики считаются по нему,
+        чтобы триггеры дальше снимали ровно учтенное состояние.
+        """
+        overdue = self._OVERDUE_SQL.format(ref='tasks')
+        member_tasks = (
+            'SELECT COUNT(*) FROM team_members tm JOIN tasks t ON t.assigned_to = tm.admin_id '
+            'WHERE tm.team_id = teams.id AND '
+        )
+        
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f'UPDATE tasks SET is_overdue = ({overdue}) WHERE is_overdue IS NOT ({overdue})')
+            cursor.execute(f'''
+                UPDATE teams SET
+                    member_count = (SELECT COUNT(*) FROM team_members tm WHERE tm.team_id = teams.id),
+                    open_new = ({member_tasks}t.status = 'new'),
+                    open_in_progress = ({member_tasks}t.status = 'in_progress'),
+                    open_review = ({member_tasks}t.status = 'review'),
+                    overdue_count = ({member_tasks}t.is_overdue = 1)
+            ''')
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка пересчета счетчиков команд: {e}")
+            self.conn.rollback()
+    
+    def mark_tasks_overdue(self, task_ids: List[int]) -> int:
+        """Учесть наступившие дедлайны: is_overdue и overdue_count команд исполнителей
+        
+        Задачи становятся просроченными с течением времени, без изменения строк,
+        поэтому триггеры их не видят. Обновляются только переданные задачи
+        (из DeadlineScheduler), которые еще не учтены и действительно просрочены.
+        """
+        overdue = self._OVERDUE_SQL.format(ref='t')
+        marked = 0
+        cursor = self.conn.cursor()
+        
+        try:
+            for start in range(0, len(task_ids), 500):
+                chunk = task_ids[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                newly_overdue = f'''
+                    SELECT t.assigned_to FROM tasks t
+                    WHERE t.id IN ({placeholders}) AND t.is_overdue = 0 AND {overdue}
+                '''
+                cursor.execute(f'''
+                    UPDATE teams SET overdue_count = overdue_count + (
+                        SELECT COUNT(*) FROM team_members tm
+                        JOIN ({newly_overdue}) n ON n.assigned_to = tm.admin_id
+                        WHERE tm.team_id = teams.id
+                    )
+                    WHERE id IN (
+                        SELECT tm.team_id FROM team_members tm
+                        JOIN ({newly_overdue}) n ON n.assigned_to = tm.admin_id
+                    )
+                ''', chunk * 2)
+                cursor.execute(f'''
+                    UPDATE tasks SET is_overdue = 1
+                    WHERE id IN (
+                        SELECT t.id FROM tasks t
+                        WHERE t.id IN ({placeholders}) AND t.is_overdue = 0 AND {overdue}
+                    )
+                ''', chunk)
+                marked += cursor.rowcount
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка учета просроченных задач: {e}")
+            self.conn.rollback()
+            return 0
+        
+        return marked
+    
+    # ==================== ШИФРОВАНИЕ ====================
+    
+    def _seal(self, text: str, table: str) -> Tuple[str, str]:
+        """Подготовить текст к записи: шифротекст и слепой индекс"""
+        text_hash = self.cipher.blind_index(text)
+        if self.encrypt_at_rest:
+            text = self.cipher.encrypt(text, table.encode())
+        return text, text_hash
+    
+    def decrypt_rows(self, rows: List[Dict], fields: Dict[str, str]) -> List[Dict]:
+        """Пакетно расшифровать текстовые поля выборки (поле -> таблица)"""
+        for field, table in fields.items():
+            values = self.cipher.decrypt_many((row[field] for row in rows), table.encode())
+            for row, value in zip(rows, values):
+                row[field] = value
+        return rows
+    
+    def encrypt_legacy_rows(self, batch_size: int = 500):
+        """Зашифровать строки, записанные открытым текстом, и проставить недостающий слепой индекс
+        
+        Открытый текст - это строки без префикса enc1:, в том числе сохраненные
+        при выключенном шифровании (у них слепой индекс уже есть).
+        """
+        cursor = self.conn.cursor()
+        total = 0
+        
+        condition = 'text_hash IS NULL'
+        params: tuple = ()
+        if self.encrypt_at_rest:
+            condition += f' OR substr(text, 1, {len(ENCRYPTED_PREFIX)}) != ?'
+            params = (ENCRYPTED_PREFIX,)
+        
+        for table in ('messages', 'replies'):
+            while True:
+                cursor.execute(
+                    f'SELECT id, text FROM {table} WHERE {condition} LIMIT ?',
+                    (*params, batch_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                updates = []
+                for row in rows:
+                    plain = self.cipher.decrypt(row['text'], table.encode())
+                    text, text_hash = self._seal(plain, table)
+                    updates.append((text, text_hash, row['id']))
+                
+                cursor.executemany(
+                    f'UPDATE {table} SET text = ?, text_hash = ? WHERE id = ?',
+                    updates
+                )
+                self.conn.commit()
+                total += len(updates)
+        
+        if total > 0:
+            logger.info(f"✅ Зашифровано или проиндексировано {total} строк, записанных открытым текстом")
+    
     def add_admins_from_config(self):
         """Добавить администраторов из конфигурации"""
         cursor = self.conn.cursor()
@@ -213,6 +824,7 @@ class Database:
                 (admin_id, 'admin', 'read,reply,delete,ban,stats,broadcast')
             )
         self.conn.commit()
+        self.reference_cache.invalidate('admins')
         logger.info(f"✅ Добавлены администраторы из конфига: {config.ADMIN_IDS}")
     
     def add_user(self, telegram_id: int, username: str = None, 
@@ -220,54 +832,120 @@ class Database:
         """Добавить или обновить пользователя"""
         cursor = self.conn.cursor()
         
-        # Проверяем, забанен ли пользователь
-        cursor.execute(
-            'SELECT is_banned, ban_until FROM users WHERE telegram_id = ?',
-            (telegram_id,)
-        )
-        user = cursor.fetchone()
-        
-        if user and user['is_banned']:
-            ban_until = None
-            if user['ban_until']:
-                try:
-                    # Пробуем разные форматы даты
-                    ban_until = datetime.strptime(user['ban_until'], '%Y-%m-%d %H:%M:%S')
-                except:
-                    try:
-                        ban_until = datetime.fromisoformat(user['ban_until'].replace('Z', '+00:00'))
-                    except:
-                        pass
-            
-            if ban_until and ban_until > datetime.now():
-                raise Exception("Пользователь забанен")
+        # Известные пользователи проверяются на бан без обращения к БД
+        user = self.user_cache.get(telegram_id)
+        if user is None:
+            cursor.execute(
+                'SELECT * FROM users WHERE telegram_id = ?',
+                (telegram_id,)
+            )
+            row = cursor.fetchone()
+            if row:
+                user = self.user_cache.put(row)
         
+        if user and self.user_cache.is_banned(user):
+            raise Exception("Пользователь забанен")
+        
+        # Известный пользователь без изменений профиля: только отметка активности в памяти
+        if user and all(value is None or value == user[field] for field, value in (
+            ('username', username), ('first_name', first_name), ('last_name', last_name)
+        )):
+            self.activity.touch(telegram_id)
+            self.segments.on_activity(user['id'])
+            return user['id']
+        
+        # Настоящий upsert: строка не удаляется, id и бан сохраняются
         cursor.execute('''
-            INSERT OR REPLACE INTO users 
+            INSERT INTO users 
             (telegram_id, username, first_name, last_name, last_activity) 
             VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(telegram_id) DO UPDATE SET
+                username = COALESCE(excluded.username, users.username),
+                first_name = COALESCE(excluded.first_name, users.first_name),
+                last_name = COALESCE(excluded.last_name, users.last_name),
+                last_activity = excluded.last_activity,
+                blocked_bot = 0
         ''', (telegram_id, username, first_name, last_name, datetime.now()))
+        self.conn.commit()
         
+        if user is None:
+            cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
+            user = self.user_cache.put(cursor.fetchone())
+        else:
+            for field, value in (('username', username), ('first_name', first_name),
+                                 ('last_name', last_name)):
+                if value is not None:
+                    user[field] = value
+        
+        self.segments.on_activity(user['id'])
+        return user['id']
+    
+    def ban_user(self, telegram_id: int, until: datetime, reason: str = None) -> bool:
+        """Забанить пользователя до указанного времени"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE users SET is_banned = 1, ban_reason = ?, ban_until = ?
+            WHERE telegram_id = ?
+        ''', (reason, until.strftime('%Y-%m-%d %H:%M:%S'), telegram_id))
+        self.conn.commit()
+        self.user_cache.invalidate(telegram_id)
+        self._set_segment_ban(telegram_id, until)
+        return cursor.rowcount > 0
+    
+    def unban_user(self, telegram_id: int) -> bool:
+        """Снять бан с пользователя"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE users SET is_banned = 0, ban_reason = NULL, ban_until = NULL
+            WHERE telegram_id = ?
+        ''', (telegram_id,))
         self.conn.commit()
-        return cursor.lastrowid
+        self.user_cache.invalidate(telegram_id)
+        self._set_segment_ban(telegram_id, None)
+        return cursor.rowcount > 0
+    
+    def _set_segment_ban(self, telegram_id: int, until: Optional[datetime]):
+        """Обновить срок бана пользователя в индексах сегментов"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,))
+        row = cursor.fetchone()
+        if row:
+            self.segments.set_ban(row['id'], until)
     
     def add_message(self, telegram_id: int, text: str, 
-                   category: str = 'general', is_anonymous: bool = True) -> Dict[str, Any]:
-        """Добавить новое сообщение"""
+                   category: str = 'general', is_anonymous: bool = True,
+                   admin_notification: Optional[Callable[[int], str]] = None) -> Dict[str, Any]:
+        """Добавить новое сообщение
+        
+        admin_notification(message_id) - текст уведомления администраторам,
+        ставится в outbox в той же транзакции.
+        """
         user_id = self.add_user(telegram_id)
         
+        stored_text, text_hash = self._seal(text, 'messages')
+        
         cursor = self.conn.cursor()
         cursor.execute('''
-            INSERT INTO messages (user_id, text, category, is_anonymous)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, text, category, is_anonymous))
+            INSERT INTO messages (user_id, text, text_hash, category, is_anonymous)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, stored_text, text_hash, category, is_anonymous))
         
         message_id = cursor.lastrowid
         
+        if admin_notification:
+            notification = admin_notification(message_id)
+            for admin_id in config.ADMIN_IDS:
+                self.outbox.enqueue(cursor, admin_id, notification)
+        
         # Обновляем статистику
         self.update_statistics()
         
         self.conn.commit()
+        self.sla.track(message_id)
+        self.reply_queue.add(message_id)
+        self.segments.on_message(user_id, category)
+        if admin_notification:
+            self.outbox.wake()
         
         return {
             'message_id': message_id,
@@ -287,7 +965,8 @@ class Database:
             LIMIT ?
         ''', (limit,))
         
-        return [dict(row) for row in cursor.fetchall()]
+        rows = [dict(row) for row in cursor.fetchall()]
+        return self.decrypt_rows(rows, {'text': 'messages'})
     
     def get_user_messages(self, telegram_id: int, limit: int = 20) -> List[Dict]:
         """Получить сообщения пользователя"""
@@ -303,28 +982,42 @@ class Database:
             LIMIT ?
         ''', (telegram_id, limit))
         
-        return [dict(row) for row in cursor.fetchall()]
+        rows = [dict(row) for row in cursor.fetchall()]
+        return self.decrypt_rows(rows, {'text': 'messages', 'reply_text': 'replies'})
     
-    def add_reply(self, message_id: int, admin_telegram_id: int, text: str) -> bool:
-        """Добавить ответ администратора"""
+    def add_reply(self, message_id: int, admin_telegram_id: int, text: str,
+                  notification: Optional[str] = None) -> bool:
+        """Добавить ответ администратора
+        
+        notification - текст для автора обращения, ставится в outbox в той же транзакции.
+        """
         cursor = self.conn.cursor()
         
         # Получаем admin_id
-        cursor.execute(
-            'SELECT id FROM admins WHERE telegram_id = ?',
-            (admin_telegram_id,)
-        )
-        admin = cursor.fetchone()
+        admin_db_id = self.reference_cache.get_admin_db_id(admin_telegram_id)
         
-        if not admin:
+        if admin_db_id is None:
             logger.error(f"Администратор с Telegram ID {admin_telegram_id} не найден в БД")
             return False
         
+        # Время первого ответа (повторные ответы не меняют статистику времени)
+        cursor.execute('''
+            SELECT status, user_id,
+                   CAST((julianday(CURRENT_TIMESTAMP) - julianday(created_at)) * 24 * 60 AS INTEGER)
+                       AS response_time
+            FROM messages WHERE id = ?
+        ''', (message_id,))
+        message = cursor.fetchone()
+        first_response_time = (
+            message['response_time'] if message and message['status'] != 'replied' else None
+        )
+        
         # Добавляем ответ
+        stored_text, text_hash = self._seal(text, 'replies')
         cursor.execute('''
-            INSERT INTO replies (message_id, admin_id, text)
-            VALUES (?, ?, ?)
-        ''', (message_id, admin['id'], text))
+            INSERT INTO replies (message_id, admin_id, text, text_hash)
+            VALUES (?, ?, ?, ?)
+        ''', (message_id, admin_db_id, stored_text, text_hash))
         
         # Обновляем статус сообщения
         cursor.execute('''
@@ -338,7 +1031,27 @@ class Database:
             WHERE id = ?
         ''', (message_id,))
         
+        # Статистика администратора в той же транзакции
+        self.admin_stats.record_reply(cursor, admin_telegram_id, first_response_time)
+        
+        # Уведомление автору обращения
+        if notification:
+            cursor.execute('''
+                SELECT u.telegram_id FROM messages m
+                JOIN users u ON u.id = m.user_id
+                WHERE m.id = ?
+            ''', (message_id,))
+            author = cursor.fetchone()
+            if author:
+                self.outbox.enqueue(cursor, author['telegram_id'], notification, PRIORITY_REPLY)
+        
         self.conn.commit()
+        self.sla.resolve(message_id)
+        self.reply_queue.remove(message_id)
+        if message:
+            self.segments.set_flag('replied', message['user_id'])
+        if notification:
+            self.outbox.wake()
         self.update_statistics()
         logger.info(f"✅ Ответ на сообщение #{message_id} добавлен")
         return True
@@ -454,6 +1167,8 @@ class Database:
             
             task_id = cursor.lastrowid
             self.conn.commit()
+            for tracker in self.task_trackers:
+                tracker.track(task_id, assigned_to, priority, 'new', deadline)
             logger.info(f"✅ Создана задача #{task_id}: '{title}'")
             return task_id
         except Exception as e:
@@ -466,14 +1181,11 @@ class Database:
         cursor = self.conn.cursor()
         
         # Получаем ID администратора по telegram_id
-        cursor.execute('SELECT id FROM admins WHERE telegram_id = ?', (admin_id,))
-        admin = cursor.fetchone()
+        admin_db_id = self.reference_cache.get_admin_db_id(admin_id)
         
-        if not admin:
+        if admin_db_id is None:
             return []
         
-        admin_db_id = admin['id']
-        
         if status:
             cursor.execute('''
                 SELECT t.*, a1.telegram_id as created_by_telegram, 
@@ -532,17 +1244,18 @@ class Database:
         cursor = self.conn.cursor()
         
         try:
-            cursor.execute('''
+            cursor.execute(f'''
                 UPDATE tasks 
-                SET status = ?, updated_at = CURRENT_TIMESTAMP,
-                    completed_at = CASE WHEN ? = 'completed' THEN CURRENT_TIMESTAMP ELSE completed_at END
+                SET {STATUS_ASSIGNMENTS}, updated_at = CURRENT_TIMESTAMP, version = version + 1
                 WHERE id = ? AND assigned_to = (SELECT id FROM admins WHERE telegram_id = ?)
-            ''', (status, status, task_id, admin_id))
+            ''', (*status_params(status), task_id, admin_id))
             
             self.conn.commit()
             success = cursor.rowcount > 0
             
             if success:
+                for tracker in self.task_trackers:
+                    tracker.on_status(task_id, status)
                 logger.info(f"✅ Статус задачи #{task_id} обновлен на '{status}'")
             else:
                 logger.warning(f"⚠️ Не удалось обновить статус задачи #{task_id}")
@@ -573,6 +1286,7 @@ class Database:
                 self.add_team_member(team_id, leader_id, 'leader')
             
             self.conn.commit()
+            self.reference_cache.invalidate('teams')
             logger.info(f"✅ Создана команда #{team_id}: '{name}'")
             return team_id
         except Exception as e:
@@ -586,11 +1300,15 @@ class Database:
         
         try:
             cursor.execute('''
-                INSERT OR REPLACE INTO team_members (team_id, admin_id, role)
+                INSERT INTO team_members (team_id, admin_id, role)
                 VALUES (?, ?, ?)
+                ON CONFLICT(team_id, admin_id) DO UPDATE SET
+                    role = excluded.role,
+                    version = team_members.version + 1
             ''', (team_id, admin_id, role))
             
             self.conn.commit()
+            self.reference_cache.invalidate('teams')
             logger.info(f"✅ Участник {admin_id} добавлен в команду #{team_id}")
             return True
         except Exception as e:
@@ -632,28 +1350,8 @@ class Database:
     # ==================== МЕТОДЫ ДЛЯ РАБОТЫ С ЦИТАТАМИ ====================
     
     def get_random_quote(self, category: Optional[str] = None) -> Optional[Dict]:
-        """Получить случайную цитату"""
-        cursor = self.conn.cursor()
-        
-        if category:
-            cursor.execute('''
-                SELECT * FROM quotes 
-                WHERE category = ? 
-                ORDER BY RANDOM() 
-                LIMIT 1
-            ''', (category,))
-        else:
-            cursor.execute('SELECT * FROM quotes ORDER BY RANDOM() LIMIT 1')
-        
-        row = cursor.fetchone()
-        
-        if row:
-            # Увеличиваем счетчик использования
-            cursor.execute('UPDATE quotes SET used_count = used_count + 1 WHERE id = ?', (row['id'],))
-            self.conn.commit()
-            
-            return dict(row)
-        return None
+        """Получить случайную цитату (из пула в памяти)"""
+        return self.quote_engine.pick(category)
     
     def add_quote(self, text: str, author: str = "", category: str = "general", 
                  created_by: Optional[int] = None) -> bool:
@@ -667,6 +1365,10 @@ class Database:
             ''', (text, author, category, created_by))
             
             self.conn.commit()
+            self.quote_engine.add({
+                'id': cursor.lastrowid, 'text': text, 'author': author,
+                'category': category, 'created_by': created_by, 'used_count': 0
+            })
             logger.info(f"✅ Добавлена новая цитата в категорию '{category}'")
             return True
         except Exception as e:
@@ -676,5 +1378,8 @@ class Database:
     
     def close(self):
         """Закрыть соединение с БД"""
+        self.quote_engine.flush()
+        self.activity.flush()
+        self.job_store.flush()
         self.conn.close()
         logger.info("✅ Соединение с БД закрыто")
\ No newline at end of file
@@ -1,20 +1,34 @@
 import logging
+import tempfile
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
 
 from utils.decorators import admin_required, handle_errors
+from services.errors import VersionConflict
 from services.task_service import TaskService
 from services.team_service import TeamService
 from services.quote_service import QuoteService
+from services.outbound import PRIORITY_BROADCAST
+from models.task import TASK_STATUSES
 
 logger = logging.getLogger(__name__)
 
 # Состояния для ConversationHandler
 TASK_TITLE, TASK_DESCRIPTION, TASK_ASSIGNEE, TASK_PRIORITY, TASK_DEADLINE = range(5)
 
+# Исполнитель выбирается при сохранении задачи по текущей загрузке
+AUTO_ASSIGNEE = 'auto'
+
+# Предел числа задач в одной массовой операции
+MAX_BULK_TASK_IDS = 500
+
+# Для скольких задач в /mytasks показывать кнопки смены статуса
+STATUS_BUTTON_TASKS = 5
+STATUS_BUTTONS = (('in_progress', '🔄'), ('review', '👀'), ('completed', '✅'))
+
 class TaskHandlers:
     def __init__(self, db):
         self.db = db
@@ -65,11 +79,9 @@ class TaskHandlers:
         context.user_data['task_description'] = update.message.text
         
         # Получаем список администраторов для назначения
-        cursor = self.db.conn.cursor()
-        cursor.execute('SELECT telegram_id, username FROM admins')
-        admins = cursor.fetchall()
+        admins = self.db.reference_cache.get_admins()
         
-        keyboard = []
+        keyboard = [[InlineKeyboardButton("🤖 Авто (наименее загруженный)", callback_data="assign_auto")]]
         for admin in admins:
             username = admin['username'] or f"ID: {admin['telegram_id']}"
             keyboard.append([
@@ -98,6 +110,8 @@ class TaskHandlers:
         
         if data == 'none':
             context.user_data['task_assignee'] = None
+        elif data == AUTO_ASSIGNEE:
+            context.user_data['task_assignee'] = AUTO_ASSIGNEE
         else:
             context.user_data['task_assignee'] = int(data)
         
@@ -192,6 +206,11 @@ class TaskHandlers:
         
         user_id = update.effective_user.id
         
+        # Авто: наименее загруженный участник команд автора (или любой администратор)
+        if assignee == AUTO_ASSIGNEE:
+            team_ids = [team['id'] for team in self.team_service.get_user_teams(user_id)]
+            assignee = self.db.workload.pick(team_ids)
+        
         # Создаем задачу
         task = self.task_service.create_task(
             title=title,
@@ -206,14 +225,15 @@ class TaskHandlers:
             # Отправляем уведомление исполнителю
             if assignee:
                 try:
-                    await context.bot.send_message(
-                        chat_id=assignee,
-                        text=f"📋 *Новая задача #{task.id}*\n\n"
-                             f"*{title}*\n\n"
-                             f"{description}\n\n"
-                             f"🎯 Приоритет: {priority}\n"
-                             f"⏰ Дедлайн: {deadline.strftime('%d.%m.%Y') if deadline else 'Нет'}\n\n"
-                             f"Для просмотра: /mytasks",
+                    await self.db.outbound.send(
+                        context.bot,
+                        assignee,
+                        f"📋 *Новая задача #{task.id}*\n\n"
+                        f"*{title}*\n\n"
+                        f"{description}\n\n"
+                        f"🎯 Приоритет: {priority}\n"
+                        f"⏰ Дедлайн: {deadline.strftime('%d.%m.%Y') if deadline else 'Нет'}\n\n"
+                        f"Для просмотра: /mytasks",
                         parse_mode='Markdown'
                     )
                 except Exception as e:
@@ -222,7 +242,7 @@ class TaskHandlers:
             message = (
                 f"✅ *Задача создана!*\n\n"
                 f"*#{task.id} {title}*\n\n"
-                f"Исполнитель: {'Назначен' if assignee else 'Не назначен'}\n"
+                f"Исполнитель: {assignee or 'Не назначен'}\n"
                 f"Приоритет: {priority}\n"
                 f"Дедлайн: {deadline.strftime('%d.%m.%Y %H:%M') if deadline else 'Нет'}"
             )
@@ -293,62 +313,79 @@ class TaskHandlers:
                 f"────────────────────\n"
             )
         
+        # Кнопки несут версию задачи: если задачу успели изменить, смена
+        # статуса отклоняется (см. change_status)
+        active = [task for task in tasks if task.status not in ('completed', 'cancelled')]
         keyboard = [
             [
-                InlineKeyboardButton("🔄 В работе", callback_data="status_in_progress"),
-                InlineKeyboardButton("👀 На проверку", callback_data="status_review"),
-            ],
-            [
-                InlineKeyboardButton("✅ Завершить", callback_data="status_completed"),
-                InlineKeyboardButton("❌ Отменить", callback_data="status_cancelled"),
-            ],
-            [InlineKeyboardButton("📝 Изменить статус задачи", callback_data="change_status_prompt")],
+                InlineKeyboardButton(
+                    f"{icon} #{task.id}",
+                    callback_data=f"task_status:{task.id}:{task.version}:{status}"
+                )
+                for status, icon in STATUS_BUTTONS if status != task.status
+            ]
+            for task in active[:STATUS_BUTTON_TASKS]
         ]
         
         await update.message.reply_text(
             response,
             parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
         )
     
+    @handle_errors
+    async def change_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Смена статуса задачи кнопкой из /mytasks (compare-and-set по версии)"""
+        query = update.callback_query
+        _, task_id, version, status = query.data.split(':')
+        task_id = int(task_id)
+        
+        if status not in TASK_STATUSES:
+            await query.answer("❌ Неизвестный статус.", show_alert=True)
+            return
+        
+        try:
+            new_version = self.task_service.update_task_status_cas(
+                task_id, status, update.effective_user.id, int(version)
+            )
+        except VersionConflict:
+            await query.answer(
+                f"⚠️ Задачу #{task_id} уже изменили. Обновите список: /mytasks",
+                show_alert=True
+            )
+            return
+        
+        if new_version is None:
+            await query.answer(f"❌ Задача #{task_id} не найдена или назначена не вам.", show_alert=True)
+            return
+        
+        await query.answer(f"✅ Задача #{task_id}: статус {status}")
+    
     @admin_required
     @handle_errors
     async def team_tasks(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать задачи команды"""
         user_id = update.effective_user.id
         
-        # Получаем команды пользователя
-        teams = self.team_service.get_user_teams(user_id)
+        # Незавершенные задачи всех команд пользователя одним запросом
+        previews = self.task_service.get_team_task_previews(user_id, limit=3)
         
-        if not teams:
+        if not previews and not self.team_service.get_user_teams(user_id):
             await update.message.reply_text("👥 Вы не состоите ни в одной команде.")
             return
         
         response = "👥 *Задачи команд:*\n\n"
         
-        for team in teams:
-            # Получаем участников команды
-            members = self.team_service.get_team_members(team['id'])
-            member_ids = [m['telegram_id'] for m in members]
+        for preview in previews:
+            response += f"*{preview['team_name']}* ({preview['total']} задач)\n"
             
-            # Получаем задачи для всех участников команды
-            team_tasks = []
-            for member_id in member_ids:
-                tasks = self.task_service.get_user_tasks(member_id)
-                for task in tasks:
-                    if task.status != 'completed':
-                        team_tasks.append((task, member_id))
+            for task in preview['tasks']:  # Показываем только 3 задачи
+                response += f"  • {task.title} (ID: {task.id})\n"
             
-            if team_tasks:
-                response += f"*{team['name']}* ({len(team_tasks)} задач)\n"
-                
-                for task, assignee_id in team_tasks[:3]:  # Показываем только 3 задачи
-                    response += f"  • {task.title} (ID: {task.id})\n"
-                
-                if len(team_tasks) > 3:
-                    response += f"  ... и еще {len(team_tasks) - 3} задач\n"
-                
-                response += "\n"
+            if preview['total'] > len(preview['tasks']):
+                response += f"  ... и еще {preview['total'] - len(preview['tasks'])} задач\n"
+            
+            response += "\n"
         
         await update.message.reply_text(response, parse_mode='Markdown')
     
@@ -356,37 +393,31 @@ class TaskHandlers:
     @handle_errors
     async def all_tasks(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать все задачи"""
-        tasks = self.task_service.get_all_tasks()
+        # По 5 последних задач каждого статуса и их общее число одним запросом
+        previews = self.task_service.get_status_previews(limit=5)
         
-        if not tasks:
+        if not previews:
             await update.message.reply_text("📭 Нет активных задач.")
             return
         
         response = "📊 *Все задачи:*\n\n"
         
-        # Группируем по статусу
-        tasks_by_status = {}
-        for task in tasks:
-            if task.status not in tasks_by_status:
-                tasks_by_status[task.status] = []
-            tasks_by_status[task.status].append(task)
-        
-        for status, status_tasks in tasks_by_status.items():
+        for preview in previews:
             status_text = {
                 'new': '🆕 Новые',
                 'in_progress': '🔄 В работе',
                 'review': '👀 На проверке',
                 'completed': '✅ Завершены',
                 'cancelled': '❌ Отменены'
-            }.get(status, status)
+            }.get(preview['status'], preview['status'])
             
-            response += f"*{status_text}* ({len(status_tasks)})\n"
+            response += f"*{status_text}* ({preview['total']})\n"
             
-            for task in status_tasks[:5]:  # Показываем по 5 задач каждого статуса
+            for task in preview['tasks']:
                 response += f"  • #{task.id} {task.title}\n"
             
-            if len(status_tasks) > 5:
-                response += f"  ... и еще {len(status_tasks) - 5}\n"
+            if preview['total'] > len(preview['tasks']):
+                response += f"  ... и еще {preview['total'] - len(preview['tasks'])}\n"
             
             response += "\n"
         
@@ -398,8 +429,8 @@ class TaskHandlers:
         """Отправить мотивационную цитату команде"""
         user_id = update.effective_user.id
         
-        # Получаем случайную цитату
-        quote = self.quote_service.get_random_quote()
+        # Получаем случайную цитату (без повторов для отправителя)
+        quote = self.quote_service.get_random_quote(user_id=user_id)
         
         if not quote:
             await update.message.reply_text("❌ Нет доступных цитат.")
@@ -423,20 +454,18 @@ class TaskHandlers:
             return
         
         # Отправляем цитату всем участникам
-        sent_count = 0
-        for member in members:
-            try:
-                await context.bot.send_message(
-                    chat_id=member['telegram_id'],
-                    text=f"💫 *Мотивация от {update.effective_user.first_name}!*\n\n"
-                         f"*{quote['text']}*\n\n"
-                         f"_{quote['author'] or 'Аноним'}_\n\n"
-                         f"#мотивация #{team['name'].lower().replace(' ', '_')}",
-                    parse_mode='Markdown'
-                )
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Не удалось отправить цитату пользователю {member['telegram_id']}: {e}")
+        text = (
+            f"💫 *Мотивация от {update.effective_user.first_name}!*\n\n"
+            f"*{quote['text']}*\n\n"
+            f"_{quote['author'] or 'Аноним'}_\n\n"
+            f"#мотивация #{team['name'].lower().replace(' ', '_')}"
+        )
+        sent_count = await self.db.outbound.send_many(
+            context.bot,
+            [(member['telegram_id'], text) for member in members],
+            PRIORITY_BROADCAST,
+            parse_mode='Markdown'
+        )
         
         await update.message.reply_text(
             f"✅ Мотивационная цитата отправлена {sent_count} участникам команды *{team['name']}*!",
@@ -455,28 +484,26 @@ class TaskHandlers:
         user = update.effective_user
         
         # Получаем всех администраторов
-        cursor = self.db.conn.cursor()
-        cursor.execute('SELECT telegram_id FROM admins WHERE telegram_id != ?', (user.id,))
-        admins = cursor.fetchall()
+        admins = [
+            admin for admin in self.db.reference_cache.get_admins()
+            if admin['telegram_id'] != user.id
+        ]
         
         if not admins:
             await update.message.reply_text("❌ Нет других администраторов.")
             return
         
-        sent_count = 0
-        for admin in admins:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin['telegram_id'],
-                    text=f"📣 *ВНИМАНИЕ!*\n\n"
-                         f"@{user.username or user.first_name} вызывает всех:\n\n"
-                         f"*{message}*\n\n"
-                         f"#all #призыв",
-                    parse_mode='Markdown'
-                )
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Не удалось отправить призыв администратору {admin['telegram_id']}: {e}")
+        text = (
+            f"📣 *ВНИМАНИЕ!*\n\n"
+            f"@{user.username or user.first_name} вызывает всех:\n\n"
+            f"*{message}*\n\n"
+            f"#all #призыв"
+        )
+        sent_count = await self.db.outbound.send_many(
+            context.bot,
+            [(admin['telegram_id'], text) for admin in admins],
+            parse_mode='Markdown'
+        )
         
         await update.message.reply_text(
             f"📣 Призыв отправлен {sent_count} администраторам!",
@@ -527,9 +554,7 @@ class TaskHandlers:
             role = context.args[2] if len(context.args) > 2 else 'member'
             
             # Проверяем, что пользователь - лидер команды
-            cursor = self.db.conn.cursor()
-            cursor.execute('SELECT leader_id FROM teams WHERE id = ?', (team_id,))
-            team = cursor.fetchone()
+            team = self.team_service.get_team(team_id)
             
             if not team:
                 await update.message.reply_text("❌ Команда не найдена.")
@@ -543,19 +568,18 @@ class TaskHandlers:
             success = self.team_service.add_team_member(team_id, member_id, role)
             
             if success:
-                # Получаем название команды
-                cursor.execute('SELECT name FROM teams WHERE id = ?', (team_id,))
-                team_name = cursor.fetchone()['name']
+                team_name = team['name']
                 
                 # Уведомляем нового участника
                 try:
-                    await context.bot.send_message(
-                        chat_id=member_id,
-                        text=f"👥 *Вас добавили в команду!*\n\n"
-                             f"Команда: *{team_name}*\n"
-                             f"Роль: {role}\n"
-                             f"Лидер: @{update.effective_user.username or update.effective_user.first_name}\n\n"
-                             f"Просмотреть задачи команды: /teamtasks",
+                    await self.db.outbound.send(
+                        context.bot,
+                        member_id,
+                        f"👥 *Вас добавили в команду!*\n\n"
+                        f"Команда: *{team_name}*\n"
+                        f"Роль: {role}\n"
+                        f"Лидер: @{update.effective_user.username or update.effective_user.first_name}\n\n"
+                        f"Просмотреть задачи команды: /teamtasks",
                         parse_mode='Markdown'
                     )
                 except Exception as e:
@@ -576,7 +600,7 @@ class TaskHandlers:
     async def my_teams(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать мои команды"""
         user_id = update.effective_user.id
-        teams = self.team_service.get_user_teams(user_id)
+        teams = self.team_service.get_team_overviews(user_id)
         
         if not teams:
             await update.message.reply_text("👥 Вы не состоите ни в одной команде.")
@@ -585,12 +609,15 @@ class TaskHandlers:
         response = "👥 *Ваши команды:*\n\n"
         
         for team in teams:
-            members = self.team_service.get_team_members(team['id'])
+            open_total = team['open_new'] + team['open_in_progress'] + team['open_review']
             
             response += (
                 f"*{team['name']}*\n"
                 f"Роль: {team['role']}\n"
-                f"Участников: {len(members)}\n"
+                f"Участников: {team['member_count']}\n"
+                f"Открытых задач: {open_total} "
+                f"(🆕 {team['open_new']} / 🔄 {team['open_in_progress']} / 👀 {team['open_review']})\n"
+                f"Просрочено: {team['overdue_count']}\n"
                 f"ID команды: {team['id']}\n"
             )
             
@@ -611,43 +638,232 @@ class TaskHandlers:
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
     
+    @admin_required
+    @handle_errors
+    async def task_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Аналитика задач: lead/cycle time, время в статусах, пропускная способность"""
+        user_id = update.effective_user.id
+        
+        sections = [('📊 Все задачи', 'all', 0), ('👤 Мои задачи', 'assignee', user_id)]
+        sections += [
+            (f"👥 {team['name']}", 'team', team['id'])
+            for team in self.team_service.get_user_teams(user_id)
+        ]
+        
+        status_names = {'new': 'новая', 'in_progress': 'в работе', 'review': 'на проверке'}
+        response = "📈 *Аналитика задач*\n\n"
+        
+        for title, scope, scope_id in sections:
+            stats = self.task_service.get_task_stats(scope, scope_id, weeks=4)
+            
+            response += (
+                f"*{title}*\n"
+                f"Завершено: {stats['completed']}\n"
+                f"Lead time: {format_duration(stats['avg_lead_time'])}, "
+                f"cycle time: {format_duration(stats['avg_cycle_time'])}\n"
+            )
+            
+            in_status = [
+                f"{name} {format_duration(stats['time_in_status'][status])}"
+                for status, name in status_names.items()
+                if status in stats['time_in_status']
+            ]
+            if in_status:
+                response += f"В статусе: {', '.join(in_status)}\n"
+            
+            if stats['throughput']:
+                weeks = ', '.join(f"{week}: {count}" for week, count in stats['throughput'])
+                response += f"По неделям: {weeks}\n"
+            
+            response += "\n"
+        
+        await update.message.reply_text(response, parse_mode='Markdown')
+    
     @admin_required
     @handle_errors
     async def daily_motivation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Ежедневная мотивационная рассылка"""
-        # Получаем случайную цитату
-        quote = self.quote_service.get_random_quote()
+        # Берем одну из наименее использованных цитат
+        quote = self.quote_service.get_random_quote(mode='least_used')
         
         if not quote:
             await update.message.reply_text("❌ Нет доступных цитат.")
             return
         
         # Получаем всех администраторов
-        cursor = self.db.conn.cursor()
-        cursor.execute('SELECT telegram_id FROM admins')
-        admins = cursor.fetchall()
-        
-        sent_count = 0
-        for admin in admins:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin['telegram_id'],
-                    text=f"🌅 *Доброе утро!*\n\n"
-                         f"*Мотивация на сегодня:*\n\n"
-                         f"_{quote['text']}_\n\n"
-                         f"— {quote['author'] or 'Аноним'}\n\n"
-                         f"#утро #мотивация #день",
-                    parse_mode='Markdown'
-                )
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Не удалось отправить мотивацию администратору {admin['telegram_id']}: {e}")
+        admins = self.db.reference_cache.get_admins()
+        
+        text = (
+            f"🌅 *Доброе утро!*\n\n"
+            f"*Мотивация на сегодня:*\n\n"
+            f"_{quote['text']}_\n\n"
+            f"— {quote['author'] or 'Аноним'}\n\n"
+            f"#утро #мотивация #день"
+        )
+        sent_count = await self.db.outbound.send_many(
+            context.bot,
+            [(admin['telegram_id'], text) for admin in admins],
+            PRIORITY_BROADCAST,
+            parse_mode='Markdown'
+        )
         
         await update.message.reply_text(
             f"✅ Ежедневная мотивация отправлена {sent_count} администраторам!",
             parse_mode='Markdown'
         )
 
+    @admin_required
+    @handle_errors
+    async def bulk_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Массовая смена статуса задач"""
+        if len(context.args) < 2 or context.args[0] not in TASK_STATUSES:
+            await update.message.reply_text(
+                "Использование: /bulkstatus <статус> <id,id,...|id-id>\n\n"
+                f"Статусы: {', '.join(TASK_STATUSES)}\n"
+                "Пример: /bulkstatus completed 12,13,20-25"
+            )
+            return
+        
+        task_ids = parse_task_ids(context.args[1:])
+        if not task_ids:
+            await update.message.reply_text(
+                f"❌ Неверный формат ID задач (не больше {MAX_BULK_TASK_IDS} за раз)."
+            )
+            return
+        
+        updated = self.task_service.bulk_update_status(
+            task_ids, context.args[0], update.effective_user.id
+        )
+        await update.message.reply_text(
+            f"✅ Статус обновлен у {updated} из {len(task_ids)} задач.\n"
+            "Меняются только задачи, назначенные вам или созданные вами."
+        )
+    
+    @admin_required
+    @handle_errors
+    async def bulk_assign(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Массовое переназначение задач"""
+        if len(context.args) < 2:
+            await update.message.reply_text(
+                "Использование: /bulkassign <id_пользователя|none> <id,id,...|id-id>\n\n"
+                "Пример: /bulkassign 123456789 12,13,20-25"
+            )
+            return
+        
+        try:
+            assignee = None if context.args[0] == 'none' else int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ Неверный формат ID пользователя.")
+            return
+        
+        if assignee is not None and not self.db.reference_cache.is_admin(assignee):
+            await update.message.reply_text("❌ Назначить задачу можно только администратору.")
+            return
+        
+        task_ids = parse_task_ids(context.args[1:])
+        if not task_ids:
+            await update.message.reply_text(
+                f"❌ Неверный формат ID задач (не больше {MAX_BULK_TASK_IDS} за раз)."
+            )
+            return
+        
+        updated = self.task_service.bulk_assign(task_ids, assignee, update.effective_user.id)
+        await update.message.reply_text(
+            f"✅ Переназначено {updated} из {len(task_ids)} задач.\n"
+            "Меняются только задачи, назначенные вам или созданные вами."
+        )
+    
+    @admin_required
+    @handle_errors
+    async def export_tasks(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгрузка задач в JSONL"""
+        filters_ = {}
+        for arg in context.args:
+            key, _, value = arg.partition('=')
+            if key in ('status', 'priority'):
+                filters_[key] = value
+            elif key == 'assigned_to' and value.isdigit():
+                filters_[key] = int(value)
+        
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as output:
+            count = self.task_service.export_tasks_jsonl(output, filters_)
+            
+            if count == 0:
+                await update.message.reply_text("📭 Нет задач для выгрузки.")
+                return
+            
+            output.seek(0)
+            await update.message.reply_document(
+                document=output,
+                filename=f"tasks_{datetime.now().strftime('%Y-%m-%d')}.jsonl",
+                caption=f"📦 Выгрузка задач: {count}"
+            )
+    
+    @admin_required
+    @handle_errors
+    async def import_tasks(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Импорт задач из JSONL (ответом на документ или с подписью /importtasks)"""
+        message = update.message
+        document = message.document or (
+            message.reply_to_message.document if message.reply_to_message else None
+        )
+        
+        if not document:
+            await message.reply_text(
+                "Использование: отправьте файл .jsonl с подписью /importtasks "
+                "или ответьте /importtasks на сообщение с файлом.\n\n"
+                "Формат строки такой же, как в /exporttasks."
+            )
+            return
+        
+        telegram_file = await document.get_file()
+        
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as buffer:
+            await telegram_file.download_to_memory(buffer)
+            buffer.seek(0)
+            result = self.task_service.import_tasks_jsonl(buffer, update.effective_user.id)
+        
+        await message.reply_text(
+            f"✅ Импортировано задач: {result['imported']}\n"
+            f"⚠️ Пропущено строк: {result['skipped']}"
+        )
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Длительность в читаемом виде: 45 мин, 5.2 ч, 3.1 дн"""
+    if seconds is None:
+        return "—"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} ч"
+    return f"{seconds / 86400:.1f} дн"
+
+def parse_task_ids(args: List[str]) -> List[int]:
+    """Разобрать список ID задач: '1,2,3', '1 2 3' или диапазоны '5-9'
+
+    Больше MAX_BULK_TASK_IDS задач за раз не принимается (пустой список).
+    """
+    task_ids = {}
+    
+    try:
+        for arg in args:
+            for part in arg.split(','):
+                if not part:
+                    continue
+                if '-' in part:
+                    start, end = (int(x) for x in part.split('-', 1))
+                    if end - start >= MAX_BULK_TASK_IDS:
+                        return []
+                    task_ids.update(dict.fromkeys(range(start, end + 1)))
+                else:
+                    task_ids[int(part)] = None
+                if len(task_ids) > MAX_BULK_TASK_IDS:
+                    return []
+    except ValueError:
+        return []
+    
+    return list(task_ids)
+
 def register(app, db):
     """Регистрация обработчиков задач и команд"""
     handlers = TaskHandlers(db)
@@ -661,7 +877,15 @@ def register(app, db):
     app.add_handler(CommandHandler("createteam", handlers.create_team))
     app.add_handler(CommandHandler("addmember", handlers.add_member))
     app.add_handler(CommandHandler("myteams", handlers.my_teams))
+    app.add_handler(CommandHandler("taskstats", handlers.task_stats))
     app.add_handler(CommandHandler("motivate", handlers.daily_motivation))
+    app.add_handler(CommandHandler("bulkstatus", handlers.bulk_status))
+    app.add_handler(CommandHandler("bulkassign", handlers.bulk_assign))
+    app.add_handler(CommandHandler("exporttasks", handlers.export_tasks))
+    app.add_handler(CommandHandler("importtasks", handlers.import_tasks))
+    app.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r'^/importtasks'), handlers.import_tasks
+    ))
     
     # Conversation для создания задачи
     conv_handler = ConversationHandler(
@@ -692,4 +916,5 @@ def register(app, db):
     app.add_handler(CallbackQueryHandler(handlers.motivate_team, pattern='^task_motivate$'))
     app.add_handler(CallbackQueryHandler(handlers.my_tasks, pattern='^task_my$'))
     app.add_handler(CallbackQueryHandler(handlers.team_tasks, pattern='^task_team$'))
-    app.add_handler(CallbackQueryHandler(handlers.all_tasks, pattern='^task_all$'))
\ No newline at end of file
+    app.add_handler(CallbackQueryHandler(handlers.all_tasks, pattern='^task_all$'))
+    app.add_handler(CallbackQueryHandler(handlers.change_status, pattern=r'^task_status:\d+:\d+:\w+$'))
@@ -2,6 +2,9 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
+TASK_STATUSES = ('new', 'in_progress', 'review', 'completed', 'cancelled')
+TASK_PRIORITIES = ('low', 'medium', 'high', 'critical')
+
 @dataclass
 class Task:
     id: Optional[int] = None
@@ -15,6 +18,7 @@ class Task:
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
+    version: int = 1
     
     def to_dict(self):
         return {
@@ -29,4 +33,26 @@ class Task:
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-        }
\ No newline at end of file
+            'version': self.version,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Task':
+        """Создать задачу из словаря (формат to_dict)"""
+        def parse_date(value):
+            return datetime.fromisoformat(value) if value else None
+        
+        return cls(
+            id=data.get('id'),
+            title=data.get('title', ''),
+            description=data.get('description') or '',
+            created_by=data.get('created_by') or 0,
+            assigned_to=data.get('assigned_to'),
+            priority=data.get('priority') or 'medium',
+            status=data.get('status') or 'new',
+            deadline=parse_date(data.get('deadline')),
+            created_at=parse_date(data.get('created_at')),
+            updated_at=parse_date(data.get('updated_at')),
+            completed_at=parse_date(data.get('completed_at')),
+            version=data.get('version') or 1,
+        )
\ No newline at end of file
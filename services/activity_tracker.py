@@ -0,0 +1,69 @@
+# services/activity_tracker.py
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+from services.user_cache import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+class ActivityTracker:
+    """Отложенная запись users.last_activity: время хранится в памяти
+    и сбрасывается в БД одним пакетом раз в N секунд и при остановке.
+    Активный пользователь не блокирует бота - флаг blocked_bot снимается."""
+
+    def __init__(self, db):
+        self.db = db
+        self._pending: Dict[int, datetime] = {}
+
+    def touch(self, telegram_id: int, when: Optional[datetime] = None):
+        """Отметить активность пользователя"""
+        self._pending[telegram_id] = when or datetime.now()
+
+    def get_last_seen(self, since: datetime) -> Dict[int, datetime]:
+        """Последняя активность пользователей, активных начиная с since (БД + память)
+
+        Ключ - Telegram ID; еще не записанные отметки перекрывают значения из БД.
+        """
+        cursor = self.db.conn.cursor()
+        cursor.execute(
+            'SELECT telegram_id, last_activity FROM users WHERE last_activity >= ?',
+            (since,)
+        )
+
+        seen = {row['telegram_id']: parse_timestamp(row['last_activity']) for row in cursor.fetchall()}
+        seen.update((tid, when) for tid, when in self._pending.items() if when >= since)
+        return seen
+
+    def is_pending(self, telegram_id: int) -> bool:
+        """Есть ли отметка, еще не записанная в БД"""
+        return telegram_id in self._pending
+
+    def flush(self) -> int:
+        """Записать накопленные отметки одним executemany"""
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        updates = [(seen, telegram_id, seen) for telegram_id, seen in pending.items()]
+
+        cursor = self.db.conn.cursor()
+        try:
+            cursor.executemany('''
+                UPDATE users SET last_activity = ?, blocked_bot = 0
+                WHERE telegram_id = ? AND (last_activity IS NULL OR last_activity < ?)
+            ''', updates)
+            self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка записи активности пользователей: {e}")
+            self.db.conn.rollback()
+            # Возвращаем отметки, не затирая более свежие
+            for telegram_id, seen in pending.items():
+                self._pending.setdefault(telegram_id, seen)
+            return 0
+
+        return len(updates)
+
+    async def flush_job(self, context):
+        """Периодическая задача JobQueue"""
+        self.flush()
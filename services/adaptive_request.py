@@ -0,0 +1,173 @@
+# services/adaptive_request.py
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Optional, Tuple
+
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class AimdLimiter:
+    """Ограничение одновременных запросов к Bot API по схеме AIMD
+
+    Ответ 2xx с нормальной задержкой увеличивает лимит на 1/лимит
+    (примерно +1 за каждое "окно" ответов); 429 (RetryAfter), 5xx и таймаут
+    уменьшают его в decrease раз. Прочие ответы и сетевые ошибки лимит не
+    меняют. Сигналы от запросов, начатых до последнего снижения, повторно
+    лимит не снижают. Пока сглаженная задержка выше latency_target, лимит
+    не растет.
+
+    Лимитер - главный ограничитель одновременных запросов к Bot API: через
+    него идут все вызовы бота, включая очередь исходящих (OutboundScheduler),
+    число воркеров которой не превышает API_CONCURRENCY_MAX.
+    """
+
+    EWMA_ALPHA = 0.2
+    # Сколько последних событий снижения хранить для метрик
+    EVENTS_KEPT = 20
+
+    def __init__(self, initial: Optional[float] = None, minimum: Optional[int] = None,
+                 maximum: Optional[int] = None, decrease: float = 0.5,
+                 latency_target: Optional[float] = None):
+        self.minimum = minimum or config.API_CONCURRENCY_MIN
+        self.maximum = maximum or config.API_CONCURRENCY_MAX
+        self.limit = float(initial or config.API_CONCURRENCY_INITIAL)
+        self.decrease = decrease
+        self.latency_target = latency_target or config.API_LATENCY_TARGET
+
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+        self.latency: Optional[float] = None
+        self.counters: Dict[str, int] = {
+            'requests': 0, 'success': 0, 'retry_after': 0, 'server_error': 0, 'timeout': 0,
+            'error': 0, 'decreases': 0,
+        }
+        self.peak_in_flight = 0
+        self.events: Deque[Tuple[datetime, str, float]] = deque(maxlen=self.EVENTS_KEPT)
+
+    # ==================== СЛОТЫ ====================
+
+    async def acquire(self) -> float:
+        """Дождаться свободного слота; возвращает момент начала запроса"""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.counters['requests'] += 1
+        return time.monotonic()
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    # ==================== СИГНАЛЫ ====================
+
+    def on_success(self, started: float):
+        self.counters['success'] += 1
+        latency = time.monotonic() - started
+        self.latency = latency if self.latency is None else (
+            self.EWMA_ALPHA * latency + (1 - self.EWMA_ALPHA) * self.latency
+        )
+
+        # Растем только когда лимит реально используется и API отвечает быстро
+        if self.latency <= self.latency_target and self.in_flight >= int(self.limit) - 1:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._wake()
+
+    def on_congestion(self, reason: str, started: float):
+        """Перегрузка: reason - 'retry_after', 'server_error' или 'timeout'"""
+        self.counters[reason] += 1
+        if started < self._last_decrease:
+            return  # запрос ушел до прошлого снижения - уже учтено
+
+        self._last_decrease = time.monotonic()
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        self.counters['decreases'] += 1
+        self.events.append((datetime.now(), reason, self.limit))
+        logger.warning(f"Bot API: {reason}, лимит одновременных запросов снижен до {int(self.limit)}")
+
+    def on_error(self):
+        """Ошибка, не говорящая о перегрузке (4xx, сетевой сбой): лимит не меняется"""
+        self.counters['error'] += 1
+
+    def metrics(self) -> Dict:
+        """Текущее состояние для мониторинга"""
+        return {
+            'limit': int(self.limit),
+            'limit_exact': round(self.limit, 2),
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'waiting': len(self._waiters),
+            'latency': self.latency,
+            **self.counters,
+            'events': list(self.events),
+        }
+
+
+class AdaptiveRequest(HTTPXRequest):
+    """HTTPXRequest с адаптивным числом одновременных запросов (AimdLimiter)
+
+    Пул соединений создается под максимальный лимит, фактическое число
+    запросов в полете задает лимитер. Ответы 429 и 5xx и таймауты - сигналы
+    перегрузки; сами ошибки по-прежнему поднимает PTB.
+    """
+
+    def __init__(self, limiter: Optional[AimdLimiter] = None, **kwargs):
+        self.limiter = limiter or AimdLimiter()
+        kwargs.setdefault('connection_pool_size', self.limiter.maximum)
+        super().__init__(**kwargs)
+
+    async def do_request(self, url: str, method: str, request_data=None,
+                         read_timeout=HTTPXRequest.DEFAULT_NONE,
+                         write_timeout=HTTPXRequest.DEFAULT_NONE,
+                         connect_timeout=HTTPXRequest.DEFAULT_NONE,
+                         pool_timeout=HTTPXRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        started = await self.limiter.acquire()
+        try:
+            code, payload = await super().do_request(
+                url, method, request_data,
+                read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+        except TimedOut:
+            self.limiter.on_congestion('timeout', started)
+            raise
+        except Exception:
+            self.limiter.on_error()
+            raise
+        finally:
+            self.limiter.release()
+
+        if 200 <= code < 300:
+            self.limiter.on_success(started)
+        elif code == 429:
+            self.limiter.on_congestion('retry_after', started)
+        elif code >= 500:
+            self.limiter.on_congestion('server_error', started)
+        else:
+            self.limiter.on_error()
+        return code, payload
@@ -0,0 +1,143 @@
+# services/admin_stats.py
+import logging
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы времени ответа (минуты); последняя корзина открытая
+RESPONSE_BUCKETS = (1, 2, 5, 10, 15, 30, 60, 120, 240, 480, 1440, 2880, 10080)
+
+def response_bucket(minutes: int) -> int:
+    """Номер корзины гистограммы для времени ответа"""
+    return bisect_left(RESPONSE_BUCKETS, max(minutes, 0))
+
+
+class AdminStats:
+    """Накопительная статистика администраторов: ответы, время ответа, задачи
+
+    Ответы учитываются в транзакции add_reply, задачи - триггерами на tasks.
+    Медиана и p95 оцениваются по гистограмме (верхняя граница корзины).
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def record_reply(self, cursor, admin_id: int, response_time: Optional[int]):
+        """Учесть ответ администратора (без commit - в транзакции вызывающего)
+
+        response_time передается только для первого ответа на обращение.
+        """
+        is_first = response_time is not None
+        cursor.execute('''
+            INSERT INTO admin_stats (admin_id, reply_count, response_count,
+                                     response_time_total, response_time_max, last_reply_at)
+            VALUES (?, 1, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(admin_id) DO UPDATE SET
+                reply_count = reply_count + 1,
+                response_count = response_count + excluded.response_count,
+                response_time_total = response_time_total + excluded.response_time_total,
+                response_time_max = MAX(response_time_max, excluded.response_time_max),
+                last_reply_at = excluded.last_reply_at,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (admin_id, int(is_first), response_time or 0, response_time or 0))
+
+        if is_first:
+            cursor.execute('''
+                INSERT INTO admin_response_histogram (admin_id, bucket, count)
+                VALUES (?, ?, 1)
+                ON CONFLICT(admin_id, bucket) DO UPDATE SET count = count + 1
+            ''', (admin_id, response_bucket(response_time)))
+
+    def get_all(self) -> List[Dict]:
+        """Статистика всех администраторов с медианой и p95 (два запроса)"""
+        cursor = self.db.conn.cursor()
+
+        cursor.execute('''
+            SELECT s.*, a.username
+            FROM admin_stats s
+            LEFT JOIN admins a ON a.telegram_id = s.admin_id
+            ORDER BY s.reply_count DESC, s.admin_id
+        ''')
+        stats = [dict(row) for row in cursor.fetchall()]
+
+        cursor.execute('SELECT admin_id, bucket, count FROM admin_response_histogram ORDER BY admin_id, bucket')
+        histograms: Dict[int, List] = {}
+        for row in cursor.fetchall():
+            histograms.setdefault(row['admin_id'], []).append((row['bucket'], row['count']))
+
+        for item in stats:
+            histogram = histograms.get(item['admin_id'], [])
+            item['avg_response_time'] = (
+                item['response_time_total'] / item['response_count'] if item['response_count'] else None
+            )
+            item['median_response_time'] = self.percentile(histogram, 0.5, item['response_time_max'])
+            item['p95_response_time'] = self.percentile(histogram, 0.95, item['response_time_max'])
+
+        return stats
+
+    def get(self, admin_id: int) -> Optional[Dict]:
+        """Статистика одного администратора"""
+        for item in self.get_all():
+            if item['admin_id'] == admin_id:
+                return item
+        return None
+
+    @staticmethod
+    def percentile(histogram: List, q: float, max_value: int) -> Optional[int]:
+        """Оценка перцентиля по гистограмме [(корзина, количество), ...]"""
+        total = sum(count for _, count in histogram)
+        if not total:
+            return None
+
+        threshold = q * total
+        seen = 0
+        for bucket, count in histogram:
+            seen += count
+            if seen >= threshold:
+                if bucket >= len(RESPONSE_BUCKETS):
+                    return max_value
+                return min(RESPONSE_BUCKETS[bucket], max_value)
+        return max_value
+
+    def rebuild(self):
+        """Пересчитать статистику с нуля по replies, messages и tasks"""
+        cursor = self.db.conn.cursor()
+
+        try:
+            cursor.execute('DELETE FROM admin_stats')
+            cursor.execute('DELETE FROM admin_response_histogram')
+
+            # Задачи: открытые и завершенные по исполнителю
+            cursor.execute('''
+                INSERT INTO admin_stats (admin_id, open_tasks, completed_tasks)
+                SELECT assigned_to,
+                       SUM(status IN ('new', 'in_progress', 'review')),
+                       SUM(status = 'completed')
+                FROM tasks
+                WHERE assigned_to IS NOT NULL
+                GROUP BY assigned_to
+            ''')
+
+            # Ответы: время ответа засчитывается автору первого ответа на обращение
+            cursor.execute('''
+                SELECT a.telegram_id AS admin_id, r.created_at,
+                       CASE WHEN r.id = first.reply_id THEN m.response_time END AS response_time
+                FROM replies r
+                JOIN admins a ON a.id = r.admin_id
+                JOIN messages m ON m.id = r.message_id
+                JOIN (SELECT message_id, MIN(id) AS reply_id FROM replies GROUP BY message_id) first
+                    ON first.message_id = r.message_id
+                ORDER BY r.id
+            ''')
+            for row in cursor.fetchall():
+                self.record_reply(self.db.conn.cursor(), row['admin_id'], row['response_time'])
+                self.db.conn.execute(
+                    'UPDATE admin_stats SET last_reply_at = ? WHERE admin_id = ?',
+                    (row['created_at'], row['admin_id'])
+                )
+
+            self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка пересчета статистики администраторов: {e}")
+            self.db.conn.rollback()
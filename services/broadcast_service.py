@@ -0,0 +1,251 @@
+# services/broadcast_service.py
+import asyncio
+import logging
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden
+
+from config import config
+from services.outbound import PRIORITY_BROADCAST
+from services.segment_index import Bitmap, SegmentError
+from services.user_cache import ACTIVE_BAN_SQL
+
+logger = logging.getLogger(__name__)
+
+class BroadcastService:
+    """Рассылка всем пользователям или сегменту с контрольными точками
+
+    Получатели читаются из users страницами по ключу (id > последнего
+    обработанного), отправляются через общую очередь db.outbound, после
+    каждой страницы прогресс и last_user_id фиксируются в broadcasts.
+    После перезапуска незавершенные рассылки продолжаются с контрольной
+    точки. Заблокировавшие бота отмечаются в users.blocked_bot и
+    пропускаются в следующих рассылках.
+    """
+
+    # Кому рассылаем: без действующего бана и не заблокировавшие бота
+    RECIPIENT_CONDITION = f'NOT {ACTIVE_BAN_SQL} AND blocked_bot = 0'
+
+    def __init__(self, db):
+        self.db = db
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    # ==================== СОЗДАНИЕ ====================
+
+    def create(self, text: str, created_by: int, segment: Optional[str] = None) -> Optional[int]:
+        """Создать рассылку; получатели считаются один раз при создании
+
+        segment - выражение SegmentIndex; ошибка в нем выбрасывает SegmentError.
+        """
+        total = len(self.audience(segment)) if segment else None
+        cursor = self.db.conn.cursor()
+
+        try:
+            cursor.execute(f'''
+                INSERT INTO broadcasts (text, created_by, segment, total)
+                SELECT ?, ?, ?, COALESCE(?, COUNT(*)) FROM users WHERE {self.RECIPIENT_CONDITION}
+            ''', (text, created_by, segment, total))
+            self.db.conn.commit()
+            return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Ошибка создания рассылки: {e}")
+            self.db.conn.rollback()
+            return None
+
+    def audience(self, segment: str) -> Bitmap:
+        """users.id получателей сегмента (без забаненных и заблокировавших бота)"""
+        segments = self.db.segments
+        return segments.resolve(segment) - segments.banned() - segments.flags['blocked']
+
+    def set_status_message(self, broadcast_id: int, chat_id: int, message_id: int):
+        """Запомнить сообщение, в котором показывается прогресс"""
+        self.db.conn.execute(
+            'UPDATE broadcasts SET status_chat_id = ?, status_message_id = ? WHERE id = ?',
+            (chat_id, message_id, broadcast_id)
+        )
+        self.db.conn.commit()
+
+    def get(self, broadcast_id: int) -> Optional[Dict]:
+        cursor = self.db.conn.cursor()
+        cursor.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def get_running_ids(self) -> List[int]:
+        cursor = self.db.conn.cursor()
+        cursor.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [row['id'] for row in cursor.fetchall()]
+
+    # ==================== ЗАПУСК ====================
+
+    def start(self, application, broadcast_id: int):
+        """Запустить рассылку фоновой задачей приложения"""
+        task = self._tasks.get(broadcast_id)
+        if task is not None and not task.done():
+            return
+        self._tasks[broadcast_id] = application.create_task(self.run(application.bot, broadcast_id))
+
+    async def resume(self, context):
+        """Задача JobQueue при старте: продолжить незавершенные рассылки"""
+        for broadcast_id in self.get_running_ids():
+            logger.info(f"Продолжение рассылки #{broadcast_id}")
+            self.start(context.application, broadcast_id)
+
+    async def run(self, bot, broadcast_id: int):
+        broadcast = self.get(broadcast_id)
+        if not broadcast or broadcast['status'] != 'running':
+            return
+
+        # Сегмент вычисляется заново при каждом запуске; ключ users.id исключает повторы
+        try:
+            audience = self.audience(broadcast['segment']) if broadcast['segment'] else None
+        except SegmentError as e:
+            # Сохраненное выражение перестало разбираться - повторный запуск не поможет
+            logger.error(f"Рассылка #{broadcast_id}: ошибка сегмента: {e}")
+            await self._fail(bot, broadcast, f"ошибка в сегменте: {e}")
+            return
+
+        loop = asyncio.get_running_loop()
+        last_progress = 0.0
+
+        while True:
+            recipients, last_user_id = self._next_page(broadcast['last_user_id'], audience)
+            if last_user_id is None:
+                break
+
+            futures = [
+                self.db.outbound.submit(bot, telegram_id, broadcast['text'], PRIORITY_BROADCAST)
+                for _, telegram_id in recipients
+            ]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+
+            sent = failed = 0
+            blocked = []
+            for (user_id, _), result in zip(recipients, results):
+                if not isinstance(result, Exception):
+                    sent += 1
+                elif self.is_unreachable(result):
+                    # Бот заблокирован или чат больше не существует
+                    blocked.append((user_id,))
+                else:
+                    failed += 1
+                    logger.error(f"Рассылка #{broadcast_id}: ошибка отправки пользователю {user_id}: {result}")
+
+            broadcast['last_user_id'] = last_user_id
+            broadcast['sent'] += sent
+            broadcast['failed'] += failed
+            broadcast['blocked'] += len(blocked)
+            self._checkpoint(broadcast, blocked)
+
+            if loop.time() - last_progress >= config.BROADCAST_PROGRESS_INTERVAL:
+                last_progress = loop.time()
+                await self._show_progress(bot, broadcast)
+
+        broadcast['status'] = 'completed'
+        self._checkpoint(broadcast, [])
+        await self._show_progress(bot, broadcast)
+        logger.info(
+            f"Рассылка #{broadcast_id} завершена: отправлено {broadcast['sent']}, "
+            f"заблокировали {broadcast['blocked']}, ошибок {broadcast['failed']}"
+        )
+
+    async def _fail(self, bot, broadcast: Dict, reason: str):
+        """Остановить рассылку со статусом failed и сообщить автору"""
+        broadcast['status'] = 'failed'
+        self._checkpoint(broadcast, [])
+        await self._show_progress(bot, broadcast)
+
+        try:
+            await self.db.outbound.send(
+                bot, broadcast['created_by'], f"❌ Рассылка #{broadcast['id']} остановлена: {reason}"
+            )
+        except Exception as e:
+            logger.error(f"Не удалось сообщить об ошибке рассылки #{broadcast['id']}: {e}")
+
+    @staticmethod
+    def is_unreachable(error: Exception) -> bool:
+        """Пользователь недоступен навсегда (а не ошибка конкретного сообщения)"""
+        if isinstance(error, Forbidden):
+            return True
+        return isinstance(error, BadRequest) and 'chat not found' in str(error).lower()
+
+    def _next_page(self, after_user_id: int,
+                   audience: Optional[Bitmap] = None) -> Tuple[List[tuple], Optional[int]]:
+        """Следующая страница получателей по ключу users.id
+
+        Возвращает ([(id, telegram_id), ...], новая контрольная точка или None в конце).
+        """
+        cursor = self.db.conn.cursor()
+
+        if audience is None:
+            cursor.execute(f'''
+                SELECT id, telegram_id FROM users
+                WHERE id > ? AND {self.RECIPIENT_CONDITION}
+                ORDER BY id
+                LIMIT ?
+            ''', (after_user_id, config.BROADCAST_PAGE_SIZE))
+            recipients = [(row['id'], row['telegram_id']) for row in cursor.fetchall()]
+            return recipients, recipients[-1][0] if recipients else None
+
+        ids = list(islice(audience.iter_after(after_user_id), config.BROADCAST_PAGE_SIZE))
+        if not ids:
+            return [], None
+
+        cursor.execute(f'''
+            SELECT id, telegram_id FROM users
+            WHERE id IN ({', '.join('?' * len(ids))}) AND {self.RECIPIENT_CONDITION}
+            ORDER BY id
+        ''', ids)
+        return [(row['id'], row['telegram_id']) for row in cursor.fetchall()], ids[-1]
+
+    def _checkpoint(self, broadcast: Dict, blocked: List[tuple]):
+        """Зафиксировать прогресс страницы и заблокировавших бота одной транзакцией"""
+        cursor = self.db.conn.cursor()
+        try:
+            cursor.executemany('UPDATE users SET blocked_bot = 1 WHERE id = ?', blocked)
+            cursor.execute('''
+                UPDATE broadcasts
+                SET last_user_id = ?, sent = ?, failed = ?, blocked = ?, status = ?,
+                    finished_at = CASE WHEN ? != 'running' THEN CURRENT_TIMESTAMP END
+                WHERE id = ?
+            ''', (broadcast['last_user_id'], broadcast['sent'], broadcast['failed'],
+                  broadcast['blocked'], broadcast['status'], broadcast['status'], broadcast['id']))
+            self.db.conn.commit()
+            for (user_id,) in blocked:
+                self.db.segments.set_flag('blocked', user_id)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения прогресса рассылки #{broadcast['id']}: {e}")
+            self.db.conn.rollback()
+
+    # ==================== ПРОГРЕСС ====================
+
+    @staticmethod
+    def render_progress(broadcast: Dict) -> str:
+        done = broadcast['sent'] + broadcast['failed'] + broadcast['blocked']
+        total = max(broadcast['total'], done)
+        percent = done / total if total else 1
+        header = {
+            'completed': f"✅ Рассылка #{broadcast['id']} завершена",
+            'failed': f"❌ Рассылка #{broadcast['id']} остановлена",
+        }.get(broadcast['status'], f"📢 Рассылка #{broadcast['id']}: {percent:.0%}")
+        return (
+            f"{header}\n\n"
+            f"Обработано: {done} из {total}\n"
+            f"✅ Доставлено: {broadcast['sent']}\n"
+            f"🚫 Заблокировали бота: {broadcast['blocked']}\n"
+            f"❌ Ошибки: {broadcast['failed']}"
+        )
+
+    async def _show_progress(self, bot, broadcast: Dict):
+        if not broadcast['status_message_id']:
+            return
+        try:
+            await bot.edit_message_text(
+                chat_id=broadcast['status_chat_id'],
+                message_id=broadcast['status_message_id'],
+                text=self.render_progress(broadcast)
+            )
+        except Exception as e:
+            # "message is not modified" и удаленное сообщение не мешают рассылке
+            logger.debug(f"Не удалось обновить прогресс рассылки #{broadcast['id']}: {e}")
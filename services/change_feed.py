@@ -0,0 +1,135 @@
+# services/change_feed.py
+import json
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ChangeFeed:
+    """Чтение журнала изменений (change_log) с сохраняемой позицией потребителя
+
+    Потребитель с фильтром по таблицам сдвигает позицию и за чужие события,
+    иначе они держали бы очистку журнала. Прочитанные всеми потребителями
+    события удаляет prune (задача prune_job раз в CHANGE_LOG_PRUNE_INTERVAL).
+    """
+
+    def __init__(self, db, consumer: str, tables: Optional[Iterable[str]] = None,
+                 batch_size: int = 500):
+        self.db = db
+        self.consumer = consumer
+        self.tables = tuple(tables) if tables else ()
+        self.batch_size = batch_size
+
+        cursor = self.db.conn.cursor()
+        cursor.execute(
+            'INSERT OR IGNORE INTO change_cursors (consumer, last_event_id) VALUES (?, 0)',
+            (consumer,)
+        )
+        self.db.conn.commit()
+
+    def head(self) -> int:
+        """ID последнего события в журнале"""
+        cursor = self.db.conn.cursor()
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM change_log')
+        return cursor.fetchone()[0]
+
+    def get_cursor(self) -> int:
+        """Получить ID последнего обработанного события"""
+        cursor = self.db.conn.cursor()
+        cursor.execute(
+            'SELECT last_event_id FROM change_cursors WHERE consumer = ?',
+            (self.consumer,)
+        )
+        row = cursor.fetchone()
+        return row['last_event_id'] if row else 0
+
+    def read_batch(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> List[Dict]:
+        """Прочитать очередную пачку событий после позиции (позиция не сдвигается)"""
+        if after_id is None:
+            after_id = self.get_cursor()
+
+        query = 'SELECT * FROM change_log WHERE id > ?'
+        params: list = [after_id]
+
+        if self.tables:
+            query += f" AND table_name IN ({', '.join('?' for _ in self.tables)})"
+            params.extend(self.tables)
+
+        query += ' ORDER BY id LIMIT ?'
+        params.append(limit or self.batch_size)
+
+        cursor = self.db.conn.cursor()
+        cursor.execute(query, params)
+
+        events = []
+        for row in cursor.fetchall():
+            event = dict(row)
+            event['payload'] = json.loads(event['payload']) if event['payload'] else {}
+            events.append(event)
+        return events
+
+    def commit(self, last_event_id: int):
+        """Сохранить позицию потребителя"""
+        cursor = self.db.conn.cursor()
+        cursor.execute('''
+            UPDATE change_cursors
+            SET last_event_id = MAX(last_event_id, ?), updated_at = CURRENT_TIMESTAMP
+            WHERE consumer = ?
+        ''', (last_event_id, self.consumer))
+        self.db.conn.commit()
+
+    def consume(self, handler: Callable[[List[Dict]], None],
+                max_batches: Optional[int] = None) -> int:
+        """Обработать накопившиеся события пачками; позиция сохраняется после каждой пачки"""
+        processed = 0
+        batches = 0
+        head = self.head()
+        last_id = self.get_cursor()
+
+        while max_batches is None or batches < max_batches:
+            events = self.read_batch(after_id=last_id)
+            if events:
+                handler(events)
+                last_id = events[-1]['id']
+                processed += len(events)
+                batches += 1
+
+            if len(events) < self.batch_size:
+                # Все подходящие события до head прочитаны - остальные не наши
+                self.commit(max(last_id, head))
+                break
+            self.commit(last_id)
+
+        return processed
+
+    def reset(self, last_event_id: int = 0):
+        """Перемотать позицию потребителя (например, для полной перестройки)"""
+        cursor = self.db.conn.cursor()
+        cursor.execute('''
+            UPDATE change_cursors
+            SET last_event_id = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE consumer = ?
+        ''', (last_event_id, self.consumer))
+        self.db.conn.commit()
+
+    @staticmethod
+    def prune(db) -> int:
+        """Удалить события, которые уже прочитали все потребители"""
+        cursor = db.conn.cursor()
+        cursor.execute('SELECT MIN(last_event_id) FROM change_cursors')
+        row = cursor.fetchone()
+
+        if not row or row[0] is None:
+            return 0
+
+        cursor.execute('DELETE FROM change_log WHERE id <= ?', (row[0],))
+        deleted = cursor.rowcount
+        db.conn.commit()
+
+        if deleted > 0:
+            logger.info(f"Журнал изменений: удалено {deleted} обработанных событий")
+        return deleted
+
+    async def prune_job(self, context):
+        """Периодическая задача JobQueue (очистка общая для всех потребителей)"""
+        self.prune(self.db)
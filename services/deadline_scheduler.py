@@ -0,0 +1,139 @@
+# services/deadline_scheduler.py
+import heapq
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from services.notification_service import NotificationService
+from services.task_tracker import OPEN_STATUSES, TaskTracker
+from services.user_cache import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+class DeadlineScheduler(TaskTracker):
+    """Оповещения о просрочке ровно в момент дедлайна
+
+    Ближайшие дедлайны открытых задач лежат в min-куче; в JobQueue всегда
+    стоит одна задача run_once на самый ранний из них. Изменения задач
+    приходят от TaskService, устаревшие элементы кучи отбрасываются лениво.
+    При срабатывании просрочка учитывается в счетчиках команд только для
+    наступивших задач (Database.mark_tasks_overdue). Новый дедлайн или
+    переоткрытие задачи снимает отметку overdue_notified_at (триггер), и
+    задача снова попадает в кучу через track.
+    """
+
+    JOB_NAME = 'deadline_alerts'
+    # Загружаются только задачи, о просрочке которых еще не сообщали
+    SEED_CONDITION = 'deadline IS NOT NULL AND overdue_notified_at IS NULL'
+
+    def __init__(self, db):
+        super().__init__(db)
+        self.job_queue = None
+        self._job = None
+        self._armed_at: Optional[datetime] = None
+        self.reload()
+
+    def reset(self):
+        self._deadlines: Dict[int, datetime] = {}
+        self._heap: List[Tuple[datetime, int]] = []
+
+    def start(self, job_queue):
+        """Подключить JobQueue и поставить таймер на ближайший дедлайн"""
+        self.job_queue = job_queue
+        self._arm()
+
+    # ==================== ОБНОВЛЕНИЕ ====================
+
+    def track(self, task_id: int, assigned_to, priority: str, status: str, deadline=None):
+        deadline = parse_timestamp(deadline)
+        if status not in OPEN_STATUSES or deadline is None:
+            self.untrack(task_id)
+            return
+
+        if self._deadlines.get(task_id) == deadline:
+            return
+
+        self._deadlines[task_id] = deadline
+        heapq.heappush(self._heap, (deadline, task_id))
+        if self._armed_at is None or deadline < self._armed_at:
+            self._arm()
+
+    def untrack(self, task_id: int):
+        # Элемент кучи остается и будет отброшен при срабатывании
+        self._deadlines.pop(task_id, None)
+
+    def is_tracked(self, task_id: int) -> bool:
+        return task_id in self._deadlines
+
+    def next_deadline(self) -> Optional[datetime]:
+        """Ближайший актуальный дедлайн"""
+        while self._heap:
+            deadline, task_id = self._heap[0]
+            if self._deadlines.get(task_id) == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: Optional[datetime] = None) -> List[int]:
+        """Снять с кучи задачи, дедлайн которых наступил"""
+        now = now or datetime.now()
+        due = []
+
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                break
+            _, task_id = heapq.heappop(self._heap)
+            del self._deadlines[task_id]
+            due.append(task_id)
+
+        return due
+
+    # ==================== ТАЙМЕР ====================
+
+    def _arm(self):
+        """Переставить run_once на ближайший дедлайн"""
+        if self.job_queue is None:
+            return
+
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+
+        deadline = self.next_deadline()
+        self._armed_at = deadline
+        if deadline is None:
+            return
+
+        # Дедлайны хранятся в локальном времени - передаем задержку, а не datetime
+        delay = max((deadline - datetime.now()).total_seconds(), 0)
+        self._job = self.job_queue.run_once(self._fire, when=delay, name=self.JOB_NAME)
+
+    async def _fire(self, context):
+        """Разослать оповещения по наступившим дедлайнам и перезапустить таймер"""
+        self._job = None
+        self._armed_at = None
+        due = self.pop_due()
+
+        try:
+            if due:
+                await self._alert(context.bot, due)
+        finally:
+            self._arm()
+
+    async def _alert(self, bot, task_ids: List[int]):
+        cursor = self.db.conn.cursor()
+        try:
+            cursor.executemany(
+                'UPDATE tasks SET overdue_notified_at = CURRENT_TIMESTAMP WHERE id = ?',
+                [(task_id,) for task_id in task_ids]
+            )
+            self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка отметки оповещений о просрочке: {e}")
+            self.db.conn.rollback()
+
+        # Задачи стали просроченными без изменения строк - учитываем только их
+        self.db.mark_tasks_overdue(task_ids)
+
+        await NotificationService(bot, self.db).notify_overdue(task_ids)
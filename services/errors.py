@@ -0,0 +1,16 @@
+# services/errors.py
+from typing import Optional
+
+class VersionConflict(Exception):
+    """Запись была изменена другим обработчиком (оптимистичная блокировка)"""
+    
+    def __init__(self, entity: str, key, expected_version: Optional[int],
+                 current_version: Optional[int]):
+        self.entity = entity
+        self.key = key
+        self.expected_version = expected_version
+        self.current_version = current_version
+        super().__init__(
+            f"Конфликт версий {entity} {key}: "
+            f"ожидалась {expected_version}, текущая {current_version}"
+        )
@@ -0,0 +1,111 @@
+# services/export_service.py
+import csv
+import gzip
+import io
+import json
+import logging
+import sqlite3
+import tempfile
+from datetime import date, timedelta
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = [
+    'message_id', 'created_at', 'category', 'status', 'text',
+    'replied_at', 'response_time', 'reply_id', 'reply_text', 'reply_created_at',
+]
+
+class ExportService:
+    """Потоковая выгрузка истории обращений в JSONL/CSV"""
+
+    def __init__(self, db, fetch_size: int = 500):
+        self.db = db
+        self.fetch_size = fetch_size
+
+    def iter_rows(self, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                  category: Optional[str] = None) -> Iterator[Dict]:
+        """Итерировать обращения с ответами, читая курсор пачками"""
+        query = '''
+            SELECT m.id AS message_id, m.created_at, m.category, m.status, m.text,
+                   m.replied_at, m.response_time,
+                   r.id AS reply_id, r.text AS reply_text, r.created_at AS reply_created_at
+            FROM messages m
+            LEFT JOIN replies r ON r.message_id = m.id
+            WHERE 1=1
+        '''
+        params = []
+
+        if date_from:
+            query += " AND m.created_at >= ?"
+            params.append(date_from.isoformat())
+        if date_to:
+            query += " AND m.created_at < ?"
+            params.append((date_to + timedelta(days=1)).isoformat())
+        if category:
+            query += " AND m.category = ?"
+            params.append(category)
+
+        query += " ORDER BY m.id, r.id"
+
+        # Отдельное соединение: выгрузка не мешает транзакциям бота
+        conn = sqlite3.connect(self.db.db_name)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+
+                batch = self.db.decrypt_rows(
+                    [dict(row) for row in rows],
+                    {'text': 'messages', 'reply_text': 'replies'}
+                )
+                yield from batch
+        finally:
+            conn.close()
+
+    def write(self, stream, fmt: str = 'jsonl', **filters) -> int:
+        """Записать выгрузку в бинарный поток; возвращает количество строк"""
+        text_stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        count = 0
+
+        try:
+            if fmt == 'csv':
+                writer = csv.DictWriter(text_stream, fieldnames=EXPORT_FIELDS)
+                writer.writeheader()
+                for row in self.iter_rows(**filters):
+                    writer.writerow(row)
+                    count += 1
+            else:
+                for row in self.iter_rows(**filters):
+                    text_stream.write(json.dumps(row, ensure_ascii=False))
+                    text_stream.write('\n')
+                    count += 1
+        finally:
+            text_stream.flush()
+            text_stream.detach()
+
+        return count
+
+    def export_to_file(self, fmt: str = 'jsonl', compress: bool = False,
+                       **filters) -> Tuple[tempfile.SpooledTemporaryFile, str, int]:
+        """Выгрузить во временный файл; возвращает (файл, имя файла, количество строк)"""
+        fmt = 'csv' if fmt == 'csv' else 'jsonl'
+        filename = f"feedback_{date.today().isoformat()}.{fmt}"
+
+        output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+
+        if compress:
+            filename += '.gz'
+            with gzip.GzipFile(fileobj=output, mode='wb') as gz:
+                count = self.write(gz, fmt, **filters)
+        else:
+            count = self.write(output, fmt, **filters)
+
+        output.seek(0)
+        logger.info(f"Выгрузка {filename}: {count} строк")
+        return output, filename, count
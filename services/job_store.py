@@ -0,0 +1,223 @@
+# services/job_store.py
+import asyncio
+import logging
+import pickle
+from typing import Callable, Dict, Optional, Tuple
+
+from apscheduler.job import Job as SchedulerJob
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.util import datetime_to_utc_timestamp
+from telegram.ext import Job, JobQueue
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+def callback_key(callback: Callable) -> str:
+    """Имя колбэка для сохранения в БД (метод - по классу владельца)"""
+    owner = getattr(callback, '__self__', None)
+    if owner is not None:
+        return f"{type(owner).__name__}.{callback.__name__}"
+    return f"{callback.__module__}.{callback.__qualname__}"
+
+
+# Поля задачи планировщика, которые сохраняются в БД (func и args у задач PTB всегда одни)
+JOB_FIELDS = ('id', 'trigger', 'executor', 'name', 'misfire_grace_time',
+              'coalesce', 'max_instances', 'next_run_time')
+
+
+class SQLiteJobStore(MemoryJobStore):
+    """Хранилище задач JobQueue в таблице scheduled_jobs
+
+    Планировщик работает с копией в памяти (MemoryJobStore), изменения
+    пишутся в БД пакетом через JOB_STORE_FLUSH_DELAY секунд и при остановке.
+    При старте задачи восстанавливаются одним чтением по индексу
+    next_run_time; пропущенные за время простоя запуски схлопываются
+    (coalesce) в один, если укладываются в JOB_MISFIRE_GRACE_TIME.
+
+    Аргументы задач PTB (JobQueue, Job) не сериализуются: колбэк хранится
+    по имени и при загрузке берется из зарегистрированных в attach.
+    """
+
+    ALIAS = 'persistent'
+
+    def __init__(self, db, flush_delay: Optional[float] = None):
+        super().__init__()
+        self.db = db
+        self.flush_delay = config.JOB_STORE_FLUSH_DELAY if flush_delay is None else flush_delay
+        self.job_queue = None
+        self._callbacks: Dict[str, Callable] = {}
+        self._dirty: Dict[str, Optional[Tuple[Optional[float], bytes]]] = {}  # id -> строка или None (удаление)
+        self._flush_handle = None
+
+    def attach(self, job_queue, *callbacks: Callable):
+        """Подключить хранилище к планировщику JobQueue и зарегистрировать колбэки
+
+        Вызывается после сборки Application: JobQueue.set_application
+        перенастраивает планировщик (scheduler.configure), а это сбрасывает
+        подключенные к нему хранилища.
+        """
+        self.job_queue = job_queue
+        for callback in callbacks:
+            self._callbacks[callback_key(callback)] = callback
+
+        job_queue.scheduler.add_jobstore(self, self.ALIAS)
+
+    def job_kwargs(self, job_id: str) -> Dict:
+        """job_kwargs для run_once/run_daily/...: задача с постоянным ID в этом хранилище"""
+        return {
+            'jobstore': self.ALIAS,
+            'id': job_id,
+            'replace_existing': True,
+            'coalesce': True,
+            'misfire_grace_time': config.JOB_MISFIRE_GRACE_TIME,
+        }
+
+    # ==================== ЗАГРУЗКА ====================
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+
+        cursor = self.db.conn.cursor()
+        cursor.execute('SELECT id, job_state FROM scheduled_jobs ORDER BY next_run_time')
+        restored = 0
+        for row in cursor.fetchall():
+            try:
+                job = self._restore(scheduler, row['job_state'])
+            except Exception as e:
+                logger.warning(f"Задача планировщика {row['id']} не восстановлена и будет удалена: {e}")
+                self._mark(row['id'], None)
+                continue
+
+            # Мимо add_job: строка в БД уже актуальна
+            super().add_job(job)
+            restored += 1
+
+        if restored:
+            logger.info(f"✅ Восстановлено задач планировщика: {restored}")
+
+    def _restore(self, scheduler, blob: bytes) -> SchedulerJob:
+        state = pickle.loads(blob)
+        callback = self._callbacks.get(state['callback'])
+        if callback is None:
+            raise LookupError(f"колбэк {state['callback']} не зарегистрирован")
+
+        ext_job = Job(
+            callback=callback, data=state['data'], name=state['name'],
+            chat_id=state['chat_id'], user_id=state['user_id']
+        )
+        job = SchedulerJob(
+            scheduler, func=JobQueue.job_callback, args=(self.job_queue, ext_job), kwargs={},
+            **{field: state['job'][field] for field in JOB_FIELDS}
+        )
+        Job.from_aps_job(job)  # связывает ext_job с задачей планировщика
+        return job
+
+    def _state(self, job: SchedulerJob) -> Dict:
+        """Сохраняемое состояние задачи: поля планировщика и Job PTB"""
+        ext_job = job.args[1]
+        key = callback_key(ext_job.callback)
+        if key not in self._callbacks:
+            raise ValueError(f"Колбэк {key} не зарегистрирован в SQLiteJobStore.attach")
+
+        return {
+            'job': {field: getattr(job, field) for field in JOB_FIELDS},
+            'callback': key,
+            'data': ext_job.data,
+            'name': ext_job.name,
+            'chat_id': ext_job.chat_id,
+            'user_id': ext_job.user_id,
+        }
+
+    @staticmethod
+    def _definition(state: Dict) -> Dict:
+        """Состояние без времени следующего запуска (триггер - в сериализованном виде)"""
+        job = {field: value for field, value in state['job'].items() if field != 'next_run_time'}
+        job['trigger'] = pickle.dumps(job['trigger'], pickle.HIGHEST_PROTOCOL)
+        return {**state, 'job': job}
+
+    def _serialize(self, job: SchedulerJob) -> Tuple[Optional[float], bytes]:
+        blob = pickle.dumps(self._state(job), pickle.HIGHEST_PROTOCOL)
+        return datetime_to_utc_timestamp(job.next_run_time), blob
+
+    # ==================== ИЗМЕНЕНИЯ ====================
+
+    def add_job(self, job: SchedulerJob):
+        restored = self.lookup_job(job.id)
+        if restored is not None and (
+            self._definition(self._state(restored)) == self._definition(self._state(job))
+        ):
+            # Та же задача, восстановленная после перезапуска: сохраняем ее
+            # время запуска, чтобы пропущенный запуск не потерялся. Если
+            # изменилось что-то кроме времени запуска, задача заменяется
+            return
+
+        row = self._serialize(job)
+        super().add_job(job)
+        self._mark(job.id, row)
+
+    def update_job(self, job: SchedulerJob):
+        row = self._serialize(job)
+        super().update_job(job)
+        self._mark(job.id, row)
+
+    def remove_job(self, job_id: str):
+        super().remove_job(job_id)
+        self._mark(job_id, None)
+
+    def remove_all_jobs(self):
+        for job_id in list(self._jobs_index):
+            self._mark(job_id, None)
+        super().remove_all_jobs()
+
+    def shutdown(self):
+        self.flush()
+        # Очищаем только память: задачи остаются в БД до следующего запуска
+        super().remove_all_jobs()
+
+    # ==================== ЗАПИСЬ ====================
+
+    def _mark(self, job_id: str, row: Optional[Tuple[Optional[float], bytes]]):
+        self._dirty[job_id] = row
+        if self._flush_handle is not None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(self.flush_delay, self.flush)
+
+    def flush(self) -> int:
+        """Записать накопленные изменения одной транзакцией"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._dirty:
+            return 0
+
+        dirty, self._dirty = self._dirty, {}
+        upserts = [(job_id, row[0], row[1]) for job_id, row in dirty.items() if row is not None]
+        deletes = [(job_id,) for job_id, row in dirty.items() if row is None]
+
+        cursor = self.db.conn.cursor()
+        try:
+            cursor.executemany('''
+                INSERT INTO scheduled_jobs (id, next_run_time, job_state) VALUES (?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    next_run_time = excluded.next_run_time,
+                    job_state = excluded.job_state
+            ''', upserts)
+            cursor.executemany('DELETE FROM scheduled_jobs WHERE id = ?', deletes)
+            self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка записи задач планировщика: {e}")
+            self.db.conn.rollback()
+            # Возвращаем изменения, не затирая более свежие
+            for job_id, row in dirty.items():
+                self._dirty.setdefault(job_id, row)
+            return 0
+
+        return len(dirty)
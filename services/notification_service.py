@@ -1,6 +1,12 @@
 # services/notification_service.py
-import asyncio
-from datetime import datetime, timedelta
+import logging
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+from services.outbound import PRIORITY_NOTIFICATION
+from services.task_service import TaskService
+
+logger = logging.getLogger(__name__)
 
 class NotificationService:
     def __init__(self, bot, db):
@@ -9,48 +15,71 @@ class NotificationService:
         self.task_service = TaskService(db)
     
     async def check_overdue_tasks(self):
-        """Проверка просроченных задач"""
-        overdue_tasks = self.task_service.get_overdue_tasks()
+        """Проверка просроченных задач (полный проход; штатно оповещает DeadlineScheduler)"""
+        await self.send_overdue_alerts(self.task_service.get_overdue_tasks())
+    
+    async def notify_overdue(self, task_ids: Iterable[int]):
+        """Оповестить исполнителей о просрочке указанных задач"""
+        await self.send_overdue_alerts(self.task_service.get_tasks_by_ids(task_ids))
+    
+    async def send_overdue_alerts(self, tasks):
+        """Оповещения исполнителям о просроченных задачах (параллельно через очередь отправки)"""
+        messages = [
+            (task.assigned_to, self.render_overdue_alert(task))
+            for task in tasks if task.assigned_to
+        ]
+        await self.db.outbound.send_many(self.bot, messages, parse_mode='Markdown')
+    
+    async def send_overdue_alert(self, task):
+        """Оповещение исполнителю о просроченной задаче"""
+        await self.send_overdue_alerts([task])
+    
+    @staticmethod
+    def render_overdue_alert(task) -> str:
+        return (
+            f"🚨 *ЗАДАЧА ПРОСРОЧЕНА!*\n\n"
+            f"*{task.title}*\n"
+            f"ID: #{task.id}\n"
+            f"Дедлайн: {task.deadline.strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"Срочно обновите статус!"
+        )
+    
+    # ==================== ДАЙДЖЕСТ ====================
+    
+    def render_daily_digest(self, day: Optional[date] = None) -> Dict[int, str]:
+        """Подготовить тексты дайджеста: {chat_id исполнителя: текст}"""
+        day = day or date.today()
+        digests = {}
+        
+        for assignee, tasks in self.task_service.get_due_tasks_by_assignee(day).items():
+            message = "📋 *Задачи на сегодня:*\n\n"
+            for task in tasks:
+                message += f"• {task.title} (ID: {task.id})\n"
+            digests[assignee] = message
         
-        for task in overdue_tasks:
-            if task.assigned_to:
-                try:
-                    await self.bot.send_message(
-                        chat_id=task.assigned_to,
-                        text=f"🚨 *ЗАДАЧА ПРОСРОЧЕНА!*\n\n"
-                             f"*{task.title}*\n"
-                             f"ID: #{task.id}\n"
-                             f"Дедлайн: {task.deadline.strftime('%d.%m.%Y %H:%M')}\n\n"
-                             f"Срочно обновите статус!",
-                        parse_mode='Markdown'
-                    )
-                except Exception as e:
-                    logger.error(f"Не удалось отправить уведомление: {e}")
-    
-    async def send_daily_digest(self):
-        """Ежедневный дайджест задач"""
-        cursor = self.db.conn.cursor()
-        cursor.execute('SELECT telegram_id FROM admins')
-        admins = cursor.fetchall()
+        return digests
+    
+    async def prerender_daily_digest(self, context=None):
+        """Задача JobQueue: заранее собрать дайджест до окна отправки"""
+        day = date.today()
+        self._digest = (day, self.render_daily_digest(day))
+        logger.info(f"Дайджест на {day.isoformat()} подготовлен: {len(self._digest[1])} получателей")
+    
+    async def send_daily_digest(self, context=None):
+        """Ежедневный дайджест задач (задача JobQueue)"""
+        day = date.today()
+        digest = getattr(self, '_digest', None)
         
-        for admin in admins:
-            user_id = admin['telegram_id']
-            tasks = self.task_service.get_user_tasks(user_id)
-            
-            if tasks:
-                today_tasks = [t for t in tasks if t.deadline and t.deadline.date() == datetime.now().date()]
-                
-                if today_tasks:
-                    message = "📋 *Задачи на сегодня:*\n\n"
-                    
-                    for task in today_tasks:
-                        message += f"• {task.title} (ID: {task.id})\n"
-                    
-                    try:
-                        await self.bot.send_message(
-                            chat_id=user_id,
-                            text=message,
-                            parse_mode='Markdown'
-                        )
-                    except Exception as e:
-                        logger.error(f"Не удалось отправить дайджест: {e}")
\ No newline at end of file
+        # Если подготовка не успела или устарела - собираем сейчас
+        messages = digest[1] if digest and digest[0] == day else self.render_daily_digest(day)
+        self._digest = None
+        
+        sent = await self.deliver(messages, parse_mode='Markdown')
+        logger.info(f"Дайджест отправлен: {sent} из {len(messages)}")
+    
+    # ==================== ОТПРАВКА ====================
+    
+    async def deliver(self, messages: Dict[int, str], parse_mode: Optional[str] = None,
+                      priority: int = PRIORITY_NOTIFICATION) -> int:
+        """Отправить сообщения через общую очередь с лимитами; возвращает число доставленных"""
+        return await self.db.outbound.send_many(self.bot, messages, priority, parse_mode=parse_mode)
@@ -0,0 +1,196 @@
+# services/outbound.py
+import asyncio
+import itertools
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньшее значение уходит раньше
+PRIORITY_REPLY = 0          # ответы администраторов пользователям
+PRIORITY_NOTIFICATION = 1   # уведомления администраторам и исполнителям
+PRIORITY_BROADCAST = 2      # рассылки
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, накапливается не больше capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд появится токен"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now: float) -> float:
+        """Забрать токен (возможно в долг); возвращает, сколько ждать до его появления"""
+        wait = self.wait_time(now)
+        self.tokens -= 1
+        return wait
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Outgoing:
+    __slots__ = ('bot', 'chat_id', 'text', 'kwargs', 'future', 'attempts')
+
+    def __init__(self, bot, chat_id: int, text: str, kwargs: Dict, future: asyncio.Future):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+
+class OutboundScheduler:
+    """Общая очередь исходящих сообщений с лимитами Telegram
+
+    Сообщения разбираются NOTIFY_CONCURRENCY воркерами (не больше
+    API_CONCURRENCY_MAX: одновременность запросов к Bot API задает
+    AimdLimiter, лишние воркеры только ждали бы его) по приоритету
+    (ответы, затем уведомления, затем рассылки) и порядку постановки.
+    Лимиты - ведра токенов: общее (NOTIFY_RATE в секунду), на личный чат
+    (NOTIFY_CHAT_RATE) и на группу (NOTIFY_GROUP_RATE в минуту). Сообщение
+    в чат, упершийся в свой лимит, откладывается и не занимает воркер.
+    На RetryAfter сообщение возвращается в очередь через указанное время.
+    """
+
+    # Ведра чатов, простаивающих дольше наполнения, удаляются при таком размере
+    PRUNE_THRESHOLD = 10000
+
+    def __init__(self, rate: Optional[float] = None, workers: Optional[int] = None,
+                 chat_rate: Optional[float] = None, group_rate: Optional[float] = None,
+                 max_retries: Optional[int] = None):
+        self.rate = rate or config.NOTIFY_RATE
+        self.workers = min(workers or config.NOTIFY_CONCURRENCY, config.API_CONCURRENCY_MAX)
+        self.chat_rate = chat_rate or config.NOTIFY_CHAT_RATE
+        self.group_rate = (group_rate or config.NOTIFY_GROUP_RATE) / 60
+        self.max_retries = config.NOTIFY_MAX_RETRIES if max_retries is None else max_retries
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._global: Optional[TokenBucket] = None
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+
+        self._loop = loop
+        self._queue = asyncio.PriorityQueue()
+        self._global = TokenBucket(self.rate, max(self.rate, 1), loop.time())
+        self._chats = {}
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def pending_count(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    # ==================== ПОСТАНОВКА ====================
+
+    def submit(self, bot, chat_id: int, text: str, priority: int = PRIORITY_NOTIFICATION,
+               **kwargs) -> asyncio.Future:
+        """Поставить сообщение в очередь; future завершится результатом send_message или ошибкой"""
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._put(priority, next(self._seq), _Outgoing(bot, chat_id, text, kwargs, future))
+        return future
+
+    async def send(self, bot, chat_id: int, text: str, priority: int = PRIORITY_NOTIFICATION, **kwargs):
+        """Отправить одно сообщение через очередь (ошибки пробрасываются)"""
+        return await self.submit(bot, chat_id, text, priority, **kwargs)
+
+    async def send_many(self, bot, messages: Union[Dict[int, str], Iterable[Tuple[int, str]]],
+                        priority: int = PRIORITY_NOTIFICATION, **kwargs) -> int:
+        """Отправить пакет сообщений параллельно; возвращает число доставленных"""
+        items = messages.items() if isinstance(messages, dict) else messages
+        futures = [(chat_id, self.submit(bot, chat_id, text, priority, **kwargs)) for chat_id, text in items]
+
+        sent = 0
+        for chat_id, future in futures:
+            try:
+                await future
+                sent += 1
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение {chat_id}: {e}")
+        return sent
+
+    def _put(self, priority: int, seq: int, outgoing: _Outgoing):
+        self._queue.put_nowait((priority, seq, outgoing))
+
+    def _defer(self, delay: float, priority: int, seq: int, outgoing: _Outgoing):
+        # Номер в очереди сохраняется, чтобы сообщение не теряло место в своей полосе
+        self._loop.call_later(delay, self._put, priority, seq, outgoing)
+
+    # ==================== ОТПРАВКА ====================
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.PRUNE_THRESHOLD:
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_full(now)}
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, 1, now)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            priority, seq, outgoing = await self._queue.get()
+            try:
+                await self._process(priority, seq, outgoing)
+            except Exception as e:
+                logger.error(f"Ошибка очереди исходящих сообщений: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, priority: int, seq: int, outgoing: _Outgoing):
+        if outgoing.future.done():
+            return  # вызывающий отменил ожидание
+
+        now = self._loop.time()
+        chat = self._chat_bucket(outgoing.chat_id, now)
+        delay = chat.wait_time(now)
+        if delay > 0:
+            self._defer(delay, priority, seq, outgoing)
+            return
+
+        chat.reserve(now)
+        delay = self._global.reserve(now)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        try:
+            result = await outgoing.bot.send_message(
+                chat_id=outgoing.chat_id, text=outgoing.text, **outgoing.kwargs
+            )
+        except RetryAfter as e:
+            if outgoing.attempts < self.max_retries:
+                outgoing.attempts += 1
+                logger.warning(f"RetryAfter {e.retry_after} с для чата {outgoing.chat_id}")
+                self._defer(float(e.retry_after), priority, seq, outgoing)
+            elif not outgoing.future.done():
+                outgoing.future.set_exception(e)
+        except Exception as e:
+            if not outgoing.future.done():
+                outgoing.future.set_exception(e)
+        else:
+            if not outgoing.future.done():
+                outgoing.future.set_result(result)
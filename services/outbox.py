@@ -0,0 +1,192 @@
+# services/outbox.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from config import config
+from services.outbound import PRIORITY_NOTIFICATION
+from services.sla_monitor import utcnow
+from services.user_cache import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+class Outbox:
+    """Надежная доставка сообщений через таблицу outbox
+
+    Сообщение записывается в outbox в той же транзакции, что и изменение,
+    которое его порождает (ответ, новое обращение), поэтому после commit
+    оно не потеряется. Отправитель выбирает созревшие строки и шлет их
+    через общую очередь db.outbound; доставленные строки удаляются.
+    При RetryAfter повтор - через указанное Telegram время, при прочих
+    сбоях - с экспоненциальной задержкой. Доставка "хотя бы один раз":
+    сбой между отправкой и удалением строки приведет к повтору.
+    """
+
+    JOB_NAME = 'outbox_drain'
+    PRUNE_JOB_NAME = 'outbox_prune'
+    # Период очистки недоставленных сообщений (сек)
+    PRUNE_INTERVAL = 24 * 60 * 60
+    # Ошибки, при которых повтор бесполезен (бот заблокирован, чат не найден)
+    PERMANENT_ERRORS = (Forbidden, BadRequest)
+
+    def __init__(self, db):
+        self.db = db
+        self.job_queue = None
+        self._job = None
+        self._armed_at: Optional[datetime] = None
+        self._draining = False
+
+    def start(self, job_queue):
+        """Подключить JobQueue и отправить то, что накопилось до перезапуска"""
+        self.job_queue = job_queue
+        self._arm(self.next_attempt_at())
+        job_queue.run_repeating(self.prune_job, interval=self.PRUNE_INTERVAL, first=60,
+                                name=self.PRUNE_JOB_NAME)
+
+    # ==================== ПОСТАНОВКА ====================
+
+    def enqueue(self, cursor, chat_id: int, text: str, priority: int = PRIORITY_NOTIFICATION,
+                parse_mode: Optional[str] = None):
+        """Записать сообщение в outbox (без commit - в транзакции вызывающего)"""
+        if self.db.encrypt_at_rest:
+            text = self.db.cipher.encrypt(text, b'outbox')
+        cursor.execute('''
+            INSERT INTO outbox (chat_id, text, parse_mode, priority)
+            VALUES (?, ?, ?, ?)
+        ''', (chat_id, text, parse_mode, priority))
+
+    def wake(self):
+        """Вызывается после commit: отправить новые сообщения сразу"""
+        self._arm(utcnow())
+
+    # ==================== ВЫБОРКА ====================
+
+    def next_attempt_at(self) -> Optional[datetime]:
+        cursor = self.db.conn.cursor()
+        cursor.execute("SELECT MIN(next_attempt_at) AS next_at FROM outbox WHERE status = 'pending'")
+        row = cursor.fetchone()
+        return parse_timestamp(row['next_at']) if row else None
+
+    def get_due(self, limit: int) -> List[Dict]:
+        cursor = self.db.conn.cursor()
+        cursor.execute('''
+            SELECT id, chat_id, text, parse_mode, priority, attempts FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY priority, id
+            LIMIT ?
+        ''', (limit,))
+        rows = [dict(row) for row in cursor.fetchall()]
+        return self.db.decrypt_rows(rows, {'text': 'outbox'})
+
+    def get_counts(self) -> Dict[str, int]:
+        """Число сообщений в outbox по статусам"""
+        cursor = self.db.conn.cursor()
+        cursor.execute('SELECT status, COUNT(*) AS count FROM outbox GROUP BY status')
+        return {row['status']: row['count'] for row in cursor.fetchall()}
+
+    def prune(self) -> int:
+        """Удалить недоставленные сообщения старше OUTBOX_FAILED_RETENTION_DAYS"""
+        cursor = self.db.conn.cursor()
+        try:
+            cursor.execute('''
+                DELETE FROM outbox
+                WHERE status = 'failed' AND created_at < datetime('now', ?)
+            ''', (f'-{config.OUTBOX_FAILED_RETENTION_DAYS} days',))
+            self.db.conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Ошибка очистки outbox: {e}")
+            self.db.conn.rollback()
+            return 0
+
+    async def prune_job(self, context):
+        """Задача JobQueue: очистка outbox"""
+        removed = self.prune()
+        if removed:
+            logger.info(f"Из outbox удалено недоставленных сообщений: {removed}")
+
+    # ==================== ОТПРАВКА ====================
+
+    def _arm(self, when: Optional[datetime]):
+        """Поставить run_once на момент when, если он раньше уже запланированного"""
+        if self.job_queue is None or when is None or self._draining:
+            return
+        if self._armed_at is not None and self._armed_at <= when:
+            return
+
+        if self._job is not None:
+            self._job.schedule_removal()
+
+        self._armed_at = when
+        delay = max((when - utcnow()).total_seconds(), 0)
+        self._job = self.job_queue.run_once(self._fire, when=delay, name=self.JOB_NAME)
+
+    async def _fire(self, context):
+        """Отправить созревшие сообщения пачками и перезапустить таймер"""
+        self._job = None
+        self._armed_at = None
+        self._draining = True
+        # Строки, уже обработанные в этом проходе: если их состояние не удалось
+        # сохранить, они снова выглядят созревшими и не должны уйти повторно
+        handled = set()
+        retry_at = None
+
+        try:
+            while True:
+                rows = self.get_due(config.OUTBOX_BATCH_SIZE)
+                if not rows:
+                    break
+                rows = [row for row in rows if row['id'] not in handled]
+                if not rows:
+                    # Пачка без прогресса - повтор с задержкой, а не по кругу
+                    retry_at = utcnow() + timedelta(seconds=config.OUTBOX_RETRY_BASE)
+                    break
+                handled.update(row['id'] for row in rows)
+                await asyncio.gather(*(self._deliver(context.bot, row) for row in rows))
+        finally:
+            self._draining = False
+            self._arm(retry_at or self.next_attempt_at())
+
+    async def _deliver(self, bot, row: Dict):
+        try:
+            await self.db.outbound.send(
+                bot, row['chat_id'], row['text'], row['priority'], parse_mode=row['parse_mode']
+            )
+        except RetryAfter as e:
+            self._reschedule(row, timedelta(seconds=float(e.retry_after)), e)
+        except self.PERMANENT_ERRORS as e:
+            self._fail(row, e)
+        except Exception as e:
+            attempts = row['attempts'] + 1
+            if attempts >= config.OUTBOX_MAX_ATTEMPTS:
+                self._fail(row, e)
+            else:
+                delay = min(config.OUTBOX_RETRY_BASE * 2 ** row['attempts'], config.OUTBOX_RETRY_MAX)
+                self._reschedule(row, timedelta(seconds=delay), e)
+        else:
+            self._execute('DELETE FROM outbox WHERE id = ?', (row['id'],))
+
+    def _reschedule(self, row: Dict, delay: timedelta, error: Exception):
+        logger.warning(f"Сообщение outbox #{row['id']} для {row['chat_id']} отложено на {delay}: {error}")
+        self._execute('''
+            UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+            WHERE id = ?
+        ''', ((utcnow() + delay).strftime('%Y-%m-%d %H:%M:%S'), str(error), row['id']))
+
+    def _fail(self, row: Dict, error: Exception):
+        logger.error(f"Сообщение outbox #{row['id']} для {row['chat_id']} не доставлено: {error}")
+        self._execute('''
+            UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ?
+            WHERE id = ?
+        ''', (str(error), row['id']))
+
+    def _execute(self, query: str, params: tuple):
+        try:
+            self.db.conn.execute(query, params)
+            self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка обновления outbox: {e}")
+            self.db.conn.rollback()
@@ -0,0 +1,186 @@
+# services/quote_engine.py
+import logging
+import random
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class _IndexedPool:
+    """Множество ID с O(1) добавлением, удалением и случайным выбором"""
+
+    def __init__(self):
+        self.items: List[int] = []
+        self.positions: Dict[int, int] = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item_id):
+        return item_id in self.positions
+
+    def add(self, item_id: int):
+        if item_id not in self.positions:
+            self.positions[item_id] = len(self.items)
+            self.items.append(item_id)
+
+    def remove(self, item_id: int):
+        position = self.positions.pop(item_id, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def choice(self) -> Optional[int]:
+        return random.choice(self.items) if self.items else None
+
+
+class QuoteEngine:
+    """Пул цитат в памяти: равномерный выбор, выбор наименее использованных,
+    «мешок» без повторов для каждого пользователя и пакетная запись used_count"""
+
+    ALL = None  # ключ пула всех категорий
+
+    def __init__(self, db, flush_threshold: int = 50, max_bags: int = 1000):
+        self.db = db
+        self.flush_threshold = flush_threshold
+        self.max_bags = max_bags
+        self._pending = Counter()
+        self.reload()
+
+    def reload(self):
+        """Загрузить все цитаты из БД"""
+        self.flush()
+
+        self._quotes: Dict[int, Dict] = {}
+        self._pools: Dict[Optional[str], _IndexedPool] = {self.ALL: _IndexedPool()}
+        # Корзины по used_count: категория -> used_count -> пул
+        self._usage: Dict[Optional[str], Dict[int, _IndexedPool]] = {self.ALL: {}}
+        self._min_usage: Dict[Optional[str], int] = {self.ALL: 0}
+        self._bags: OrderedDict = OrderedDict()
+
+        cursor = self.db.conn.cursor()
+        cursor.execute('SELECT * FROM quotes')
+        for row in cursor.fetchall():
+            self._index(dict(row))
+
+    def _index(self, quote: Dict):
+        """Добавить цитату в пулы"""
+        quote_id = quote['id']
+        self._quotes[quote_id] = quote
+
+        for key in (self.ALL, quote['category']):
+            self._pools.setdefault(key, _IndexedPool()).add(quote_id)
+            buckets = self._usage.setdefault(key, {})
+            buckets.setdefault(quote['used_count'], _IndexedPool()).add(quote_id)
+            self._min_usage[key] = min(buckets)
+
+    def add(self, quote: Dict):
+        """Добавить новую цитату без перезагрузки пула"""
+        quote = dict(quote)
+        quote.setdefault('used_count', 0)
+        self._index(quote)
+
+    def remove(self, quote_id: int):
+        """Убрать цитату из пулов"""
+        quote = self._quotes.pop(quote_id, None)
+        if not quote:
+            return
+        self._pending.pop(quote_id, None)
+
+        for key in (self.ALL, quote['category']):
+            self._pools[key].remove(quote_id)
+            buckets = self._usage[key]
+            buckets[quote['used_count']].remove(quote_id)
+            if not buckets[quote['used_count']]:
+                del buckets[quote['used_count']]
+            if not self._pools[key] and key is not self.ALL:
+                del self._pools[key], self._usage[key], self._min_usage[key]
+            else:
+                self._min_usage[key] = min(buckets) if buckets else 0
+
+    def categories(self) -> List[str]:
+        """Категории, в которых есть цитаты"""
+        return [key for key in self._pools if key is not self.ALL]
+
+    def pick(self, category: Optional[str] = None, mode: str = 'uniform',
+             user_id: Optional[int] = None) -> Optional[Dict]:
+        """Выбрать цитату: uniform - равномерно, least_used - из наименее использованных;
+        при user_id цитаты не повторяются, пока пользователь не увидит весь пул"""
+        key = category or self.ALL
+        pool = self._pools.get(key)
+        if not pool:
+            return None
+
+        if user_id is not None:
+            quote_id = self._pick_from_bag(user_id, key, pool)
+        elif mode == 'least_used':
+            quote_id = self._usage[key][self._min_usage[key]].choice()
+        else:
+            quote_id = pool.choice()
+
+        return self._mark_used(quote_id)
+
+    def _pick_from_bag(self, user_id: int, key: Optional[str], pool: _IndexedPool) -> int:
+        """Вытащить цитату из перемешанного мешка пользователя"""
+        bag_key = (user_id, key)
+        bag = self._bags.get(bag_key)
+
+        while True:
+            if not bag:
+                bag = list(pool.items)
+                random.shuffle(bag)
+                self._bags[bag_key] = bag
+            quote_id = bag.pop()
+            if quote_id in pool:
+                break
+
+        self._bags.move_to_end(bag_key)
+        if len(self._bags) > self.max_bags:
+            self._bags.popitem(last=False)
+        return quote_id
+
+    def _mark_used(self, quote_id: int) -> Dict:
+        """Увеличить счетчик в памяти и отложить запись в БД"""
+        quote = self._quotes[quote_id]
+        old_count = quote['used_count']
+        quote['used_count'] = old_count + 1
+
+        for key in (self.ALL, quote['category']):
+            buckets = self._usage[key]
+            buckets[old_count].remove(quote_id)
+            if not buckets[old_count]:
+                del buckets[old_count]
+            buckets.setdefault(old_count + 1, _IndexedPool()).add(quote_id)
+            if self._min_usage[key] == old_count and old_count not in buckets:
+                self._min_usage[key] = old_count + 1
+
+        self._pending[quote_id] += 1
+        if sum(self._pending.values()) >= self.flush_threshold:
+            self.flush()
+
+        return dict(quote)
+
+    def flush(self) -> int:
+        """Записать накопленные увеличения used_count одним executemany"""
+        if not self._pending:
+            return 0
+
+        updates = [(count, quote_id) for quote_id, count in self._pending.items()]
+        cursor = self.db.conn.cursor()
+
+        try:
+            cursor.executemany(
+                'UPDATE quotes SET used_count = used_count + ? WHERE id = ?',
+                updates
+            )
+            self.db.conn.commit()
+            self._pending.clear()
+        except Exception as e:
+            logger.error(f"Ошибка записи счетчиков цитат: {e}")
+            self.db.conn.rollback()
+            return 0
+
+        return len(updates)
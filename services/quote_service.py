@@ -37,31 +37,13 @@ class QuoteService:
                 ''', (text, author, category))
             
             self.db.conn.commit()
+            self.db.quote_engine.reload()
             logger.info("Добавлены стандартные цитаты")
     
-    def get_random_quote(self, category: Optional[str] = None) -> Optional[Dict]:
-        """Получить случайную цитату"""
-        cursor = self.db.conn.cursor()
-        
-        if category:
-            cursor.execute('''
-                SELECT * FROM quotes 
-                WHERE category = ? 
-                ORDER BY RANDOM() 
-                LIMIT 1
-            ''', (category,))
-        else:
-            cursor.execute('SELECT * FROM quotes ORDER BY RANDOM() LIMIT 1')
-        
-        row = cursor.fetchone()
-        
-        if row:
-            # Увеличиваем счетчик использования
-            cursor.execute('UPDATE quotes SET used_count = used_count + 1 WHERE id = ?', (row['id'],))
-            self.db.conn.commit()
-            
-            return dict(row)
-        return None
+    def get_random_quote(self, category: Optional[str] = None, mode: str = 'uniform',
+                         user_id: Optional[int] = None) -> Optional[Dict]:
+        """Получить случайную цитату (uniform, least_used или без повторов для user_id)"""
+        return self.db.quote_engine.pick(category, mode=mode, user_id=user_id)
     
     def add_quote(self, text: str, author: str = "", category: str = "general", 
                  created_by: Optional[int] = None) -> bool:
@@ -75,6 +57,10 @@ class QuoteService:
             ''', (text, author, category, created_by))
             
             self.db.conn.commit()
+            self.db.quote_engine.add({
+                'id': cursor.lastrowid, 'text': text, 'author': author,
+                'category': category, 'created_by': created_by, 'used_count': 0
+            })
             return True
         except Exception as e:
             logger.error(f"Ошибка добавления цитаты: {e}")
@@ -83,6 +69,8 @@ class QuoteService:
     
     def get_all_quotes(self, category: Optional[str] = None) -> List[Dict]:
         """Получить все цитаты"""
+        # Досохраняем отложенные счетчики, чтобы сортировка была точной
+        self.db.quote_engine.flush()
         cursor = self.db.conn.cursor()
         
         if category:
@@ -99,6 +87,7 @@ class QuoteService:
         try:
             cursor.execute('DELETE FROM quotes WHERE id = ?', (quote_id,))
             self.db.conn.commit()
+            self.db.quote_engine.remove(quote_id)
             return cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Ошибка удаления цитаты: {e}")
@@ -107,7 +96,4 @@ class QuoteService:
     
     def get_categories(self) -> List[str]:
         """Получить все категории цитат"""
-        cursor = self.db.conn.cursor()
-        cursor.execute('SELECT DISTINCT category FROM quotes')
-        
-        return [row['category'] for row in cursor.fetchall()]
\ No newline at end of file
+        return self.db.quote_engine.categories()
\ No newline at end of file
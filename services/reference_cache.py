@@ -0,0 +1,97 @@
+# services/reference_cache.py
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ReferenceCache:
+    """Кэш редко меняющихся справочников: администраторы, команды, участники
+
+    Разделы загружаются при старте и перечитываются после invalidate(),
+    которую вызывают методы записи в эти таблицы.
+    """
+
+    SECTIONS = ('admins', 'teams')
+
+    def __init__(self, db):
+        self.db = db
+        self._dirty = set(self.SECTIONS)
+
+    def load(self):
+        """Загрузить все устаревшие разделы"""
+        if 'admins' in self._dirty:
+            self._load_admins()
+        if 'teams' in self._dirty:
+            self._load_teams()
+
+    def invalidate(self, section: Optional[str] = None):
+        """Пометить раздел (или все) устаревшим; перечитывается при следующем обращении"""
+        self._dirty.update([section] if section else self.SECTIONS)
+
+    def _load_admins(self):
+        cursor = self.db.conn.cursor()
+        cursor.execute('SELECT * FROM admins ORDER BY id')
+
+        self._admins: Dict[int, Dict] = {row['telegram_id']: dict(row) for row in cursor.fetchall()}
+        self._dirty.discard('admins')
+
+    def _load_teams(self):
+        cursor = self.db.conn.cursor()
+        cursor.execute('SELECT id, name, description, leader_id, created_at FROM teams')
+        self._teams: Dict[int, Dict] = {row['id']: dict(row) for row in cursor.fetchall()}
+
+        cursor.execute('SELECT team_id, admin_id, role FROM team_members ORDER BY id')
+        self._members: Dict[int, Dict[int, str]] = {}
+        self._user_teams: Dict[int, Dict[int, str]] = {}
+        for row in cursor.fetchall():
+            self._members.setdefault(row['team_id'], {})[row['admin_id']] = row['role']
+            self._user_teams.setdefault(row['admin_id'], {})[row['team_id']] = row['role']
+
+        self._dirty.discard('teams')
+
+    # ==================== АДМИНИСТРАТОРЫ ====================
+
+    def get_admins(self) -> List[Dict]:
+        """Все администраторы из таблицы admins"""
+        self.load()
+        return list(self._admins.values())
+
+    def is_admin(self, telegram_id: int) -> bool:
+        self.load()
+        return telegram_id in self._admins
+
+    def get_admin_db_id(self, telegram_id: int) -> Optional[int]:
+        """admins.id по Telegram ID"""
+        self.load()
+        admin = self._admins.get(telegram_id)
+        return admin['id'] if admin else None
+
+    # ==================== КОМАНДЫ ====================
+
+    def get_team(self, team_id: int) -> Optional[Dict]:
+        self.load()
+        team = self._teams.get(team_id)
+        return dict(team) if team else None
+
+    def get_user_teams(self, admin_id: int) -> List[Dict]:
+        """Команды пользователя с его ролью (новые первыми)"""
+        self.load()
+        teams = [
+            dict(self._teams[team_id], role=role)
+            for team_id, role in self._user_teams.get(admin_id, {}).items()
+            if team_id in self._teams
+        ]
+        teams.sort(key=lambda team: (team['created_at'] or '', team['id']), reverse=True)
+        return teams
+
+    def get_team_members(self, team_id: int) -> List[Dict]:
+        """Участники команды"""
+        self.load()
+        return [
+            {'telegram_id': admin_id, 'role': role}
+            for admin_id, role in self._members.get(team_id, {}).items()
+        ]
+
+    def get_team_member_ids(self, team_id: int) -> List[int]:
+        self.load()
+        return list(self._members.get(team_id, {}))
@@ -0,0 +1,193 @@
+# services/reply_queue.py
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import config
+from services.sla_monitor import utcnow
+from services.user_cache import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+class FenwickTree:
+    """Дерево Фенвика: точечное изменение и префиксная сумма за O(log n)
+
+    Индексы - положительные целые, размер растет удвоением.
+    """
+
+    def __init__(self, size: int = 1024):
+        self._tree: List[int] = [0] * (size + 1)
+
+    @property
+    def size(self) -> int:
+        return len(self._tree) - 1
+
+    def add(self, index: int, delta: int):
+        if index > self.size:
+            self._grow(index)
+
+        while index <= self.size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index: int) -> int:
+        """Сумма значений с индексами 1..index"""
+        index = min(index, self.size)
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _grow(self, index: int):
+        size = max(self.size, 1)
+        while size < index:
+            size *= 2
+
+        # Значения восстанавливаются обратным проходом, дерево строится заново - оба за O(n)
+        values = self.unbuild(self._tree)
+        values.extend([0] * (size + 1 - len(values)))
+        self._tree = self.build(values)
+
+    @staticmethod
+    def build(values: List[int]) -> List[int]:
+        """Дерево по массиву значений (values[0] не используется)"""
+        tree = list(values)
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        return tree
+
+    @staticmethod
+    def unbuild(tree: List[int]) -> List[int]:
+        """Массив значений по дереву (обратно build)"""
+        values = list(tree)
+        for i in range(len(values) - 1, 0, -1):
+            parent = i + (i & -i)
+            if parent < len(values):
+                values[parent] -= values[i]
+        return values
+
+    @classmethod
+    def from_indexes(cls, indexes: Iterable[int], size: int = 1024) -> 'FenwickTree':
+        indexes = list(indexes)
+        while indexes and size < max(indexes):
+            size *= 2
+
+        values = [0] * (size + 1)
+        for index in indexes:
+            values[index] += 1
+
+        fenwick = cls(size)
+        fenwick._tree = cls.build(values)
+        return fenwick
+
+
+class ReplyQueue:
+    """Очередь неотвеченных обращений: место в очереди и ожидаемое время ответа
+
+    Место - число неотвеченных обращений с ID не больше данного (дерево
+    Фенвика, без COUNT по таблице). Дерево индексируется не ID, а плотными
+    номерами ячеек в порядке ID: память пропорциональна очереди, а не
+    максимальному ID. Когда свободных ячеек становится больше занятых,
+    номера переназначаются заново. Темп ответов - экспоненциальное среднее
+    интервала между первыми ответами; интервалы простоя ограничены
+    RESPONSE_TIME_LIMIT, чтобы ночь без ответов не искажала оценку.
+    """
+
+    # Сколько последних ответов учитывать при загрузке темпа из БД
+    SEED_REPLIES = 50
+    # Меньше стольких ячеек дерево не уплотняется
+    MIN_SLOTS = 1024
+
+    def __init__(self, db, alpha: Optional[float] = None):
+        self.db = db
+        self.alpha = alpha or config.QUEUE_EWMA_ALPHA
+        self.max_interval = config.RESPONSE_TIME_LIMIT * 3600
+        self.reload()
+
+    def reload(self):
+        """Загрузить неотвеченные обращения и темп последних ответов"""
+        cursor = self.db.conn.cursor()
+
+        cursor.execute("SELECT id FROM messages WHERE status = 'new' ORDER BY id")
+        self._compact([row['id'] for row in cursor.fetchall()])
+
+        self._interval: Optional[float] = None  # секунд на один ответ
+        self._last_reply_at: Optional[datetime] = None
+        cursor.execute('''
+            SELECT replied_at FROM messages
+            WHERE replied_at IS NOT NULL
+            ORDER BY replied_at DESC
+            LIMIT ?
+        ''', (self.SEED_REPLIES,))
+        for row in reversed(cursor.fetchall()):
+            self._record_reply(parse_timestamp(row['replied_at']))
+
+    # ==================== ОБНОВЛЕНИЕ ====================
+
+    def _compact(self, message_ids: List[int]):
+        """Назначить ячейки 1..n обращениям по возрастанию ID"""
+        self._slots: Dict[int, int] = {message_id: slot for slot, message_id in enumerate(message_ids, 1)}
+        self._tree = FenwickTree.from_indexes(self._slots.values())
+        self._last_id = message_ids[-1] if message_ids else 0
+        self._next_slot = len(message_ids) + 1
+
+    def add(self, message_id: int):
+        """Обращение встало в очередь"""
+        if message_id in self._slots:
+            return
+
+        if message_id < self._last_id:
+            # ID пришел не по порядку - ячейки переназначаются целиком
+            self._compact(sorted([*self._slots, message_id]))
+            return
+
+        slot = self._next_slot
+        self._next_slot += 1
+        self._last_id = message_id
+        self._slots[message_id] = slot
+        self._tree.add(slot, 1)
+
+    def remove(self, message_id: int, replied_at: Optional[datetime] = None):
+        """На обращение ответили (повторные ответы не учитываются)"""
+        slot = self._slots.pop(message_id, None)
+        if slot is None:
+            return
+
+        self._tree.add(slot, -1)
+        if self._next_slot > max(2 * len(self._slots), self.MIN_SLOTS):
+            self._compact(sorted(self._slots))
+        self._record_reply(replied_at or utcnow())
+
+    def _record_reply(self, replied_at: Optional[datetime]):
+        if replied_at is None:
+            return
+
+        if self._last_reply_at is not None:
+            interval = min(max((replied_at - self._last_reply_at).total_seconds(), 0), self.max_interval)
+            if self._interval is None:
+                self._interval = interval
+            else:
+                self._interval = self.alpha * interval + (1 - self.alpha) * self._interval
+        self._last_reply_at = replied_at
+
+    # ==================== ОЦЕНКА ====================
+
+    def pending_count(self) -> int:
+        return len(self._slots)
+
+    def position(self, message_id: int) -> Optional[int]:
+        """Место обращения в очереди (1 - следующее) или None, если уже отвечено"""
+        slot = self._slots.get(message_id)
+        if slot is None:
+            return None
+        return self._tree.prefix_sum(slot)
+
+    def estimate(self, message_id: int) -> Tuple[Optional[int], Optional[timedelta]]:
+        """(место в очереди, ожидаемое время до ответа); время None, пока нет статистики"""
+        position = self.position(message_id)
+        if position is None or self._interval is None:
+            return position, None
+        return position, timedelta(seconds=position * self._interval)
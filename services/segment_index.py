@@ -0,0 +1,325 @@
+# services/segment_index.py
+import logging
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from services.change_feed import ChangeFeed
+from services.user_cache import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+class Bitmap:
+    """Сжатое множество неотрицательных целых (ID пользователей)
+
+    Значения разбиты на чанки по 2^16 (как в roaring bitmap), каждый чанк -
+    битовая маска в int. Пустые чанки не хранятся, поэтому разреженные
+    множества занимают мало памяти, а операции идут по чанкам.
+    """
+
+    __slots__ = ('_chunks',)
+
+    def __init__(self, chunks: Optional[Dict[int, int]] = None):
+        self._chunks: Dict[int, int] = chunks or {}
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int]) -> 'Bitmap':
+        bitmap = cls()
+        for value in ids:
+            bitmap.add(value)
+        return bitmap
+
+    def add(self, value: int):
+        key = value >> CHUNK_BITS
+        self._chunks[key] = self._chunks.get(key, 0) | (1 << (value & CHUNK_MASK))
+
+    def discard(self, value: int):
+        key = value >> CHUNK_BITS
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            return
+        chunk &= ~(1 << (value & CHUNK_MASK))
+        if chunk:
+            self._chunks[key] = chunk
+        else:
+            del self._chunks[key]
+
+    def __contains__(self, value: int) -> bool:
+        return bool(self._chunks.get(value >> CHUNK_BITS, 0) >> (value & CHUNK_MASK) & 1)
+
+    def __len__(self) -> int:
+        return sum(chunk.bit_count() for chunk in self._chunks.values())
+
+    def __iter__(self) -> Iterator[int]:
+        return self.iter_after(-1)
+
+    def iter_after(self, after: int) -> Iterator[int]:
+        """Значения больше after по возрастанию (для постраничной выборки по ключу)"""
+        start = after + 1
+        start_key = start >> CHUNK_BITS
+        for key in sorted(self._chunks):
+            if key < start_key:
+                continue
+            chunk = self._chunks[key]
+            if key == start_key:
+                chunk &= ~((1 << (start & CHUNK_MASK)) - 1)
+            base = key << CHUNK_BITS
+            while chunk:
+                low = chunk & -chunk
+                yield base + low.bit_length() - 1
+                chunk ^= low
+
+    def copy(self) -> 'Bitmap':
+        return Bitmap(dict(self._chunks))
+
+    def __or__(self, other: 'Bitmap') -> 'Bitmap':
+        chunks = dict(self._chunks)
+        for key, chunk in other._chunks.items():
+            chunks[key] = chunks.get(key, 0) | chunk
+        return Bitmap(chunks)
+
+    def __and__(self, other: 'Bitmap') -> 'Bitmap':
+        small, large = sorted((self._chunks, other._chunks), key=len)
+        chunks = {}
+        for key, chunk in small.items():
+            common = chunk & large.get(key, 0)
+            if common:
+                chunks[key] = common
+        return Bitmap(chunks)
+
+    def __sub__(self, other: 'Bitmap') -> 'Bitmap':
+        chunks = {}
+        for key, chunk in self._chunks.items():
+            rest = chunk & ~other._chunks.get(key, 0)
+            if rest:
+                chunks[key] = rest
+        return Bitmap(chunks)
+
+
+class SegmentError(ValueError):
+    """Ошибка в выражении сегмента"""
+
+
+class SegmentIndex:
+    """Битовые индексы пользователей для сегментации рассылок
+
+    Атрибуты (ключ - users.id):
+      all           - все пользователи
+      banned        - забаненные (бан еще не истек)
+      blocked       - заблокировавшие бота
+      replied       - получавшие ответ на обращение
+      cat:<код>     - отправлявшие обращения категории (cat:bug, cat:question, ...)
+      active:<N>    - активные за последние N дней (active:30)
+
+    Активность хранится корзинами по дням: пользователь добавляется в
+    корзину дня активности, active:N - объединение корзин за N дней.
+    Индексы строятся одним проходом при старте и дальше обновляются
+    точечно из Database (add_user, add_message, add_reply, бан, рассылки).
+    Обращения, записанные в обход этих методов, догоняются по журналу
+    изменений (потребитель segment_index, задача sync_job).
+
+    Выражение: атрибуты, & (и), | (или), - (кроме), ! (не), скобки.
+    Пример: active:30&cat:bug&!replied
+    """
+
+    # Сколько дней корзин активности хранить
+    MAX_ACTIVITY_DAYS = 366
+
+    TOKEN_RE = re.compile(r'\s*(?:([a-z_]+(?::[a-z0-9_]+)?)|(.))', re.IGNORECASE)
+
+    def __init__(self, db):
+        self.db = db
+        self.feed = ChangeFeed(db, 'segment_index', tables=('messages',))
+        self.reload()
+
+    def reload(self):
+        """Построить индексы по users и messages"""
+        self.all = Bitmap()
+        self.flags: Dict[str, Bitmap] = {'blocked': Bitmap(), 'replied': Bitmap()}
+        # Баны временные, поэтому хранятся со сроком, а не флагом
+        self.bans: Dict[int, datetime] = {}
+        self.categories: Dict[str, Bitmap] = {}
+        self.activity: Dict[date, Bitmap] = {}
+
+        cursor = self.db.conn.cursor()
+        oldest = date.today() - timedelta(days=self.MAX_ACTIVITY_DAYS)
+        # Активность - через ActivityTracker: часть отметок еще не записана в БД
+        activity = self.db.activity
+        last_seen = activity.get_last_seen(datetime.combine(oldest, time.min))
+
+        cursor.execute('SELECT id, telegram_id, is_banned, ban_until, blocked_bot FROM users')
+        for row in cursor.fetchall():
+            self.all.add(row['id'])
+            if row['is_banned'] and row['ban_until']:
+                self.bans[row['id']] = parse_timestamp(row['ban_until'])
+            # Непереданная отметка активности снимет blocked_bot при flush
+            if row['blocked_bot'] and not activity.is_pending(row['telegram_id']):
+                self.flags['blocked'].add(row['id'])
+            seen = last_seen.get(row['telegram_id'])
+            if seen:
+                self._activity_bucket(seen.date()).add(row['id'])
+
+        cursor.execute('SELECT DISTINCT user_id, category FROM messages')
+        for row in cursor.fetchall():
+            self.categories.setdefault(row['category'] or 'general', Bitmap()).add(row['user_id'])
+
+        cursor.execute("SELECT DISTINCT user_id FROM messages WHERE status = 'replied'")
+        for row in cursor.fetchall():
+            self.flags['replied'].add(row['user_id'])
+
+        # Индексы построены по текущему состоянию - журнал до этого места не нужен
+        self.feed.reset(self.feed.head())
+
+    # ==================== ОБНОВЛЕНИЕ ====================
+
+    def _activity_bucket(self, day: date) -> Bitmap:
+        bucket = self.activity.get(day)
+        if bucket is None:
+            bucket = self.activity[day] = Bitmap()
+            # Новая корзина - повод выбросить корзины старше MAX_ACTIVITY_DAYS
+            oldest = date.today() - timedelta(days=self.MAX_ACTIVITY_DAYS)
+            for old_day in [d for d in self.activity if d < oldest]:
+                del self.activity[old_day]
+        return bucket
+
+    def on_activity(self, user_id: int):
+        """Пользователь активен сегодня (и, значит, не блокирует бота)"""
+        self.all.add(user_id)
+        self._activity_bucket(date.today()).add(user_id)
+        self.flags['blocked'].discard(user_id)
+
+    def on_message(self, user_id: int, category: str):
+        self.on_activity(user_id)
+        self.categories.setdefault(category or 'general', Bitmap()).add(user_id)
+
+    def set_flag(self, flag: str, user_id: int, value: bool = True):
+        """Установить или снять флаг blocked / replied"""
+        if value:
+            self.flags[flag].add(user_id)
+        else:
+            self.flags[flag].discard(user_id)
+
+    def set_ban(self, user_id: int, until: Optional[datetime]):
+        """Бан до until (None - бан снят)"""
+        if until is None:
+            self.bans.pop(user_id, None)
+        else:
+            self.bans[user_id] = until
+
+    def banned(self) -> Bitmap:
+        """Пользователи с действующим баном (истекшие баны выбрасываются)"""
+        now = datetime.now()
+        for user_id in [uid for uid, until in self.bans.items() if until is None or until <= now]:
+            del self.bans[user_id]
+        return Bitmap.from_ids(self.bans)
+
+    def apply_changes(self, events: List[Dict]):
+        """Применить события журнала по messages
+
+        Удаления не учитываются: cat:<код> и replied означают "когда-либо",
+        у пользователя могут остаться другие обращения.
+        """
+        for event in events:
+            if event['operation'] == 'delete':
+                continue
+            payload = event['payload']
+            user_id = payload.get('user_id')
+            if user_id is None:
+                continue
+            self.categories.setdefault(payload.get('category') or 'general', Bitmap()).add(user_id)
+            if payload.get('status') == 'replied':
+                self.flags['replied'].add(user_id)
+
+    async def sync_job(self, context):
+        """Периодическая задача JobQueue: догнать журнал изменений"""
+        self.feed.consume(self.apply_changes)
+
+    # ==================== ВЫРАЖЕНИЯ ====================
+
+    def attribute(self, name: str) -> Bitmap:
+        name = name.lower()
+        if name == 'all':
+            return self.all
+        if name == 'banned':
+            return self.banned()
+        if name in self.flags:
+            return self.flags[name]
+        if name.startswith('cat:'):
+            return self.categories.get(name[4:], Bitmap())
+        if name.startswith('active:') and name[7:].isdigit():
+            since = date.today() - timedelta(days=int(name[7:]) - 1)
+            result = Bitmap()
+            for day, bucket in self.activity.items():
+                if day >= since:
+                    result = result | bucket
+            return result
+        raise SegmentError(f"Неизвестный атрибут: {name}")
+
+    def resolve(self, expression: str) -> Bitmap:
+        """Вычислить выражение сегмента в множество users.id"""
+        self._tokens = self._tokenize(expression)
+        self._position = 0
+        result = self._parse_union()
+        if self._position < len(self._tokens):
+            raise SegmentError(f"Лишний символ: {self._tokens[self._position]}")
+        return result
+
+    def _tokenize(self, expression: str) -> List[str]:
+        tokens = []
+        for name, symbol in self.TOKEN_RE.findall(expression.strip()):
+            if name:
+                tokens.append(name)
+            elif symbol in '&|-!()':
+                tokens.append(symbol)
+            elif not symbol.isspace():
+                raise SegmentError(f"Недопустимый символ: {symbol}")
+        if not tokens:
+            raise SegmentError("Пустое выражение")
+        return tokens
+
+    def _peek(self) -> Optional[str]:
+        return self._tokens[self._position] if self._position < len(self._tokens) else None
+
+    def _next(self) -> Optional[str]:
+        token = self._peek()
+        self._position += 1
+        return token
+
+    def _parse_union(self) -> Bitmap:
+        result = self._parse_intersection()
+        while self._peek() == '|':
+            self._next()
+            result = result | self._parse_intersection()
+        return result
+
+    def _parse_intersection(self) -> Bitmap:
+        result = self._parse_factor()
+        while self._peek() in ('&', '-'):
+            operator = self._next()
+            operand = self._parse_factor()
+            result = result & operand if operator == '&' else result - operand
+        return result
+
+    def _parse_factor(self) -> Bitmap:
+        token = self._next()
+        if token == '!':
+            return self.all - self._parse_factor()
+        if token == '(':
+            result = self._parse_union()
+            if self._next() != ')':
+                raise SegmentError("Не закрыта скобка")
+            return result
+        if token is None or token in '&|-)':
+            raise SegmentError("Ожидался атрибут")
+        return self.attribute(token)
+
+    def describe(self) -> List[str]:
+        """Доступные атрибуты с размерами"""
+        lines = [f"all - {len(self.all)}", f"banned - {len(self.banned())}"]
+        lines += [f"{name} - {len(bitmap)}" for name, bitmap in self.flags.items()]
+        lines += [f"cat:{name} - {len(bitmap)}" for name, bitmap in sorted(self.categories.items())]
+        lines += [f"active:{days} - {len(self.attribute(f'active:{days}'))}" for days in (1, 7, 30, 90)]
+        return lines
@@ -0,0 +1,190 @@
+# services/sla_monitor.py
+import heapq
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import config
+from services.user_cache import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+def utcnow() -> datetime:
+    """Текущее время UTC без tzinfo (как CURRENT_TIMESTAMP в SQLite)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SlaMonitor:
+    """Контроль времени ответа на обращения с эскалацией администраторам
+
+    Неотвеченные обращения лежат в min-куче по моменту следующего порога
+    (доли RESPONSE_TIME_LIMIT). add_message добавляет обращение, add_reply
+    снимает его; в JobQueue стоит одна задача run_once на ближайший порог.
+    Достигнутый уровень хранится в messages.sla_level, чтобы после
+    перезапуска не повторять эскалации.
+    """
+
+    JOB_NAME = 'sla_escalation'
+
+    def __init__(self, db, limit_hours: Optional[float] = None,
+                 thresholds: Optional[Sequence[float]] = None):
+        self.db = db
+        self.limit = timedelta(hours=limit_hours or config.RESPONSE_TIME_LIMIT)
+        self.thresholds = list(thresholds or config.SLA_ESCALATION_THRESHOLDS)
+        self.job_queue = None
+        self._job = None
+        self._armed_at: Optional[datetime] = None
+        self.reload()
+
+    def reload(self):
+        """Загрузить неотвеченные обращения"""
+        self._created: Dict[int, datetime] = {}
+        self._levels: Dict[int, int] = {}
+        self._heap: List[Tuple[datetime, int, int]] = []  # (срок, message_id, уровень)
+
+        cursor = self.db.conn.cursor()
+        cursor.execute("SELECT id, created_at, sla_level FROM messages WHERE status = 'new'")
+        for row in cursor.fetchall():
+            self.track(row['id'], parse_timestamp(row['created_at']), row['sla_level'] or 0)
+
+    def start(self, job_queue):
+        """Подключить JobQueue и поставить таймер на ближайший порог"""
+        self.job_queue = job_queue
+        self._arm()
+
+    def due_at(self, message_id: int, level: int) -> datetime:
+        """Момент достижения порога level (1 - первый порог)"""
+        return self._created[message_id] + self.limit * self.thresholds[level - 1]
+
+    # ==================== ОБНОВЛЕНИЕ ====================
+
+    def track(self, message_id: int, created_at: Optional[datetime] = None, level: int = 0):
+        """Начать отслеживать обращение (level - уже пройденные пороги)"""
+        self._created[message_id] = created_at or utcnow()
+        self._levels[message_id] = level
+        self._schedule_next(message_id)
+
+    def resolve(self, message_id: int):
+        """На обращение ответили; элемент кучи будет отброшен лениво"""
+        self._created.pop(message_id, None)
+        self._levels.pop(message_id, None)
+
+    def pending_count(self) -> int:
+        return len(self._created)
+
+    def _schedule_next(self, message_id: int):
+        level = self._levels[message_id] + 1
+        if level > len(self.thresholds):
+            return
+
+        due = self.due_at(message_id, level)
+        heapq.heappush(self._heap, (due, message_id, level))
+        if self._armed_at is None or due < self._armed_at:
+            self._arm()
+
+    def _is_current(self, message_id: int, level: int) -> bool:
+        return self._levels.get(message_id) == level - 1
+
+    def next_due(self) -> Optional[datetime]:
+        """Ближайший актуальный порог"""
+        while self._heap:
+            due, message_id, level = self._heap[0]
+            if self._is_current(message_id, level):
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: Optional[datetime] = None) -> List[Tuple[int, int]]:
+        """Снять обращения, достигшие порога: [(message_id, уровень), ...]
+
+        Если пройдено сразу несколько порогов (например, бот был выключен),
+        эскалация идет только по старшему.
+        """
+        now = now or utcnow()
+        due = []
+
+        while True:
+            next_due = self.next_due()
+            if next_due is None or next_due > now:
+                break
+
+            _, message_id, level = heapq.heappop(self._heap)
+            while level < len(self.thresholds) and self.due_at(message_id, level + 1) <= now:
+                level += 1
+
+            self._levels[message_id] = level
+            self._schedule_next(message_id)
+            due.append((message_id, level))
+
+        return due
+
+    # ==================== ТАЙМЕР ====================
+
+    def _arm(self):
+        """Переставить run_once на ближайший порог"""
+        if self.job_queue is None:
+            return
+
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+
+        due = self.next_due()
+        self._armed_at = due
+        if due is None:
+            return
+
+        delay = max((due - utcnow()).total_seconds(), 0)
+        self._job = self.job_queue.run_once(self._fire, when=delay, name=self.JOB_NAME)
+
+    async def _fire(self, context):
+        """Эскалировать обращения, достигшие порога, и перезапустить таймер"""
+        self._job = None
+        self._armed_at = None
+
+        try:
+            due = self.pop_due()
+            if due:
+                await self._escalate(context.bot, due)
+        finally:
+            self._arm()
+
+    async def _escalate(self, bot, due: List[Tuple[int, int]]):
+        cursor = self.db.conn.cursor()
+
+        try:
+            cursor.executemany(
+                'UPDATE messages SET sla_level = ? WHERE id = ?',
+                [(level, message_id) for message_id, level in due]
+            )
+            self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка записи уровня SLA: {e}")
+            self.db.conn.rollback()
+
+        # Одно сообщение администратору на каждый уровень эскалации
+        by_level: Dict[int, List[int]] = defaultdict(list)
+        for message_id, level in due:
+            by_level[level].append(message_id)
+
+        now = utcnow()
+        limit_hours = f"{self.limit.total_seconds() / 3600:g} ч"
+        for level, message_ids in sorted(by_level.items()):
+            share = self.thresholds[level - 1]
+            header = (
+                f"🚨 Нарушен срок ответа ({limit_hours})"
+                if share >= 1 else
+                f"⚠️ Обращения без ответа: {share:.0%} срока ({limit_hours})"
+            )
+
+            lines = []
+            for message_id in sorted(message_ids)[:30]:
+                created = self._created.get(message_id)
+                waiting = (now - created).total_seconds() / 3600 if created else 0
+                lines.append(f"• #{message_id} - ждет {waiting:.1f} ч (/reply {message_id})")
+            if len(message_ids) > 30:
+                lines.append(f"... и еще {len(message_ids) - 30}")
+
+            text = header + "\n\n" + "\n".join(lines)
+            await self.db.outbound.send_many(bot, [(admin_id, text) for admin_id in config.ADMIN_IDS])
@@ -1,10 +1,26 @@
+import io
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-from models.task import Task
+from datetime import date, datetime, time, timedelta
+from typing import List, Dict, Iterable, Optional
+from models.task import Task, TASK_STATUSES, TASK_PRIORITIES
+from services.errors import VersionConflict
+from services.task_tracker import OPEN_STATUSES
 
 logger = logging.getLogger(__name__)
 
+# SET-часть смены статуса: фиксирует момент перехода, начало работы и завершение.
+# Параметры: статус четыре раза (см. status_params)
+STATUS_ASSIGNMENTS = """
+    status = ?,
+    status_changed_at = CASE WHEN status IS NOT ? THEN CURRENT_TIMESTAMP ELSE status_changed_at END,
+    started_at = CASE WHEN ? = 'in_progress' AND started_at IS NULL THEN CURRENT_TIMESTAMP ELSE started_at END,
+    completed_at = CASE WHEN ? = 'completed' THEN CURRENT_TIMESTAMP ELSE completed_at END
+"""
+
+def status_params(status: str) -> tuple:
+    return (status,) * 4
+
 class TaskService:
     def __init__(self, db):
         self.db = db
@@ -24,6 +40,7 @@ class TaskService:
             
             task_id = cursor.lastrowid
             self.db.conn.commit()
+            self._notify_trackers('track', task_id, assigned_to, priority, 'new', deadline)
             
             return self.get_task_by_id(task_id)
         except Exception as e:
@@ -41,6 +58,19 @@ class TaskService:
             return self._row_to_task(row)
         return None
     
+    def get_tasks_by_ids(self, task_ids: Iterable[int]) -> List[Task]:
+        """Получить задачи по списку ID (в порядке ID)"""
+        task_ids = list(task_ids)
+        if not task_ids:
+            return []
+        
+        cursor = self.db.conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM tasks WHERE id IN ({', '.join('?' * len(task_ids))}) ORDER BY id",
+            task_ids
+        )
+        return [self._row_to_task(row) for row in cursor.fetchall()]
+    
     def get_user_tasks(self, user_id: int, status: Optional[str] = None) -> List[Task]:
         """Получить задачи пользователя"""
         cursor = self.db.conn.cursor()
@@ -100,20 +130,136 @@ class TaskService:
         
         return [self._row_to_task(row) for row in cursor.fetchall()]
     
+    def get_team_task_previews(self, admin_id: int, limit: int = 3) -> List[Dict]:
+        """Открытые задачи команд пользователя: первые limit на команду и общее число
+        
+        Один запрос: team_members x tasks с нумерацией строк внутри каждой команды.
+        Возвращает [{'team_id', 'team_name', 'total', 'tasks': [Task, ...]}, ...].
+        """
+        cursor = self.db.conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT * FROM (
+                SELECT t.*, te.id AS team_id, te.name AS team_name, te.created_at AS team_created_at,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY te.id
+                           ORDER BY
+                               CASE t.priority
+                                   WHEN 'critical' THEN 1
+                                   WHEN 'high' THEN 2
+                                   WHEN 'medium' THEN 3
+                                   WHEN 'low' THEN 4
+                               END,
+                               t.deadline ASC, t.id
+                       ) AS rn,
+                       COUNT(*) OVER (PARTITION BY te.id) AS total
+                FROM team_members my
+                JOIN teams te ON te.id = my.team_id
+                JOIN team_members tm ON tm.team_id = my.team_id
+                JOIN tasks t ON t.assigned_to = tm.admin_id
+                WHERE my.admin_id = ? AND t.status IN ({', '.join('?' * len(OPEN_STATUSES))})
+            )
+            WHERE rn <= ?
+            ORDER BY team_created_at DESC, team_id DESC, rn
+        ''', (admin_id, *OPEN_STATUSES, limit))
+        
+        previews = []
+        for row in cursor.fetchall():
+            if not previews or previews[-1]['team_id'] != row['team_id']:
+                previews.append({
+                    'team_id': row['team_id'],
+                    'team_name': row['team_name'],
+                    'total': row['total'],
+                    'tasks': [],
+                })
+            previews[-1]['tasks'].append(self._row_to_task(row))
+        
+        return previews
+    
+    def get_status_previews(self, limit: int = 5) -> List[Dict]:
+        """Последние limit задач каждого статуса и общее число одним запросом
+        
+        Возвращает [{'status', 'total', 'tasks': [Task, ...]}, ...] в порядке TASK_STATUSES.
+        """
+        cursor = self.db.conn.cursor()
+        
+        cursor.execute('''
+            SELECT * FROM (
+                SELECT *,
+                       ROW_NUMBER() OVER (PARTITION BY status ORDER BY created_at DESC, id DESC) AS rn,
+                       COUNT(*) OVER (PARTITION BY status) AS total
+                FROM tasks
+            )
+            WHERE rn <= ?
+            ORDER BY status, rn
+        ''', (limit,))
+        
+        by_status: Dict[str, Dict] = {}
+        for row in cursor.fetchall():
+            preview = by_status.setdefault(
+                row['status'], {'status': row['status'], 'total': row['total'], 'tasks': []}
+            )
+            preview['tasks'].append(self._row_to_task(row))
+        
+        order = {status: position for position, status in enumerate(TASK_STATUSES)}
+        return sorted(by_status.values(), key=lambda preview: order.get(preview['status'], len(order)))
+    
+    def get_task_stats(self, scope: str = 'all', scope_id: int = 0, weeks: int = 8) -> Dict:
+        """Предрасчитанная аналитика задач по области (all / assignee / team)
+        
+        Возвращает среднее lead/cycle time (сек.), среднее время в каждом статусе
+        и число завершенных задач за последние weeks недель.
+        """
+        cursor = self.db.conn.cursor()
+        
+        cursor.execute(
+            'SELECT * FROM task_flow_stats WHERE scope = ? AND scope_id = ?',
+            (scope, scope_id)
+        )
+        flow = cursor.fetchone()
+        
+        cursor.execute('''
+            SELECT status, seconds_total / entries AS avg_seconds
+            FROM task_status_time
+            WHERE scope = ? AND scope_id = ? AND entries > 0
+        ''', (scope, scope_id))
+        time_in_status = {row['status']: row['avg_seconds'] for row in cursor.fetchall()}
+        
+        cursor.execute('''
+            SELECT week, completed FROM task_throughput
+            WHERE scope = ? AND scope_id = ?
+            ORDER BY week DESC
+            LIMIT ?
+        ''', (scope, scope_id, weeks))
+        throughput = [(row['week'], row['completed']) for row in cursor.fetchall()]
+        
+        completed = flow['completed_count'] if flow else 0
+        return {
+            'completed': completed,
+            'avg_lead_time': flow['lead_seconds_total'] / completed if completed else None,
+            'avg_cycle_time': (
+                flow['cycle_seconds_total'] / flow['cycle_count'] if flow and flow['cycle_count'] else None
+            ),
+            'time_in_status': time_in_status,
+            'throughput': throughput,
+        }
+    
     def update_task_status(self, task_id: int, status: str, user_id: int) -> bool:
         """Обновить статус задачи"""
         cursor = self.db.conn.cursor()
         
         try:
-            cursor.execute('''
+            cursor.execute(f'''
                 UPDATE tasks 
-                SET status = ?, updated_at = CURRENT_TIMESTAMP,
-                    completed_at = CASE WHEN ? = 'completed' THEN CURRENT_TIMESTAMP ELSE completed_at END
+                SET {STATUS_ASSIGNMENTS}, updated_at = CURRENT_TIMESTAMP, version = version + 1
                 WHERE id = ? AND assigned_to = ?
-            ''', (status, status, task_id, user_id))
+            ''', (*status_params(status), task_id, user_id))
             
             self.db.conn.commit()
-            return cursor.rowcount > 0
+            if cursor.rowcount > 0:
+                self._notify_trackers('on_status', task_id, status)
+                return True
+            return False
         except Exception as e:
             logger.error(f"Ошибка обновления задачи: {e}")
             self.db.conn.rollback()
@@ -126,17 +272,80 @@ class TaskService:
         try:
             cursor.execute('''
                 UPDATE tasks 
-                SET assigned_to = ?, updated_at = CURRENT_TIMESTAMP
+                SET assigned_to = ?, updated_at = CURRENT_TIMESTAMP, version = version + 1
                 WHERE id = ?
             ''', (assigned_to, task_id))
             
             self.db.conn.commit()
-            return cursor.rowcount > 0
+            if cursor.rowcount > 0:
+                self._notify_trackers('on_assign', task_id, assigned_to)
+                return True
+            return False
         except Exception as e:
             logger.error(f"Ошибка назначения задачи: {e}")
             self.db.conn.rollback()
             return False
     
+    def update_task_status_cas(self, task_id: int, status: str, user_id: int,
+                               expected_version: int) -> Optional[int]:
+        """Обновить статус, если версия задачи не изменилась (compare-and-set)
+        
+        Возвращает новую версию, None если задача не найдена или назначена
+        другому пользователю; при конфликте версий выбрасывает VersionConflict.
+        """
+        version = self._compare_and_set(
+            task_id, expected_version,
+            STATUS_ASSIGNMENTS, status_params(status),
+            'assigned_to = ?', (user_id,)
+        )
+        if version is not None:
+            self._notify_trackers('on_status', task_id, status)
+        return version
+    
+    def assign_task_cas(self, task_id: int, assigned_to: Optional[int],
+                        expected_version: int) -> Optional[int]:
+        """Назначить задачу, если версия не изменилась (compare-and-set)"""
+        version = self._compare_and_set(
+            task_id, expected_version,
+            'assigned_to = ?', (assigned_to,)
+        )
+        if version is not None:
+            self._notify_trackers('on_assign', task_id, assigned_to)
+        return version
+    
+    def _compare_and_set(self, task_id: int, expected_version: int, assignments: str,
+                         params: tuple, condition: str = '1=1',
+                         condition_params: tuple = ()) -> Optional[int]:
+        """Условное обновление задачи по версии"""
+        cursor = self.db.conn.cursor()
+        
+        try:
+            cursor.execute(f'''
+                UPDATE tasks
+                SET {assignments}, updated_at = CURRENT_TIMESTAMP, version = version + 1
+                WHERE id = ? AND version = ? AND {condition}
+            ''', (*params, task_id, expected_version, *condition_params))
+            
+            if cursor.rowcount > 0:
+                self.db.conn.commit()
+                return expected_version + 1
+            
+            cursor.execute(
+                f'SELECT version FROM tasks WHERE id = ? AND {condition}',
+                (task_id, *condition_params)
+            )
+            row = cursor.fetchone()
+            self.db.conn.rollback()
+        except Exception as e:
+            logger.error(f"Ошибка условного обновления задачи: {e}")
+            self.db.conn.rollback()
+            return None
+        
+        if row is None:
+            return None
+        
+        raise VersionConflict('task', task_id, expected_version, row['version'])
+    
     def delete_task(self, task_id: int, user_id: int) -> bool:
         """Удалить задачу (только создатель)"""
         cursor = self.db.conn.cursor()
@@ -146,12 +355,183 @@ class TaskService:
                           (task_id, user_id))
             
             self.db.conn.commit()
-            return cursor.rowcount > 0
+            if cursor.rowcount > 0:
+                self._notify_trackers('untrack', task_id)
+                return True
+            return False
         except Exception as e:
             logger.error(f"Ошибка удаления задачи: {e}")
             self.db.conn.rollback()
             return False
     
+    # ==================== МАССОВЫЕ ОПЕРАЦИИ ====================
+    
+    def bulk_create_tasks(self, tasks: Iterable[Task], created_by: int) -> int:
+        """Создать много задач одной транзакцией
+        
+        Создателем всегда записывается created_by (вызывающий), а не значение
+        из входных данных.
+        """
+        rows = [
+            (task.title, task.description, created_by, task.assigned_to,
+             task.priority if task.priority in TASK_PRIORITIES else 'medium',
+             task.status if task.status in TASK_STATUSES else 'new',
+             task.deadline)
+            for task in tasks if task.title
+        ]
+        
+        if not rows:
+            return 0
+        
+        cursor = self.db.conn.cursor()
+        
+        try:
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM tasks')
+            last_id = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO tasks
+                (title, description, created_by, assigned_to, priority, status, deadline)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            
+            # executemany не возвращает ID, но новые строки получают ID больше прежнего максимума
+            cursor.execute('SELECT id FROM tasks WHERE id > ?', (last_id,))
+            task_ids = [row['id'] for row in cursor.fetchall()]
+            self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка массового создания задач: {e}")
+            self.db.conn.rollback()
+            return 0
+        
+        self._notify_trackers('sync', task_ids)
+        return len(rows)
+    
+    def bulk_update_status(self, task_ids: Iterable[int], status: str, user_id: int) -> int:
+        """Сменить статус у многих задач одной транзакцией (только исполнитель или создатель)"""
+        task_ids = list(task_ids)
+        return self._bulk_update(f'''
+            UPDATE tasks
+            SET {STATUS_ASSIGNMENTS}, updated_at = CURRENT_TIMESTAMP, version = version + 1
+            WHERE id = ? AND status != ? AND (assigned_to = ? OR created_by = ?)
+        ''', [(*status_params(status), task_id, status, user_id, user_id) for task_id in task_ids], task_ids)
+    
+    def bulk_assign(self, task_ids: Iterable[int], assigned_to: Optional[int], user_id: int) -> int:
+        """Переназначить много задач одной транзакцией (только исполнитель или создатель)"""
+        task_ids = list(task_ids)
+        return self._bulk_update('''
+            UPDATE tasks
+            SET assigned_to = ?, updated_at = CURRENT_TIMESTAMP, version = version + 1
+            WHERE id = ? AND (assigned_to = ? OR created_by = ?)
+        ''', [(assigned_to, task_id, user_id, user_id) for task_id in task_ids], task_ids)
+    
+    def bulk_delete(self, task_ids: Iterable[int], user_id: int) -> int:
+        """Удалить много задач одной транзакцией (только создатель)"""
+        task_ids = list(task_ids)
+        return self._bulk_update(
+            'DELETE FROM tasks WHERE id = ? AND created_by = ?',
+            [(task_id, user_id) for task_id in task_ids], task_ids
+        )
+    
+    def _bulk_update(self, query: str, rows: List[tuple], task_ids: List[int]) -> int:
+        """executemany в одной транзакции; возвращает число затронутых строк"""
+        if not rows:
+            return 0
+        
+        cursor = self.db.conn.cursor()
+        
+        try:
+            cursor.executemany(query, rows)
+            self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка массового обновления задач: {e}")
+            self.db.conn.rollback()
+            return 0
+        
+        self._notify_trackers('sync', task_ids)
+        return cursor.rowcount
+    
+    def export_tasks_jsonl(self, stream, filters: Optional[Dict] = None,
+                           fetch_size: int = 500) -> int:
+        """Потоково выгрузить задачи в JSONL (бинарный поток)"""
+        query = "SELECT * FROM tasks WHERE 1=1"
+        params = []
+        
+        if filters:
+            for column in ('status', 'priority', 'assigned_to', 'created_by'):
+                if column in filters:
+                    query += f" AND {column} = ?"
+                    params.append(filters[column])
+        
+        query += " ORDER BY id"
+        
+        cursor = self.db.conn.cursor()
+        cursor.execute(query, params)
+        
+        count = 0
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            
+            for row in rows:
+                line = json.dumps(self._row_to_task(row).to_dict(), ensure_ascii=False)
+                stream.write(line.encode('utf-8') + b'\n')
+                count += 1
+        
+        return count
+    
+    def import_tasks_jsonl(self, stream, created_by: int, batch_size: int = 500) -> Dict[str, int]:
+        """Потоково загрузить задачи из JSONL (бинарный поток) пачками executemany"""
+        result = {'imported': 0, 'skipped': 0}
+        batch = []
+        
+        for line in io.TextIOWrapper(stream, encoding='utf-8'):
+            line = line.strip()
+            if not line:
+                continue
+            
+            try:
+                batch.append(Task.from_dict(json.loads(line)))
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.warning(f"Пропущена строка импорта задач: {e}")
+                result['skipped'] += 1
+                continue
+            
+            if len(batch) >= batch_size:
+                result['imported'] += self.bulk_create_tasks(batch, created_by)
+                batch = []
+        
+        if batch:
+            result['imported'] += self.bulk_create_tasks(batch, created_by)
+        
+        return result
+    
+    def get_due_tasks_by_assignee(self, day: date) -> Dict[int, List[Task]]:
+        """Открытые задачи с дедлайном в указанный день, сгруппированные по исполнителю
+        
+        Один запрос по диапазону idx_tasks_deadline.
+        """
+        cursor = self.db.conn.cursor()
+        cursor.execute('''
+            SELECT * FROM tasks
+            WHERE deadline >= ? AND deadline < ?
+              AND status NOT IN ('completed', 'cancelled')
+              AND assigned_to IS NOT NULL
+            ORDER BY assigned_to,
+                CASE priority
+                    WHEN 'critical' THEN 1
+                    WHEN 'high' THEN 2
+                    WHEN 'medium' THEN 3
+                    WHEN 'low' THEN 4
+                END,
+                deadline ASC
+        ''', (datetime.combine(day, time.min), datetime.combine(day + timedelta(days=1), time.min)))
+        
+        grouped: Dict[int, List[Task]] = {}
+        for row in cursor.fetchall():
+            grouped.setdefault(row['assigned_to'], []).append(self._row_to_task(row))
+        return grouped
+    
     def get_overdue_tasks(self) -> List[Task]:
         """Получить просроченные задачи"""
         cursor = self.db.conn.cursor()
@@ -159,12 +539,17 @@ class TaskService:
             SELECT * FROM tasks 
             WHERE status NOT IN ('completed', 'cancelled') 
             AND deadline IS NOT NULL 
-            AND deadline < CURRENT_TIMESTAMP
+            AND deadline < datetime('now', 'localtime')
             ORDER BY deadline ASC
         ''')
         
         return [self._row_to_task(row) for row in cursor.fetchall()]
     
+    def _notify_trackers(self, event: str, *args):
+        """Передать изменение задачи состояниям в памяти (загрузка, дедлайны)"""
+        for tracker in self.db.task_trackers:
+            getattr(tracker, event)(*args)
+    
     def _row_to_task(self, row) -> Task:
         """Преобразовать строку БД в объект Task"""
         return Task(
@@ -179,4 +564,5 @@ class TaskService:
             created_at=datetime.fromisoformat(row['created_at']) if row['created_at'] else None,
             updated_at=datetime.fromisoformat(row['updated_at']) if row['updated_at'] else None,
             completed_at=datetime.fromisoformat(row['completed_at']) if row['completed_at'] else None,
+            version=row['version'] or 1,
         )
\ No newline at end of file
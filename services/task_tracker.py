@@ -0,0 +1,82 @@
+# services/task_tracker.py
+import logging
+from abc import ABC, abstractmethod
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ('new', 'in_progress', 'review')
+
+class TaskTracker(ABC):
+    """Состояние в памяти, следующее за открытыми задачами
+
+    Загружается один раз из БД, дальше обновляется TaskService после commit
+    (Database.task_trackers). Наследники реализуют track/untrack/is_tracked.
+    """
+
+    # Дополнительное условие выборки при загрузке
+    SEED_CONDITION = '1=1'
+
+    def __init__(self, db):
+        self.db = db
+
+    def reset(self):
+        """Очистить состояние перед загрузкой"""
+
+    def reload(self):
+        """Перечитать открытые задачи из БД"""
+        self.reset()
+
+        cursor = self.db.conn.cursor()
+        cursor.execute(f'''
+            SELECT id, assigned_to, priority, status, deadline FROM tasks
+            WHERE status IN ({', '.join('?' * len(OPEN_STATUSES))}) AND {self.SEED_CONDITION}
+        ''', OPEN_STATUSES)
+        for row in cursor.fetchall():
+            self.track(row['id'], row['assigned_to'], row['priority'], row['status'], row['deadline'])
+
+    @abstractmethod
+    def track(self, task_id: int, assigned_to, priority: str, status: str, deadline=None):
+        """Учесть задачу с текущими полями"""
+
+    @abstractmethod
+    def untrack(self, task_id: int):
+        """Перестать учитывать задачу"""
+
+    @abstractmethod
+    def is_tracked(self, task_id: int) -> bool:
+        """Учитывается ли задача"""
+
+    def on_status(self, task_id: int, status: str):
+        """Статус задачи изменился"""
+        if status not in OPEN_STATUSES:
+            self.untrack(task_id)
+        elif not self.is_tracked(task_id):
+            # Задачу переоткрыли: остальные поля неизвестны без чтения строки
+            self.sync([task_id])
+
+    def on_assign(self, task_id: int, assigned_to):
+        """Задачу переназначили"""
+
+    def sync(self, task_ids: Iterable[int]):
+        """Перечитать указанные задачи (после массовых операций)
+
+        Задачи, которых нет или которые не проходят SEED_CONDITION, снимаются.
+        """
+        task_ids = list(task_ids)
+        found = set()
+        cursor = self.db.conn.cursor()
+
+        for start in range(0, len(task_ids), 500):
+            chunk = task_ids[start:start + 500]
+            cursor.execute(f'''
+                SELECT id, assigned_to, priority, status, deadline FROM tasks
+                WHERE id IN ({', '.join('?' * len(chunk))}) AND {self.SEED_CONDITION}
+            ''', chunk)
+            for row in cursor.fetchall():
+                found.add(row['id'])
+                self.track(row['id'], row['assigned_to'], row['priority'], row['status'], row['deadline'])
+
+        for task_id in task_ids:
+            if task_id not in found:
+                self.untrack(task_id)
@@ -2,6 +2,8 @@
 import logging
 from typing import List, Dict, Optional
 
+from services.errors import VersionConflict
+
 logger = logging.getLogger(__name__)
 
 class TeamService:
@@ -19,7 +21,12 @@ class TeamService:
                 name TEXT NOT NULL UNIQUE,
                 description TEXT,
                 leader_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                member_count INTEGER DEFAULT 0,
+                open_new INTEGER DEFAULT 0,
+                open_in_progress INTEGER DEFAULT 0,
+                open_review INTEGER DEFAULT 0,
+                overdue_count INTEGER DEFAULT 0
             )
         ''')
         
@@ -30,6 +37,7 @@ class TeamService:
                 admin_id INTEGER NOT NULL,
                 role TEXT DEFAULT 'member',
                 joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                version INTEGER DEFAULT 1,
                 UNIQUE(team_id, admin_id)
             )
         ''')
@@ -54,6 +62,7 @@ class TeamService:
                 self.add_team_member(team_id, leader_id, 'leader')
             
             self.db.conn.commit()
+            self.db.reference_cache.invalidate('teams')
             return team_id
         except Exception as e:
             logger.error(f"Ошибка создания команды: {e}")
@@ -66,39 +75,98 @@ class TeamService:
         
         try:
             cursor.execute('''
-                INSERT OR REPLACE INTO team_members (team_id, admin_id, role)
+                INSERT INTO team_members (team_id, admin_id, role)
                 VALUES (?, ?, ?)
+                ON CONFLICT(team_id, admin_id) DO UPDATE SET
+                    role = excluded.role,
+                    version = team_members.version + 1
             ''', (team_id, admin_id, role))
             
             self.db.conn.commit()
+            self.db.reference_cache.invalidate('teams')
             return True
         except Exception as e:
             logger.error(f"Ошибка добавления участника: {e}")
             self.db.conn.rollback()
             return False
     
-    def get_user_teams(self, admin_id):
-        """Получить команды пользователя"""
+    def get_team_member(self, team_id, admin_id) -> Optional[Dict]:
+        """Получить участника команды вместе с версией записи"""
         cursor = self.db.conn.cursor()
         
         cursor.execute('''
-            SELECT t.*, tm.role
-            FROM teams t
-            JOIN team_members tm ON t.id = tm.team_id
-            WHERE tm.admin_id = ?
-            ORDER BY t.created_at DESC
-        ''', (admin_id,))
+            SELECT team_id, admin_id, role, version
+            FROM team_members
+            WHERE team_id = ? AND admin_id = ?
+        ''', (team_id, admin_id))
         
-        return [dict(row) for row in cursor.fetchall()]
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    
+    def set_team_member_cas(self, team_id, admin_id, role,
+                            expected_version: Optional[int] = None) -> Optional[int]:
+        """Добавить участника или сменить роль, если запись не изменилась (compare-and-set)
+        
+        expected_version=None означает, что участника еще нет в команде.
+        Возвращает новую версию; при конфликте выбрасывает VersionConflict.
+        """
+        cursor = self.db.conn.cursor()
+        
+        try:
+            if expected_version is None:
+                cursor.execute('''
+                    INSERT INTO team_members (team_id, admin_id, role)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(team_id, admin_id) DO NOTHING
+                ''', (team_id, admin_id, role))
+            else:
+                cursor.execute('''
+                    UPDATE team_members
+                    SET role = ?, version = version + 1
+                    WHERE team_id = ? AND admin_id = ? AND version = ?
+                ''', (role, team_id, admin_id, expected_version))
+            
+            if cursor.rowcount > 0:
+                self.db.conn.commit()
+                self.db.reference_cache.invalidate('teams')
+                return (expected_version or 0) + 1
+            
+            self.db.conn.rollback()
+        except Exception as e:
+            logger.error(f"Ошибка условного обновления участника: {e}")
+            self.db.conn.rollback()
+            return None
+        
+        current = self.get_team_member(team_id, admin_id)
+        raise VersionConflict(
+            'team_member', (team_id, admin_id), expected_version,
+            current['version'] if current else None
+        )
+    
+    def get_team(self, team_id):
+        """Получить команду (из кэша справочников)"""
+        return self.db.reference_cache.get_team(team_id)
+    
+    def get_user_teams(self, admin_id):
+        """Получить команды пользователя (из кэша справочников)"""
+        return self.db.reference_cache.get_user_teams(admin_id)
     
     def get_team_members(self, team_id):
-        """Получить участников команды"""
+        """Получить участников команды (из кэша справочников)"""
+        return self.db.reference_cache.get_team_members(team_id)
+    
+    def get_team_overviews(self, admin_id) -> List[Dict]:
+        """Команды пользователя с ролью и счетчиками одним индексированным запросом"""
         cursor = self.db.conn.cursor()
         
         cursor.execute('''
-            SELECT admin_id as telegram_id, role
-            FROM team_members 
-            WHERE team_id = ?
-        ''', (team_id,))
+            SELECT t.id, t.name, t.description, t.leader_id, t.created_at, tm.role,
+                   t.member_count, t.open_new, t.open_in_progress, t.open_review,
+                   t.overdue_count
+            FROM team_members tm
+            JOIN teams t ON t.id = tm.team_id
+            WHERE tm.admin_id = ?
+            ORDER BY t.created_at DESC, t.id DESC
+        ''', (admin_id,))
         
-        return [dict(row) for row in cursor.fetchall()]
\ No newline at end of file
+        return [dict(row) for row in cursor.fetchall()]
@@ -0,0 +1,157 @@
+# services/update_dedup.py
+import logging
+from collections import deque
+from typing import List, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+
+logger = logging.getLogger(__name__)
+
+class UpdateDeduplicator:
+    """Защита от повторной обработки апдейтов по update_id
+
+    Апдейт считается обработанным только после того, как его прошли все
+    обработчики (mark_update в последней группе); если обработчик упал,
+    ID забывается и повторная доставка будет обработана заново. Пока
+    апдейт в работе, его копия отсеивается по памяти.
+
+    Последние capacity идентификаторов держатся в памяти (множество + очередь)
+    и в таблице processed_update_ids с ключом по порядковому номеру. Запись
+    в БД идет пакетом раз в UPDATE_DEDUP_FLUSH_INTERVAL секунд и при остановке.
+    """
+
+    # Группа обработчиков, выполняемая после всех остальных
+    MARK_GROUP = 100
+
+    def __init__(self, db, capacity: int = 10000):
+        self.db = db
+        self.capacity = capacity
+        self._seen = set()
+        self._order = deque()
+        self._in_progress = set()
+        self._failed = set()
+        self._pending: List[Tuple[int, int]] = []
+        self._next_seq = 0
+        self.duplicates = 0
+        self.setup_tables()
+        self._load()
+
+    def setup_tables(self):
+        """Создание таблицы обработанных апдейтов"""
+        cursor = self.db.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS processed_update_ids (
+                seq INTEGER PRIMARY KEY,
+                update_id INTEGER NOT NULL
+            )
+        ''')
+
+        # Перенос из прежнего кольца со слотами seq % capacity
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'processed_updates'")
+        if cursor.fetchone():
+            cursor.execute('''
+                INSERT OR IGNORE INTO processed_update_ids (seq, update_id)
+                SELECT seq, update_id FROM processed_updates
+            ''')
+            cursor.execute('DROP TABLE processed_updates')
+
+        self.db.conn.commit()
+
+    def _load(self):
+        """Загрузить последние capacity ID из БД при старте"""
+        cursor = self.db.conn.cursor()
+        cursor.execute('''
+            SELECT seq, update_id FROM (
+                SELECT seq, update_id FROM processed_update_ids ORDER BY seq DESC LIMIT ?
+            ) ORDER BY seq
+        ''', (self.capacity,))
+
+        for row in cursor.fetchall():
+            self._remember(row['update_id'])
+            self._next_seq = row['seq'] + 1
+
+        if self._seen:
+            logger.info(f"Загружено {len(self._seen)} обработанных update_id")
+
+    def _remember(self, update_id: int):
+        """Добавить ID в память, вытесняя самый старый"""
+        self._seen.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.capacity:
+            self._seen.discard(self._order.popleft())
+
+    # ==================== ОТМЕТКИ ====================
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """Проверить ID; True - если апдейт уже обработан или сейчас в работе"""
+        if update_id in self._seen or update_id in self._in_progress:
+            self.duplicates += 1
+            return True
+
+        self._in_progress.add(update_id)
+        return False
+
+    def mark_processed(self, update_id: int):
+        """Апдейт прошел все обработчики: запомнить его (упавший - забыть)"""
+        self._in_progress.discard(update_id)
+        if update_id in self._failed:
+            self._failed.discard(update_id)
+            return
+
+        self._remember(update_id)
+        self._pending.append((self._next_seq, update_id))
+        self._next_seq += 1
+
+    def mark_failed(self, update_id: int):
+        """Обработчик апдейта упал: повторная доставка будет обработана"""
+        if update_id in self._in_progress:
+            self._failed.add(update_id)
+
+    def flush(self) -> int:
+        """Записать накопленные отметки одним executemany и удалить вытесненные"""
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, []
+        cursor = self.db.conn.cursor()
+        try:
+            cursor.executemany(
+                'INSERT OR REPLACE INTO processed_update_ids (seq, update_id) VALUES (?, ?)',
+                pending
+            )
+            cursor.execute(
+                'DELETE FROM processed_update_ids WHERE seq < ?',
+                (self._next_seq - self.capacity,)
+            )
+            self.db.conn.commit()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить обработанные update_id: {e}")
+            self.db.conn.rollback()
+            self._pending = pending + self._pending
+            return 0
+
+        return len(pending)
+
+    # ==================== ОБРАБОТЧИКИ ====================
+
+    async def check_update(self, update, context):
+        """Обработчик группы -1: прерывает обработку повторного апдейта"""
+        if update.update_id is not None and self.is_duplicate(update.update_id):
+            logger.info(f"Пропущен повторный апдейт {update.update_id}")
+            raise ApplicationHandlerStop
+
+    async def mark_update(self, update, context):
+        """Обработчик группы MARK_GROUP: апдейт обработан"""
+        if update.update_id is not None:
+            self.mark_processed(update.update_id)
+
+    async def on_error(self, update, context):
+        """Обработчик ошибок приложения"""
+        logger.error(f"Ошибка при обработке апдейта: {context.error}", exc_info=context.error)
+        if isinstance(update, Update) and update.update_id is not None:
+            self.mark_failed(update.update_id)
+
+    async def flush_job(self, context):
+        """Периодическая задача JobQueue"""
+        self.flush()
@@ -0,0 +1,73 @@
+# services/user_cache.py
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+# SQL-вариант UserCache.is_banned: бан действует, пока не истек ban_until (локальное время)
+ACTIVE_BAN_SQL = "(is_banned = 1 AND ban_until IS NOT NULL AND ban_until > datetime('now', 'localtime'))"
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Разобрать метку времени из БД в наивный datetime (локальное время)"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        pass
+
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+class UserCache:
+    """LRU-кэш пользователей: ID в БД, профиль и разобранный срок бана"""
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self._users: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int) -> Optional[Dict]:
+        user = self._users.get(telegram_id)
+        if user is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._users.move_to_end(telegram_id)
+        return user
+
+    def put(self, row) -> Dict:
+        """Положить строку users в кэш (срок бана разбирается один раз)"""
+        user = {
+            'id': row['id'],
+            'username': row['username'],
+            'first_name': row['first_name'],
+            'last_name': row['last_name'],
+            'is_banned': bool(row['is_banned']),
+            'ban_until': parse_timestamp(row['ban_until']),
+        }
+
+        self._users[row['telegram_id']] = user
+        self._users.move_to_end(row['telegram_id'])
+        if len(self._users) > self.capacity:
+            self._users.popitem(last=False)
+        return user
+
+    def invalidate(self, telegram_id: int):
+        self._users.pop(telegram_id, None)
+
+    @staticmethod
+    def is_banned(user: Dict) -> bool:
+        """Действует ли бан пользователя сейчас"""
+        return bool(user['is_banned'] and user['ban_until'] and user['ban_until'] > datetime.now())
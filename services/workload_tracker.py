@@ -0,0 +1,121 @@
+# services/workload_tracker.py
+import heapq
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.task_tracker import OPEN_STATUSES, TaskTracker
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_WEIGHTS = {'low': 1, 'medium': 2, 'high': 3, 'critical': 5}
+
+class WorkloadTracker(TaskTracker):
+    """Загрузка исполнителей в памяти: сумма весов открытых задач по приоритету
+
+    Выбор наименее загруженного берется из кучи пула (команда или все
+    администраторы) без запросов к БД. Устаревшие элементы кучи
+    отбрасываются лениво.
+    """
+
+    ALL = 'all'  # ключ пула всех администраторов
+    SEED_CONDITION = 'assigned_to IS NOT NULL'
+
+    def __init__(self, db):
+        super().__init__(db)
+        self.reload()
+
+    def reset(self):
+        self._tasks: Dict[int, Tuple[int, int]] = {}  # task_id -> (исполнитель, вес)
+        self._load: Dict[int, int] = {}
+        self._heaps: Dict = {}
+        self._pools: Dict = {}
+
+    def load(self, admin_id: int) -> int:
+        """Текущая взвешенная загрузка исполнителя"""
+        return self._load.get(admin_id, 0)
+
+    # ==================== ОБНОВЛЕНИЕ ====================
+
+    def track(self, task_id: int, assigned_to: Optional[int], priority: str, status: str, deadline=None):
+        """Учесть задачу с текущими исполнителем, приоритетом и статусом"""
+        self.untrack(task_id)
+        if assigned_to is None or status not in OPEN_STATUSES:
+            return
+
+        weight = PRIORITY_WEIGHTS.get(priority, PRIORITY_WEIGHTS['medium'])
+        self._tasks[task_id] = (assigned_to, weight)
+        self._change_load(assigned_to, weight)
+
+    def untrack(self, task_id: int):
+        """Перестать учитывать задачу (закрыта или удалена)"""
+        tracked = self._tasks.pop(task_id, None)
+        if tracked:
+            self._change_load(tracked[0], -tracked[1])
+
+    def is_tracked(self, task_id: int) -> bool:
+        return task_id in self._tasks
+
+    def on_assign(self, task_id: int, assigned_to: Optional[int]):
+        """Задачу переназначили"""
+        tracked = self._tasks.pop(task_id, None)
+        if not tracked:
+            return
+
+        self._change_load(tracked[0], -tracked[1])
+        if assigned_to is not None:
+            self._tasks[task_id] = (assigned_to, tracked[1])
+            self._change_load(assigned_to, tracked[1])
+
+    def _change_load(self, admin_id: int, delta: int):
+        load = self._load.get(admin_id, 0) + delta
+        if load:
+            self._load[admin_id] = load
+        else:
+            self._load.pop(admin_id, None)
+
+        # Новое значение кладется во все кучи, где участвует исполнитель
+        for key, members in self._pools.items():
+            if admin_id in members:
+                heapq.heappush(self._heaps[key], (load, admin_id))
+
+    # ==================== ВЫБОР ====================
+
+    def least_loaded(self, key, members: Iterable[int]) -> Optional[int]:
+        """Наименее загруженный из пула members (при равенстве - меньший ID)"""
+        members = frozenset(members)
+        if not members:
+            return None
+
+        heap = self._heaps.get(key)
+        if self._pools.get(key) != members or len(heap) > 2 * len(members) + 16:
+            heap = [(self.load(admin_id), admin_id) for admin_id in members]
+            heapq.heapify(heap)
+            self._heaps[key] = heap
+            self._pools[key] = members
+
+        while heap:
+            load, admin_id = heap[0]
+            if self.load(admin_id) == load:
+                return admin_id
+            heapq.heappop(heap)  # устаревшая запись
+
+        return None
+
+    def pick(self, team_ids: Iterable[int] = ()) -> Optional[int]:
+        """Наименее загруженный участник указанных команд; без команд - среди всех администраторов"""
+        cache = self.db.reference_cache
+        candidates: List[int] = []
+
+        for team_id in team_ids:
+            admin_id = self.least_loaded(('team', team_id), cache.get_team_member_ids(team_id))
+            if admin_id is not None:
+                candidates.append(admin_id)
+
+        if not candidates:
+            admin_id = self.least_loaded(self.ALL, (admin['telegram_id'] for admin in cache.get_admins()))
+            if admin_id is not None:
+                candidates.append(admin_id)
+
+        if not candidates:
+            return None
+        return min(candidates, key=lambda admin_id: (self.load(admin_id), admin_id))
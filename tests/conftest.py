@@ -0,0 +1,21 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Чистая БД во временном каталоге"""
+    from database import Database
+
+    monkeypatch.setattr(config, 'DB_NAME', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(config, 'ENCRYPTION_KEY', 'test-encryption-key-0123456789abcdef')
+    database = Database()
+    yield database
+    database.close()
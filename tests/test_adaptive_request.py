@@ -0,0 +1,197 @@
+# tests/test_adaptive_request.py
+import asyncio
+import time
+
+import pytest
+from telegram.error import NetworkError, TimedOut
+from telegram.request import HTTPXRequest
+
+from services.adaptive_request import AdaptiveRequest, AimdLimiter
+
+
+def make_limiter(**kwargs) -> AimdLimiter:
+    params = dict(initial=4, minimum=1, maximum=8, latency_target=10.0)
+    params.update(kwargs)
+    return AimdLimiter(**params)
+
+
+def saturate(limiter: AimdLimiter):
+    """Занять все слоты, чтобы лимит мог расти"""
+    limiter.in_flight = int(limiter.limit)
+
+
+# ==================== ЛИМИТЕР ====================
+
+def test_success_grows_limit_additively():
+    limiter = make_limiter()
+    saturate(limiter)
+
+    limiter.on_success(time.monotonic())
+
+    assert limiter.limit == pytest.approx(4.25)
+    assert limiter.counters['success'] == 1
+
+
+def test_limit_grows_about_one_per_window():
+    limiter = make_limiter()
+    for _ in range(4):
+        saturate(limiter)
+        limiter.on_success(time.monotonic())
+
+    assert int(limiter.limit) == 4
+    assert 4.9 < limiter.limit < 5
+
+
+def test_success_does_not_grow_idle_limit():
+    limiter = make_limiter()
+    limiter.in_flight = 1
+
+    limiter.on_success(time.monotonic())
+
+    assert limiter.limit == 4
+
+
+def test_success_does_not_grow_above_latency_target():
+    limiter = make_limiter(latency_target=0.5)
+    saturate(limiter)
+
+    limiter.on_success(time.monotonic() - 1)
+
+    assert limiter.limit == 4
+
+
+def test_limit_capped_by_maximum():
+    limiter = make_limiter(initial=8)
+    saturate(limiter)
+
+    limiter.on_success(time.monotonic())
+
+    assert limiter.limit == 8
+
+
+@pytest.mark.parametrize('reason', ['retry_after', 'server_error', 'timeout'])
+def test_congestion_halves_limit(reason):
+    limiter = make_limiter()
+
+    limiter.on_congestion(reason, time.monotonic())
+
+    assert limiter.limit == 2
+    assert limiter.counters[reason] == 1
+    assert limiter.counters['decreases'] == 1
+
+
+def test_congestion_decreases_once_per_epoch():
+    limiter = make_limiter(initial=8)
+    started = time.monotonic()
+
+    limiter.on_congestion('retry_after', started)
+    limiter.on_congestion('retry_after', started)
+
+    assert limiter.limit == 4
+    assert limiter.counters['retry_after'] == 2
+    assert limiter.counters['decreases'] == 1
+
+    limiter.on_congestion('timeout', time.monotonic())
+    assert limiter.limit == 2
+
+
+def test_limit_not_below_minimum():
+    limiter = make_limiter(initial=1)
+
+    limiter.on_congestion('timeout', time.monotonic())
+
+    assert limiter.limit == 1
+
+
+def test_error_keeps_limit():
+    limiter = make_limiter()
+    saturate(limiter)
+
+    limiter.on_error()
+
+    assert limiter.limit == 4
+    assert limiter.counters['error'] == 1
+
+
+def test_acquire_waits_for_released_slot():
+    async def scenario():
+        limiter = make_limiter(initial=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        limiter.release()
+        await asyncio.wait_for(waiter, 1)
+        assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+# ==================== HTTP-ОТВЕТЫ ====================
+
+async def request(limiter: AimdLimiter, monkeypatch, result):
+    """Один запрос через AdaptiveRequest с подмененным ответом HTTPXRequest"""
+    async def fake_do_request(self, *args, **kwargs):
+        if isinstance(result, Exception):
+            raise result
+        return result, b'{}'
+
+    monkeypatch.setattr(HTTPXRequest, 'do_request', fake_do_request)
+    adaptive = AdaptiveRequest(limiter)
+    limiter.in_flight = int(limiter.limit) - 1  # с этим запросом лимит занят целиком
+    try:
+        return await adaptive.do_request('https://example.invalid', 'POST')
+    finally:
+        await adaptive.shutdown()
+
+
+@pytest.mark.parametrize('code', [200, 204])
+def test_2xx_grows_limit(code, monkeypatch):
+    limiter = make_limiter()
+
+    asyncio.run(request(limiter, monkeypatch, code))
+
+    assert limiter.limit > 4
+    assert limiter.counters['success'] == 1
+
+
+@pytest.mark.parametrize('code, reason', [(429, 'retry_after'), (500, 'server_error'), (502, 'server_error')])
+def test_congestion_codes_shrink_limit(code, reason, monkeypatch):
+    limiter = make_limiter()
+
+    asyncio.run(request(limiter, monkeypatch, code))
+
+    assert limiter.limit == 2
+    assert limiter.counters[reason] == 1
+
+
+@pytest.mark.parametrize('code', [400, 403, 404])
+def test_client_errors_keep_limit(code, monkeypatch):
+    limiter = make_limiter()
+
+    asyncio.run(request(limiter, monkeypatch, code))
+
+    assert limiter.limit == 4
+    assert limiter.counters['error'] == 1
+    assert limiter.counters['success'] == 0
+
+
+def test_timeout_shrinks_limit(monkeypatch):
+    limiter = make_limiter()
+
+    with pytest.raises(TimedOut):
+        asyncio.run(request(limiter, monkeypatch, TimedOut()))
+
+    assert limiter.limit == 2
+    assert limiter.counters['timeout'] == 1
+
+
+def test_network_error_keeps_limit(monkeypatch):
+    limiter = make_limiter()
+
+    with pytest.raises(NetworkError):
+        asyncio.run(request(limiter, monkeypatch, NetworkError('connection reset')))
+
+    assert limiter.limit == 4
+    assert limiter.counters['error'] == 1
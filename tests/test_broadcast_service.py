@@ -0,0 +1,28 @@
+# tests/test_broadcast_service.py
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+ADMIN = 777
+
+
+def test_broken_segment_fails_broadcast(db, monkeypatch):
+    send = AsyncMock()
+    monkeypatch.setattr(db.outbound, 'send', send)
+    bot = SimpleNamespace(edit_message_text=AsyncMock())
+
+    broadcast_id = db.broadcasts.create('Новости', ADMIN, 'cat:bug')
+    db.broadcasts.set_status_message(broadcast_id, ADMIN, 42)
+    # Выражение, сохраненное раньше, больше не разбирается
+    db.conn.execute("UPDATE broadcasts SET segment = 'unknown' WHERE id = ?", (broadcast_id,))
+    db.conn.commit()
+
+    asyncio.run(db.broadcasts.run(bot, broadcast_id))
+
+    broadcast = db.broadcasts.get(broadcast_id)
+    assert broadcast['status'] == 'failed'
+    assert broadcast['finished_at'] is not None
+    assert db.broadcasts.get_running_ids() == []
+    assert 'остановлена' in bot.edit_message_text.call_args.kwargs['text']
+    assert send.call_args.args[1] == ADMIN
+    assert 'ошибка в сегменте' in send.call_args.args[2]
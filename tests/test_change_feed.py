@@ -0,0 +1,113 @@
+# tests/test_change_feed.py
+import asyncio
+from types import SimpleNamespace
+
+from services.change_feed import ChangeFeed
+
+
+def log_size(db) -> int:
+    return db.conn.execute('SELECT COUNT(*) FROM change_log').fetchone()[0]
+
+
+def insert_message(db, user_id: int, category: str = 'bug', status: str = 'new') -> int:
+    """Обращение в обход Database.add_message (как при импорте или ручной правке)"""
+    cursor = db.conn.execute(
+        'INSERT INTO messages (user_id, text, category, status) VALUES (?, ?, ?, ?)',
+        (user_id, 'текст', category, status)
+    )
+    db.conn.commit()
+    return cursor.lastrowid
+
+
+# ==================== ЖУРНАЛ ====================
+
+def test_triggers_log_key_columns_without_text(db):
+    user_id = db.add_user(501)
+    message_id = insert_message(db, user_id)
+    db.conn.execute("UPDATE messages SET status = 'replied' WHERE id = ?", (message_id,))
+    db.conn.execute('DELETE FROM messages WHERE id = ?', (message_id,))
+    db.conn.commit()
+
+    events = ChangeFeed(db, 'test', tables=('messages',)).read_batch(after_id=0)
+
+    assert [event['operation'] for event in events] == ['insert', 'update', 'delete']
+    assert all(event['row_id'] == message_id for event in events)
+    assert events[1]['payload'] == {'user_id': user_id, 'category': 'bug', 'status': 'replied'}
+    assert 'text' not in events[0]['payload']
+
+
+def test_consume_resumes_from_stored_cursor(db):
+    user_id = db.add_user(502)
+    feed = ChangeFeed(db, 'test', tables=('messages',), batch_size=2)
+    feed.reset(feed.head())
+    first = [insert_message(db, user_id) for _ in range(3)]
+
+    seen = []
+    assert feed.consume(lambda events: seen.extend(event['row_id'] for event in events)) == 3
+    assert seen == first
+
+    # Новый экземпляр (перезапуск) продолжает с сохраненной позиции
+    second = insert_message(db, user_id)
+    restarted = ChangeFeed(db, 'test', tables=('messages',), batch_size=2)
+    seen.clear()
+    assert restarted.consume(lambda events: seen.extend(event['row_id'] for event in events)) == 1
+    assert seen == [second]
+
+
+def test_filtered_consumer_advances_past_other_tables(db):
+    feed = ChangeFeed(db, 'test', tables=('messages',))
+    db.conn.execute("INSERT INTO tasks (title, description, created_by) VALUES ('t', 'd', 1)")
+    db.conn.commit()
+
+    assert feed.consume(lambda events: None) == 0
+    assert feed.get_cursor() == feed.head()
+
+
+def test_prune_keeps_events_until_every_consumer_read_them(db):
+    user_id = db.add_user(503)
+    slow = ChangeFeed(db, 'slow')
+    fast = ChangeFeed(db, 'fast')
+    slow.reset(slow.head())
+    fast.reset(fast.head())
+    ChangeFeed.prune(db)
+
+    insert_message(db, user_id)
+    insert_message(db, user_id)
+    fast.consume(lambda events: None)
+
+    assert ChangeFeed.prune(db) == 0
+    assert log_size(db) == 2
+
+    slow.consume(lambda events: None, max_batches=1)
+    assert ChangeFeed.prune(db) == 0  # потребитель segment_index еще не прочитал
+
+    asyncio.run(db.segments.sync_job(SimpleNamespace()))
+    assert ChangeFeed.prune(db) == 2
+    assert log_size(db) == 0
+
+
+# ==================== ПОТРЕБИТЕЛЬ: СЕГМЕНТЫ ====================
+
+def test_segment_index_catches_up_on_direct_writes(db):
+    user_id = db.add_user(504)
+    message_id = insert_message(db, user_id, category='question')
+    db.conn.execute("UPDATE messages SET status = 'replied' WHERE id = ?", (message_id,))
+    db.conn.commit()
+
+    assert user_id not in db.segments.resolve('cat:question')
+
+    asyncio.run(db.segments.sync_job(SimpleNamespace()))
+
+    assert user_id in db.segments.resolve('cat:question&replied')
+    assert db.segments.feed.get_cursor() == db.segments.feed.head()
+
+
+def test_segment_index_reload_skips_logged_events(db):
+    user_id = db.add_user(505)
+    insert_message(db, user_id)
+
+    db.segments.reload()
+
+    assert user_id in db.segments.resolve('cat:bug')
+    assert db.segments.feed.read_batch() == []
+    assert ChangeFeed.prune(db) > 0
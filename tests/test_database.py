@@ -0,0 +1,45 @@
+# tests/test_database.py
+import pytest
+
+from config import Config, config
+from database import Database
+from utils.crypto import ENCRYPTED_PREFIX
+
+
+def test_refuses_default_key_with_encryption(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DB_NAME', str(tmp_path / 'test.db'))
+    # validate - метод класса, Database читает экземпляр
+    for target in (Config, config):
+        monkeypatch.setattr(target, 'ENABLE_ENCRYPTION', True)
+        monkeypatch.setattr(target, 'ENCRYPTION_KEY', Config.DEFAULT_ENCRYPTION_KEY)
+
+    with pytest.raises(ValueError):
+        Database()
+    assert not (tmp_path / 'test.db').exists()
+    assert not config.validate()
+
+
+def test_rows_saved_without_encryption_are_encrypted_later(db, monkeypatch):
+    monkeypatch.setattr(db, 'encrypt_at_rest', False)
+    message_id = db.add_message(3001, 'Текст без шифрования')['message_id']
+    row = db.conn.execute('SELECT text, text_hash FROM messages WHERE id = ?', (message_id,)).fetchone()
+    assert row['text'] == 'Текст без шифрования'
+    assert row['text_hash'] is not None
+
+    monkeypatch.setattr(db, 'encrypt_at_rest', True)
+    db.encrypt_legacy_rows()
+
+    row = db.conn.execute('SELECT text, text_hash FROM messages WHERE id = ?', (message_id,)).fetchone()
+    assert row['text'].startswith(ENCRYPTED_PREFIX)
+    assert db.cipher.decrypt(row['text'], b'messages') == 'Текст без шифрования'
+    assert row['text_hash'] == db.cipher.blind_index('Текст без шифрования')
+
+
+def test_encrypted_rows_are_left_alone(db):
+    message_id = db.add_message(3002, 'Уже зашифровано')['message_id']
+    before = db.conn.execute('SELECT text FROM messages WHERE id = ?', (message_id,)).fetchone()['text']
+
+    db.encrypt_legacy_rows()
+
+    after = db.conn.execute('SELECT text FROM messages WHERE id = ?', (message_id,)).fetchone()['text']
+    assert after == before
@@ -0,0 +1,166 @@
+# tests/test_deadline_scheduler.py
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from services.notification_service import NotificationService
+from services.task_service import TaskService
+
+ASSIGNEE = 2001
+
+
+class FakeJobQueue:
+    """JobQueue, запоминающая единственный run_once"""
+
+    def __init__(self):
+        self.callback = None
+
+    def run_once(self, callback, when, name=None):
+        self.callback = callback
+        return SimpleNamespace(schedule_removal=lambda: None)
+
+
+@pytest.fixture
+def scheduler(db, monkeypatch):
+    monkeypatch.setattr(NotificationService, 'notify_overdue', AsyncMock())
+    db.deadlines.start(FakeJobQueue())
+    return db.deadlines
+
+
+@pytest.fixture
+def service(db):
+    return TaskService(db)
+
+
+@pytest.fixture
+def team_id(db):
+    team_id = db.create_team('Команда')
+    db.add_team_member(team_id, ASSIGNEE)
+    return team_id
+
+
+def overdue_count(db, team_id: int) -> int:
+    return db.conn.execute('SELECT overdue_count FROM teams WHERE id = ?', (team_id,)).fetchone()[0]
+
+
+def notified_at(db, task_id: int):
+    return db.conn.execute('SELECT overdue_notified_at FROM tasks WHERE id = ?', (task_id,)).fetchone()[0]
+
+
+def fire(scheduler):
+    asyncio.run(scheduler._fire(SimpleNamespace(bot=None)))
+
+
+def expire(db, task_id: int):
+    """Дедлайн наступил с течением времени: строка не менялась, триггеры не сработали"""
+    db.conn.execute('UPDATE tasks SET is_overdue = 0 WHERE id = ?', (task_id,))
+    db.conn.execute(
+        'UPDATE teams SET overdue_count = overdue_count - 1 WHERE id IN '
+        '(SELECT team_id FROM team_members WHERE admin_id = ?)', (ASSIGNEE,)
+    )
+    db.conn.commit()
+
+
+# ==================== СЧЕТЧИКИ ====================
+
+def test_fired_deadline_counts_only_fired_tasks(db, scheduler, service, team_id):
+    past = datetime.now() - timedelta(minutes=1)
+    due = service.create_task('Просрочена', '', 1, assigned_to=ASSIGNEE, deadline=past)
+    other = service.create_task('Тоже', '', 1, assigned_to=ASSIGNEE, deadline=past)
+    expire(db, due.id)
+    expire(db, other.id)
+    assert overdue_count(db, team_id) == 0
+
+    assert db.mark_tasks_overdue([due.id]) == 1
+    assert overdue_count(db, team_id) == 1
+
+    # Повторное срабатывание не считает задачу дважды
+    assert db.mark_tasks_overdue([due.id]) == 0
+    assert overdue_count(db, team_id) == 1
+
+    # Завершение снимает ровно учтенное
+    service.update_task_status(due.id, 'completed', ASSIGNEE)
+    assert overdue_count(db, team_id) == 0
+
+
+def test_mark_skips_tasks_not_overdue(db, service, team_id):
+    task = service.create_task('Впереди', '', 1, assigned_to=ASSIGNEE,
+                               deadline=datetime.now() + timedelta(days=1))
+
+    assert db.mark_tasks_overdue([task.id]) == 0
+    assert overdue_count(db, team_id) == 0
+
+
+def test_alert_marks_task_and_counts_it(db, scheduler, service, team_id):
+    task = service.create_task('Просрочена', '', 1, assigned_to=ASSIGNEE,
+                               deadline=datetime.now() - timedelta(minutes=1))
+    expire(db, task.id)
+
+    fire(scheduler)
+
+    assert notified_at(db, task.id) is not None
+    assert overdue_count(db, team_id) == 1
+    NotificationService.notify_overdue.assert_awaited_once_with([task.id])
+    assert not scheduler.is_tracked(task.id)
+
+
+# ==================== ПОВТОРНЫЕ ОПОВЕЩЕНИЯ ====================
+
+def test_new_deadline_clears_notification(db, scheduler, service):
+    task = service.create_task('Задача', '', 1, assigned_to=ASSIGNEE,
+                               deadline=datetime.now() - timedelta(minutes=1))
+    fire(scheduler)
+    assert notified_at(db, task.id) is not None
+
+    later = datetime.now() + timedelta(days=1)
+    db.conn.execute('UPDATE tasks SET deadline = ? WHERE id = ?', (later, task.id))
+    db.conn.commit()
+    scheduler.sync([task.id])
+
+    assert notified_at(db, task.id) is None
+    assert scheduler.is_tracked(task.id)
+
+
+def test_reopened_task_alerts_again(db, scheduler, service):
+    task = service.create_task('Задача', '', 1, assigned_to=ASSIGNEE,
+                               deadline=datetime.now() - timedelta(minutes=1))
+    fire(scheduler)
+    service.update_task_status(task.id, 'completed', ASSIGNEE)
+
+    service.update_task_status(task.id, 'in_progress', ASSIGNEE)
+
+    assert notified_at(db, task.id) is None
+    assert scheduler.is_tracked(task.id)
+    fire(scheduler)
+    assert NotificationService.notify_overdue.await_count == 2
+
+
+def test_status_change_between_open_statuses_keeps_notification(db, scheduler, service):
+    task = service.create_task('Задача', '', 1, assigned_to=ASSIGNEE,
+                               deadline=datetime.now() - timedelta(minutes=1))
+    fire(scheduler)
+
+    service.update_task_status(task.id, 'review', ASSIGNEE)
+
+    assert notified_at(db, task.id) is not None
+    assert not scheduler.is_tracked(task.id)
+
+
+def test_restart_seeds_reopened_task(db, service):
+    task = service.create_task('Задача', '', 1, assigned_to=ASSIGNEE,
+                               deadline=datetime.now() - timedelta(minutes=1))
+    db.conn.execute('UPDATE tasks SET overdue_notified_at = CURRENT_TIMESTAMP WHERE id = ?', (task.id,))
+    db.conn.execute("UPDATE tasks SET status = 'completed' WHERE id = ?", (task.id,))
+    db.conn.commit()
+    db.deadlines.reload()
+    assert not db.deadlines.is_tracked(task.id)
+
+    # Переоткрыта в обход TaskService (до перезапуска)
+    db.conn.execute("UPDATE tasks SET status = 'new' WHERE id = ?", (task.id,))
+    db.conn.commit()
+    db.deadlines.reload()
+
+    assert db.deadlines.is_tracked(task.id)
@@ -0,0 +1,88 @@
+# tests/test_job_store.py
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+
+from telegram.ext import Application
+
+from services.job_store import SQLiteJobStore
+
+
+async def reminder(context):
+    """Колбэк задачи для тестов"""
+
+
+def make_application(db):
+    """Новый экземпляр бота с подключенным хранилищем (JobQueue держит приложение по weakref)"""
+    application = Application.builder().token('123:TEST').build()
+    store = SQLiteJobStore(db, flush_delay=0)
+    store.attach(application.job_queue, reminder)
+    return application, store
+
+
+def test_job_restored_after_restart(db):
+    async def first_run():
+        application, store = make_application(db)
+        job_queue = application.job_queue
+        await job_queue.start()
+        job_queue.run_repeating(
+            reminder, interval=timedelta(hours=1), first=timedelta(hours=1),
+            name='reminder', data={'chat': 42}, job_kwargs=store.job_kwargs('reminder')
+        )
+        next_run = job_queue.scheduler.get_job('reminder', SQLiteJobStore.ALIAS).next_run_time
+        await job_queue.stop()
+        return next_run
+
+    async def second_run():
+        application, store = make_application(db)
+        job_queue = application.job_queue
+        await job_queue.start()
+        try:
+            jobs = job_queue.get_jobs_by_name('reminder')
+            return [(job.callback, job.data, job.next_t) for job in jobs]
+        finally:
+            await job_queue.stop()
+
+    next_run = asyncio.run(first_run())
+    assert db.conn.execute('SELECT COUNT(*) FROM scheduled_jobs').fetchone()[0] == 1
+
+    assert asyncio.run(second_run()) == [(reminder, {'chat': 42}, next_run)]
+
+
+def schedule_daily(store, job_queue, data):
+    return job_queue.run_daily(
+        reminder, time=time(9, 0, tzinfo=timezone.utc), name='reminder', data=data,
+        job_kwargs=store.job_kwargs('reminder')
+    )
+
+
+def test_same_job_keeps_restored_run_time(db):
+    missed = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(minutes=5)
+
+    async def first_run():
+        application, store = make_application(db)
+        job_queue = application.job_queue
+        # Планировщик на паузе: пропущенный запуск не выполняется сразу
+        job_queue.scheduler.start(paused=True)
+        schedule_daily(store, job_queue, {'chat': 42})
+        # Запуск, пропущенный за время простоя
+        job_queue.scheduler.modify_job('reminder', SQLiteJobStore.ALIAS, next_run_time=missed)
+        job_queue.scheduler.shutdown(wait=False)
+
+    async def second_run(data):
+        application, store = make_application(db)
+        job_queue = application.job_queue
+        job_queue.scheduler.start(paused=True)
+        try:
+            schedule_daily(store, job_queue, data)
+            job = job_queue.scheduler.get_job('reminder', SQLiteJobStore.ALIAS)
+            return job.next_run_time, job.args[1].data
+        finally:
+            job_queue.scheduler.shutdown(wait=False)
+
+    asyncio.run(first_run())
+    assert asyncio.run(second_run({'chat': 42})) == (missed, {'chat': 42})
+
+    # Изменились данные - задача заменяется вместе со временем запуска
+    next_run, data = asyncio.run(second_run({'chat': 43}))
+    assert data == {'chat': 43}
+    assert next_run > missed
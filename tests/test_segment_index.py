@@ -0,0 +1,221 @@
+# tests/test_segment_index.py
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.segment_index import CHUNK_BITS, Bitmap, SegmentError
+
+BOUNDARY = 1 << CHUNK_BITS  # 65536 - первое значение второго чанка
+AROUND = [0, 1, BOUNDARY - 2, BOUNDARY - 1, BOUNDARY, BOUNDARY + 1, 2 * BOUNDARY - 1, 2 * BOUNDARY]
+
+
+# ==================== BITMAP ====================
+
+def test_add_and_contains_around_chunk_boundary():
+    bitmap = Bitmap.from_ids([BOUNDARY - 1, BOUNDARY, BOUNDARY + 1])
+
+    assert len(bitmap) == 3
+    for value in (BOUNDARY - 1, BOUNDARY, BOUNDARY + 1):
+        assert value in bitmap
+    for value in (0, BOUNDARY - 2, BOUNDARY + 2, 2 * BOUNDARY):
+        assert value not in bitmap
+
+
+def test_add_is_idempotent():
+    bitmap = Bitmap.from_ids([BOUNDARY, BOUNDARY])
+
+    assert len(bitmap) == 1
+
+
+def test_discard_around_chunk_boundary():
+    bitmap = Bitmap.from_ids([BOUNDARY - 1, BOUNDARY, BOUNDARY + 1])
+
+    bitmap.discard(BOUNDARY)
+    bitmap.discard(BOUNDARY + 5)  # отсутствующее значение
+    bitmap.discard(3 * BOUNDARY)  # отсутствующий чанк
+
+    assert list(bitmap) == [BOUNDARY - 1, BOUNDARY + 1]
+
+    bitmap.discard(BOUNDARY + 1)
+    assert list(bitmap) == [BOUNDARY - 1]
+    assert bitmap._chunks.keys() == {0}  # пустой чанк удален
+
+
+def test_iter_is_sorted_across_chunks():
+    values = [2 * BOUNDARY, BOUNDARY, 5, BOUNDARY - 1, BOUNDARY + 1]
+
+    assert list(Bitmap.from_ids(values)) == sorted(values)
+
+
+@pytest.mark.parametrize('after', [-1, 0, BOUNDARY - 2, BOUNDARY - 1, BOUNDARY, BOUNDARY + 1, 2 * BOUNDARY])
+def test_iter_after_around_chunk_boundary(after):
+    bitmap = Bitmap.from_ids(AROUND)
+
+    assert list(bitmap.iter_after(after)) == [value for value in AROUND if value > after]
+
+
+def test_set_operations_around_chunk_boundary():
+    left = Bitmap.from_ids([BOUNDARY - 1, BOUNDARY, 2 * BOUNDARY])
+    right = Bitmap.from_ids([BOUNDARY, BOUNDARY + 1])
+
+    assert list(left | right) == [BOUNDARY - 1, BOUNDARY, BOUNDARY + 1, 2 * BOUNDARY]
+    assert list(left & right) == [BOUNDARY]
+    assert list(left - right) == [BOUNDARY - 1, 2 * BOUNDARY]
+    assert list(right - left) == [BOUNDARY + 1]
+
+
+def test_set_operations_drop_empty_chunks():
+    left = Bitmap.from_ids([1, BOUNDARY])
+    right = Bitmap.from_ids([BOUNDARY])
+
+    assert (left & Bitmap.from_ids([1]))._chunks.keys() == {0}
+    assert (left - right)._chunks.keys() == {0}
+    assert len(right - left) == 0
+
+
+def test_operations_do_not_mutate_operands():
+    left = Bitmap.from_ids([1, BOUNDARY])
+    right = Bitmap.from_ids([BOUNDARY, BOUNDARY + 1])
+
+    left | right
+    left & right
+    left - right
+    copy = left.copy()
+    copy.add(7)
+
+    assert list(left) == [1, BOUNDARY]
+    assert list(right) == [BOUNDARY, BOUNDARY + 1]
+
+
+def test_matches_set_on_random_values():
+    rng = random.Random(49)
+    for _ in range(20):
+        a = {rng.randrange(3 * BOUNDARY) for _ in range(200)} | {BOUNDARY - 1, BOUNDARY}
+        b = {rng.randrange(3 * BOUNDARY) for _ in range(200)} | {BOUNDARY}
+        left, right = Bitmap.from_ids(a), Bitmap.from_ids(b)
+
+        assert list(left) == sorted(a)
+        assert len(left) == len(a)
+        assert list(left | right) == sorted(a | b)
+        assert list(left & right) == sorted(a & b)
+        assert list(left - right) == sorted(a - b)
+
+        after = rng.randrange(3 * BOUNDARY)
+        assert list(left.iter_after(after)) == sorted(v for v in a if v > after)
+
+
+# ==================== ВЫРАЖЕНИЯ ====================
+
+@pytest.fixture
+def segments(db):
+    """Индекс с заданными вручную атрибутами"""
+    index = db.segments
+    index.all = Bitmap.from_ids(range(1, 11))
+    index.flags['blocked'] = Bitmap.from_ids([1, 2])
+    index.flags['replied'] = Bitmap.from_ids([2, 3, 4])
+    index.categories = {
+        'bug': Bitmap.from_ids([3, 4, 5, 6]),
+        'question': Bitmap.from_ids([6, 7]),
+    }
+    return index
+
+
+def resolve(segments, expression):
+    return list(segments.resolve(expression))
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('all', list(range(1, 11))),
+    ('cat:bug', [3, 4, 5, 6]),
+    ('CAT:BUG', [3, 4, 5, 6]),
+    ('cat:unknown', []),
+    ('cat:bug|cat:question', [3, 4, 5, 6, 7]),
+    ('cat:bug&replied', [3, 4]),
+    ('cat:bug-replied', [5, 6]),
+    ('!blocked', list(range(3, 11))),
+    ('!!blocked', [1, 2]),
+    # & и - связывают сильнее |
+    ('blocked|cat:bug&replied', [1, 2, 3, 4]),
+    ('(blocked|cat:bug)&replied', [2, 3, 4]),
+    ('cat:question|cat:bug-replied', [5, 6, 7]),
+    # & и - одного приоритета, вычисляются слева направо
+    ('cat:bug-replied&cat:question', [6]),
+    ('cat:bug&cat:question-cat:question', []),
+    # ! относится к ближайшему множителю
+    ('!replied&cat:bug', [5, 6]),
+    ('!(replied|blocked)', [5, 6, 7, 8, 9, 10]),
+    (' cat:bug  &  ! replied ', [5, 6]),
+])
+def test_resolve(segments, expression, expected):
+    assert resolve(segments, expression) == expected
+
+
+@pytest.mark.parametrize('expression', [
+    '',
+    '   ',
+    'unknown',
+    'active:x',
+    'cat:bug&',
+    '&cat:bug',
+    'cat:bug||replied',
+    '!',
+    '(cat:bug',
+    '(cat:bug|replied',
+    'cat:bug)',
+    '()',
+    'cat:bug replied',
+    'cat:bug$replied',
+    'cat:bug,replied',
+])
+def test_resolve_rejects_malformed(segments, expression):
+    with pytest.raises(SegmentError):
+        segments.resolve(expression)
+
+
+def test_segment_error_is_value_error():
+    assert issubclass(SegmentError, ValueError)
+
+
+def test_banned_ignores_expired_bans(segments):
+    segments.set_ban(1, datetime.now() + timedelta(days=1))
+    segments.set_ban(2, datetime.now() - timedelta(days=1))
+
+    assert resolve(segments, 'banned') == [1]
+    assert resolve(segments, 'blocked-banned') == [2]
+
+    segments.set_ban(1, None)
+    assert resolve(segments, 'banned') == []
+
+
+# ==================== ЗАГРУЗКА ====================
+
+def test_reload_sees_unflushed_activity(db):
+    user_id = db.add_user(5001, 'old_user')
+    db.activity.flush()
+    db.conn.execute(
+        'UPDATE users SET last_activity = ?, blocked_bot = 1 WHERE id = ?',
+        (datetime.now() - timedelta(days=40), user_id)
+    )
+    db.conn.commit()
+
+    db.activity.touch(5001)
+    db.segments.reload()
+
+    assert user_id in db.segments.resolve('active:1')
+    assert user_id not in db.segments.flags['blocked']
+
+
+def test_reload_reads_flushed_activity(db):
+    user_id = db.add_user(5002, 'old_user')
+    db.activity.flush()
+    db.conn.execute(
+        'UPDATE users SET last_activity = ? WHERE id = ?',
+        (datetime.now() - timedelta(days=40), user_id)
+    )
+    db.conn.commit()
+
+    db.segments.reload()
+
+    assert user_id not in db.segments.resolve('active:30')
+    assert user_id in db.segments.resolve('active:60')
@@ -0,0 +1,181 @@
+# tests/test_task_service.py
+import asyncio
+import io
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from handlers.task_handlers import TaskHandlers
+from services.errors import VersionConflict
+from services.task_service import TaskService
+
+ASSIGNEE = 1001
+OTHER_USER = 1002
+
+
+@pytest.fixture
+def service(db):
+    return TaskService(db)
+
+
+@pytest.fixture
+def task(service):
+    return service.create_task('Отчет', 'Собрать отчет', created_by=1, assigned_to=ASSIGNEE)
+
+
+# ==================== COMPARE-AND-SET ====================
+
+def test_status_cas_bumps_version(service, task):
+    assert task.version == 1
+
+    assert service.update_task_status_cas(task.id, 'in_progress', ASSIGNEE, 1) == 2
+
+    stored = service.get_task_by_id(task.id)
+    assert stored.status == 'in_progress'
+    assert stored.version == 2
+
+
+def test_status_cas_rejects_stale_version(service, task):
+    service.update_task_status_cas(task.id, 'in_progress', ASSIGNEE, 1)
+
+    with pytest.raises(VersionConflict) as conflict:
+        service.update_task_status_cas(task.id, 'completed', ASSIGNEE, 1)
+
+    assert conflict.value.key == task.id
+    assert conflict.value.expected_version == 1
+    assert conflict.value.current_version == 2
+    stored = service.get_task_by_id(task.id)
+    assert stored.status == 'in_progress'
+    assert stored.version == 2
+
+
+def test_plain_update_invalidates_version(service, task):
+    service.update_task_status(task.id, 'review', ASSIGNEE)
+
+    with pytest.raises(VersionConflict):
+        service.update_task_status_cas(task.id, 'completed', ASSIGNEE, task.version)
+
+
+def test_status_cas_other_assignee(service, task):
+    assert service.update_task_status_cas(task.id, 'completed', OTHER_USER, 1) is None
+    assert service.update_task_status_cas(task.id + 100, 'completed', ASSIGNEE, 1) is None
+    assert service.get_task_by_id(task.id).version == 1
+
+
+def test_assign_cas_rejects_stale_version(service, task):
+    assert service.assign_task_cas(task.id, OTHER_USER, 1) == 2
+
+    with pytest.raises(VersionConflict):
+        service.assign_task_cas(task.id, ASSIGNEE, 1)
+    assert service.get_task_by_id(task.id).assigned_to == OTHER_USER
+
+
+# ==================== ОБРАБОТЧИК ====================
+
+def press(db, data: str, user_id: int = ASSIGNEE):
+    """Нажать кнопку смены статуса; возвращает мок query.answer"""
+    query = SimpleNamespace(data=data, answer=AsyncMock())
+    update = SimpleNamespace(
+        callback_query=query, effective_user=SimpleNamespace(id=user_id), message=None
+    )
+    asyncio.run(TaskHandlers(db).change_status(update, SimpleNamespace()))
+    return query.answer
+
+
+def test_status_button_changes_status(db, service, task):
+    answer = press(db, f'task_status:{task.id}:{task.version}:in_progress')
+
+    assert 'статус in_progress' in answer.call_args.args[0]
+    assert service.get_task_by_id(task.id).status == 'in_progress'
+
+
+def test_status_button_shows_conflict(db, service, task):
+    # Кнопка из списка, показанного до чужого изменения
+    service.update_task_status(task.id, 'review', ASSIGNEE)
+
+    answer = press(db, f'task_status:{task.id}:{task.version}:completed')
+
+    assert 'уже изменили' in answer.call_args.args[0]
+    assert answer.call_args.kwargs['show_alert'] is True
+    assert service.get_task_by_id(task.id).status == 'review'
+
+
+def test_status_button_other_assignee(db, service, task):
+    answer = press(db, f'task_status:{task.id}:{task.version}:completed', user_id=OTHER_USER)
+
+    assert 'назначена не вам' in answer.call_args.args[0]
+    assert service.get_task_by_id(task.id).status == 'new'
+
+
+# ==================== МАССОВЫЕ ОПЕРАЦИИ ====================
+
+def test_import_uses_caller_and_tracks_new_rows(db, service, task, monkeypatch):
+    for tracker in db.task_trackers:
+        monkeypatch.setattr(tracker, 'reload', lambda: pytest.fail('полная перезагрузка'))
+
+    lines = [
+        {'title': f'Импорт {i}', 'created_by': OTHER_USER, 'assigned_to': ASSIGNEE,
+         'deadline': '2099-01-01 10:00:00'}
+        for i in range(3)
+    ]
+    stream = io.BytesIO('\n'.join(json.dumps(line) for line in lines).encode('utf-8'))
+
+    assert service.import_tasks_jsonl(stream, ASSIGNEE, batch_size=2) == {'imported': 3, 'skipped': 0}
+
+    imported = db.conn.execute(
+        'SELECT id, created_by FROM tasks WHERE id > ?', (task.id,)
+    ).fetchall()
+    assert [row['created_by'] for row in imported] == [ASSIGNEE] * 3
+    assert all(db.deadlines.is_tracked(row['id']) for row in imported)
+
+
+def test_bulk_status_only_own_tasks(service, task):
+    foreign = service.create_task('Чужая', '', created_by=OTHER_USER, assigned_to=OTHER_USER)
+    created = service.create_task('Поручение', '', created_by=ASSIGNEE, assigned_to=OTHER_USER)
+
+    assert service.bulk_update_status([task.id, foreign.id, created.id], 'review', ASSIGNEE) == 2
+
+    assert service.get_task_by_id(task.id).status == 'review'
+    assert service.get_task_by_id(created.id).status == 'review'
+    assert service.get_task_by_id(foreign.id).status == 'new'
+
+
+def test_bulk_assign_only_own_tasks(service, task):
+    foreign = service.create_task('Чужая', '', created_by=OTHER_USER, assigned_to=OTHER_USER)
+
+    assert service.bulk_assign([task.id, foreign.id], OTHER_USER, ASSIGNEE) == 1
+
+    assert service.get_task_by_id(task.id).assigned_to == OTHER_USER
+    assert service.get_task_by_id(foreign.id).assigned_to == OTHER_USER
+    assert service.get_task_by_id(foreign.id).version == 1
+
+
+def test_bulk_assign_handler_rejects_non_admin(db, service, task):
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=ASSIGNEE),
+        message=SimpleNamespace(reply_text=AsyncMock()),
+    )
+    context = SimpleNamespace(args=[str(OTHER_USER), str(task.id)])
+
+    handler = TaskHandlers.bulk_assign.__wrapped__.__wrapped__
+    asyncio.run(handler(TaskHandlers(db), update, context))
+
+    assert 'только администратору' in update.message.reply_text.call_args.args[0]
+    assert service.get_task_by_id(task.id).assigned_to == ASSIGNEE
+
+
+# ==================== КОМАНДЫ ====================
+
+def test_team_previews_skip_closed_tasks(db, service, task):
+    team_id = db.create_team('Отчеты')
+    db.add_team_member(team_id, ASSIGNEE)
+    for status in ('completed', 'cancelled'):
+        closed = service.create_task(status, '', created_by=1, assigned_to=ASSIGNEE)
+        service.update_task_status(closed.id, status, ASSIGNEE)
+
+    previews = service.get_team_task_previews(ASSIGNEE)
+
+    assert [preview['total'] for preview in previews] == [1]
+    assert [t.id for t in previews[0]['tasks']] == [task.id]
@@ -0,0 +1,68 @@
+# utils/crypto.py
+import binascii
+import hashlib
+import hmac
+import os
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# Префикс зашифрованных значений: строки без него считаются открытым текстом
+ENCRYPTED_PREFIX = 'enc1:'
+NONCE_SIZE = 12
+
+
+class TextCipher:
+    """Шифрование текстов AES-GCM и слепой индекс HMAC-SHA256"""
+
+    def __init__(self, secret: str):
+        # Из одного секрета выводим два независимых ключа: для AEAD и для индекса
+        material = HKDF(
+            algorithm=hashes.SHA256(),
+            length=64,
+            salt=None,
+            info=b'enerje-lab/text-at-rest/v1',
+        ).derive(secret.encode('utf-8'))
+        self._aead = AESGCM(material[:32])
+        self._index_key = material[32:]
+
+    def encrypt(self, text: str, context: bytes = b'') -> str:
+        """Зашифровать текст (nonce генерируется для каждой строки)"""
+        nonce = os.urandom(NONCE_SIZE)
+        sealed = self._aead.encrypt(nonce, text.encode('utf-8'), context)
+        return ENCRYPTED_PREFIX + binascii.b2a_base64(nonce + sealed, newline=False).decode('ascii')
+
+    def decrypt(self, value: Optional[str], context: bytes = b'') -> Optional[str]:
+        """Расшифровать значение; открытый текст возвращается как есть
+
+        Расшифрованные тексты не кэшируются: открытый текст живет в памяти
+        только пока нужен вызывающему.
+        """
+        if not value or not value.startswith(ENCRYPTED_PREFIX):
+            return value
+
+        raw = binascii.a2b_base64(value[len(ENCRYPTED_PREFIX):])
+        try:
+            return self._aead.decrypt(raw[:NONCE_SIZE], raw[NONCE_SIZE:], context).decode('utf-8')
+        except InvalidTag:
+            raise ValueError("Не удалось расшифровать значение: неверный ключ или данные повреждены")
+
+    def decrypt_many(self, values: Iterable[Optional[str]], context: bytes = b'') -> List[Optional[str]]:
+        """Пакетная расшифровка для списков"""
+        decrypt = self.decrypt
+        return [decrypt(value, context) for value in values]
+
+    def blind_index(self, text: str) -> str:
+        """Слепой индекс для поиска по равенству без расшифровки"""
+        normalized = ' '.join(text.split()).casefold()
+        return hmac.new(self._index_key, normalized.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+@lru_cache(maxsize=1)
+def get_cipher(secret: str) -> TextCipher:
+    """Получить шифратор (ключи выводятся один раз на процесс)"""
+    return TextCipher(secret)
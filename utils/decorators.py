@@ -22,7 +22,7 @@ def admin_required(func):
         
         user_id = update.effective_user.id
         
-        if user_id not in config.ADMIN_IDS:
+        if not config.is_admin(user_id):
             await update.message.reply_text("⛔ Доступ запрещен.")
             return
         